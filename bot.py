@@ -1,9 +1,13 @@
 # bot.py
 import os
-import json
+import time
+import signal
 import asyncio
+import inspect
+import functools
 import datetime
 import discord
+from django.conf import settings
 from django.utils import timezone
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proj.settings')
@@ -11,24 +15,66 @@ import django
 django.setup()
 
 import datetime as _dt
-from decimal import Decimal
+from collections import OrderedDict
 
-from asgiref.sync import sync_to_async
-from django.db.models import F, Sum
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections, transaction
+from django.db.models import F
+from core import jobs, rollups, storage
 from core.models import (
-    KV, Daily, UserProfile,
-    VoiceUserDaily, VoiceUserTotal,
-    MessageUserDaily, MessageUserTotal,
-    VoiceChannel, VoiceChannelDaily, VoiceUserChannelDaily,
+    Daily, UserProfile,
+    VoiceUserTotal, MessageUserTotal,
+    VoiceChannel, VoiceSession,
 )
 
 # ====== ENV ======
-GS_SHEET_ID = os.getenv('GOOGLE_SHEETS_SPREADSHEET_ID', '').strip()
-GS_SA       = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON', '').strip()
-GUILD_ID    = int(os.getenv('GUILD_ID', '0') or 0)
-
-
-MAX_PIVOT_DATES = int(os.getenv('GS_MAX_PIVOT_DATES', '31'))
+# guilds to track: comma-separated ids, falls back to GUILD_ID; empty tracks every
+# guild the bot is in. Rows of each guild carry its id (core.models.guild_field).
+GUILD_IDS   = {int(x) for x in (os.getenv('GUILD_IDS', '') or os.getenv('GUILD_ID', '')).split(',')
+               if x.strip() not in ('', '0')}
+
+# sharding: BOT_SHARDED=1 runs an AutoShardedClient; BOT_SHARD_COUNT / BOT_SHARD_IDS
+# pin the layout when several processes split the shards, otherwise Discord picks it
+BOT_SHARDED     = os.getenv('BOT_SHARDED', '0') == '1'
+BOT_SHARD_COUNT = int(os.getenv('BOT_SHARD_COUNT', '0') or 0) or None
+BOT_SHARD_IDS   = [int(x) for x in os.getenv('BOT_SHARD_IDS', '').split(',') if x.strip()] or None
+
+
+# write-behind buffer for message counters: at most this much is lost on a crash
+MSG_FLUSH_MS     = int(os.getenv('MSG_FLUSH_MS', '1000'))
+MSG_FLUSH_EVENTS = int(os.getenv('MSG_FLUSH_EVENTS', '500'))
+
+# DB execution: ingestion writes run on BOT_DB_WORKERS lanes (one thread and one
+# connection each), export bookkeeping on its own lane
+BOT_DB_WORKERS = int(os.getenv('BOT_DB_WORKERS', '4'))
+
+# ingest queue between gateway handlers and storage: at most INGEST_QUEUE_SIZE
+# pending coalescing items (repeats for the same key merge and take no room); when
+# full, 'block' waits up to INGEST_BLOCK_TIMEOUT seconds and then drops, 'drop' drops
+# at once. 'block' parks the handler task itself, so while the queue is full the
+# waiting handlers pile up (each for up to the timeout) instead of the items.
+# Ordered kinds (the voice ledger) are never dropped and do not count toward the size.
+INGEST_QUEUE_SIZE    = int(os.getenv('INGEST_QUEUE_SIZE', '10000'))
+INGEST_OVERFLOW      = os.getenv('INGEST_OVERFLOW', 'block')
+INGEST_BLOCK_TIMEOUT = float(os.getenv('INGEST_BLOCK_TIMEOUT', '30'))
+
+# voice: how often in-flight sessions are credited and checkpointed; on restart a
+# session still open in the same channel resumes from its checkpoint if the gap is
+# below VOICE_RESUME_MAX_GAP seconds
+VOICE_FLUSH_SECONDS    = int(os.getenv('VOICE_FLUSH_SECONDS', '60'))
+VOICE_RESUME_MAX_GAP   = int(os.getenv('VOICE_RESUME_MAX_GAP', str(6 * 3600)))
+VOICE_LEDGER_KEEP_DAYS = int(os.getenv('VOICE_LEDGER_KEEP_DAYS', '30'))
+
+# rollups: a day is folded into the weekly/monthly tables once it is this many
+# minutes old, so message counts still buffered at midnight land first
+ROLLUP_GRACE_MINUTES = int(os.getenv('ROLLUP_GRACE_MINUTES', '15'))
+
+# members whose profile fingerprint is remembered (LRU)
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '250000'))
+
+# Prometheus text endpoint (GET /metrics) inside the bot process; 0 turns it off
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100') or 0)
 
 intents = discord.Intents.none()
 intents.guilds = True
@@ -37,7 +83,46 @@ intents.messages = True
 intents.message_content = True
 intents.voice_states = True
 
-client = discord.Client(intents=intents)
+class StatsClient(discord.AutoShardedClient if BOT_SHARDED else discord.Client):
+    def dispatch(self, event: str, /, *args, **kwargs):
+        if hasattr(self, 'on_' + event):
+            metrics.inc('bot_events_total', (('event', event),))
+        super().dispatch(event, *args, **kwargs)
+
+    async def setup_hook(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, lambda: asyncio.create_task(self.close()))
+            except NotImplementedError:
+                pass
+        ingest.start()
+        asyncio.create_task(msg_buffer.run())
+        asyncio.create_task(_voice_flusher(VOICE_FLUSH_SECONDS))
+        asyncio.create_task(_daily_noon_export())
+        asyncio.create_task(_export_status_refresher())
+        asyncio.create_task(_day_closer())
+        if METRICS_PORT:
+            await asyncio.start_server(_serve_metrics, METRICS_HOST, METRICS_PORT)
+
+    async def close(self):
+        # forced flush so buffered counters survive a clean shutdown;
+        # voice sessions stay open in the ledger and resume on the next start
+        await ingest.drain()
+        await msg_buffer.flush()
+        await _flush_all_voice()
+        await super().close()
+
+if BOT_SHARDED:
+    client = StatsClient(intents=intents, shard_count=BOT_SHARD_COUNT, shard_ids=BOT_SHARD_IDS)
+else:
+    client = StatsClient(intents=intents)
+
+def _tracked(guild) -> bool:
+    return guild is not None and (not GUILD_IDS or guild.id in GUILD_IDS)
+
+def _gid(guild) -> str:
+    return str(guild.id)
 
 # ============= time helpers =============
 def _today():
@@ -46,354 +131,617 @@ def _today():
 def _now():
     return timezone.now()
 
-# ============= sync DB helpers =============
-def kv_get_sync(key: str, default: str = '') -> str:
-    obj, _ = KV.objects.get_or_create(key=key, defaults={'val': default})
-    return obj.val
-
-def kv_set_sync(key: str, val: str):
-    KV.objects.update_or_create(key=key, defaults={'val': val})
-
-def kv_get_total_sync():
-    return int(kv_get_sync('messages_total', '0') or '0')
+# ============= metrics =============
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metrics:
+    """
+    Counters, histograms and callback gauges rendered in the Prometheus text format.
+    Labels are tuples of (name, value) pairs. Only touched from the event loop.
+    """
+
+    def __init__(self):
+        self._meta: dict[str, tuple[str, str]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._hists: dict[str, dict[tuple, list]] = {}
+        self._gauges: dict[str, object] = {}
+
+    def describe(self, name: str, kind: str, text: str):
+        self._meta[name] = (kind, text)
+
+    def inc(self, name: str, labels: tuple = (), by: float = 1):
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + by
+
+    def observe(self, name: str, labels: tuple, value: float):
+        # per-bucket counts, then sum and count; cumulated on render
+        h = self._hists.setdefault(name, {}).setdefault(labels, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+        for i, le in enumerate(LATENCY_BUCKETS):
+            if value <= le:
+                h[i] += 1
+                break
+        h[-2] += value
+        h[-1] += 1
+
+    def gauge(self, name: str, text: str, fn, kind: str = 'gauge'):
+        """Read at scrape time: fn() returns a number or a {labels: number} dict."""
+        self.describe(name, kind, text)
+        self._gauges[name] = fn
+
+    @staticmethod
+    def _fmt(name: str, labels: tuple, value) -> str:
+        lbl = ','.join(f'{k}="{str(v)}"' for k, v in labels)
+        return f"{name}{{{lbl}}} {float(value)!r}" if lbl else f"{name} {float(value)!r}"
+
+    def _head(self, out: list, name: str, kind: str):
+        text = self._meta.get(name, (kind, name))[1]
+        out.append(f"# HELP {name} {text}")
+        out.append(f"# TYPE {name} {kind}")
+
+    def render(self) -> str:
+        out: list[str] = []
+        for name, series in self._counters.items():
+            self._head(out, name, 'counter')
+            out += [self._fmt(name, labels, v) for labels, v in series.items()]
+        for name, series in self._hists.items():
+            self._head(out, name, 'histogram')
+            for labels, h in series.items():
+                acc = 0
+                for le, n in zip(LATENCY_BUCKETS, h):
+                    acc += n
+                    out.append(self._fmt(name + '_bucket', labels + (('le', le),), acc))
+                out.append(self._fmt(name + '_bucket', labels + (('le', '+Inf'),), h[-1]))
+                out.append(self._fmt(name + '_sum', labels, h[-2]))
+                out.append(self._fmt(name + '_count', labels, h[-1]))
+        for name, fn in self._gauges.items():
+            try:
+                v = fn()
+            except Exception:
+                continue
+            self._head(out, name, self._meta[name][0])
+            if isinstance(v, dict):
+                out += [self._fmt(name, labels, x) for labels, x in v.items()]
+            else:
+                out.append(self._fmt(name, (), v))
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics()
+metrics.describe('bot_events_total', 'counter', 'Gateway events dispatched to a handler, by event.')
+metrics.describe('bot_db_seconds', 'histogram', 'DB helper latency including the wait for its lane, by helper.')
+metrics.describe('bot_db_errors_total', 'counter', 'DB helper calls that raised, by helper.')
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, ctype, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode()
+        else:
+            status, ctype, body = '404 Not Found', 'text/plain', b'not found\n'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
 
-def kv_set_total_sync(v: int):
-    kv_set_sync('messages_total', str(v))
+# ============= sync DB helpers =============
+# every helper that writes stats takes the guild id (str) first
+def messages_total_sync(gid: str) -> int:
+    return storage.counter_get(gid, storage.MESSAGES_TOTAL)
 
-def ensure_daily_sync(members: int | None = None):
-    d = _today()
+def ensure_daily_sync(gid: str, members: int | None = None, d: _dt.date | None = None):
+    d = d or _today()
+    # a callable default only runs when the row is created, not on every call
     row, _ = Daily.objects.get_or_create(
-        date=d,
-        defaults={'members': members or 0, 'messages_total': kv_get_total_sync()},
+        guild_id=gid, date=d,
+        defaults={'members': members or 0, 'messages_total': lambda: messages_total_sync(gid)},
     )
     if members is not None and row.members != members:
-        Daily.objects.filter(pk=row.pk).update(members=members)
+        Daily.objects.filter(pk=row.pk).update(members=members, updated_at=_now())
+        storage.bump_version(gid)
 
-def inc_daily_sync(field: str, by: int = 1):
+def inc_daily_sync(gid: str, field: str, by: int = 1):
     d = _today()
-    ensure_daily_sync()
-    Daily.objects.filter(date=d).update(**{field: F(field) + by})
+    with transaction.atomic():
+        ensure_daily_sync(gid)
+        Daily.objects.filter(guild_id=gid, date=d).update(**{field: F(field) + by}, updated_at=_now())
+        storage.bump_version(gid)
 
-def upsert_profile_sync(member: discord.Member):
-    avatar_url = ''
+def _avatar_url(member) -> str:
     try:
         if getattr(member, 'avatar', None):
-            avatar_url = member.avatar.url
+            return member.avatar.url
         elif getattr(member, 'display_avatar', None):
-            avatar_url = member.display_avatar.url
+            return member.display_avatar.url
     except Exception:
         pass
-
-    obj, _ = UserProfile.objects.update_or_create(
-        user_id=str(member.id),
-        defaults=dict(
-            username=getattr(member, 'name', '') or '',
-            display_name=getattr(member, 'display_name', '') or '',
-            avatar_url=avatar_url or "https://cdn.discordapp.com/embed/avatars/0.png",
-            joined_at=getattr(member, 'joined_at', None),
-            is_bot=bool(getattr(member, 'bot', False)),
-        ),
+    return ''
+
+def _profile_fingerprint(member) -> int:
+    return hash((
+        getattr(member, 'name', '') or '',
+        getattr(member, 'display_name', '') or '',
+        _avatar_url(member),
+        getattr(member, 'joined_at', None),
+        bool(getattr(member, 'bot', False)),
+    ))
+
+def _profile_fields(member) -> dict:
+    return dict(
+        username=getattr(member, 'name', '') or '',
+        display_name=getattr(member, 'display_name', '') or '',
+        avatar_url=_avatar_url(member) or "https://cdn.discordapp.com/embed/avatars/0.png",
+        joined_at=getattr(member, 'joined_at', None),
+        is_bot=bool(getattr(member, 'bot', False)),
     )
-    VoiceUserTotal.objects.get_or_create(user=obj, defaults={'seconds': 0})
-    MessageUserTotal.objects.get_or_create(user=obj, defaults={'messages': 0})
 
-def upsert_channel_sync(ch: discord.abc.GuildChannel | None):
+def upsert_profile_sync(gid: str, member: discord.Member, ensure_totals: bool = True):
+    with transaction.atomic():
+        obj, _ = UserProfile.objects.update_or_create(
+            user_id=str(member.id),
+            defaults=_profile_fields(member),
+        )
+        if ensure_totals:
+            VoiceUserTotal.objects.get_or_create(guild_id=gid, user=obj, defaults={'seconds': 0})
+            MessageUserTotal.objects.get_or_create(guild_id=gid, user=obj, defaults={'messages': 0})
+        storage.bump_version(gid)
+
+def _channel_fields(ch) -> dict | None:
     if not ch:
-        return
+        return None
     t = str(getattr(ch, 'type', ''))
-    is_stage = (t == 'stage_voice')
     if t not in ('voice', 'stage_voice'):
-        return
-    VoiceChannel.objects.update_or_create(
-        channel_id=str(ch.id),
-        defaults={'name': getattr(ch, 'name', '') or '', 'is_stage': is_stage}
-    )
-
-def inc_message_user_sync(uid: str, by: int = 1):
-    tot, _ = MessageUserTotal.objects.get_or_create(user_id=uid, defaults={'messages': 0})
-    MessageUserTotal.objects.filter(pk=tot.pk).update(messages=F('messages') + by)
-    d = _today()
-    row, _ = MessageUserDaily.objects.get_or_create(date=d, user_id=uid, defaults={'messages': 0})
-    MessageUserDaily.objects.filter(pk=row.pk).update(messages=F('messages') + by)
+        return None
+    return {'channel_id': str(ch.id), 'name': getattr(ch, 'name', '') or '', 'is_stage': t == 'stage_voice'}
 
-def flush_voice_sync(uid: str, sec: int, channel_id: str | None):
-    if sec <= 0:
+def upsert_channel_sync(gid: str, ch: discord.abc.GuildChannel | None):
+    row = _channel_fields(ch)
+    if not row:
         return
+    with transaction.atomic():
+        VoiceChannel.objects.update_or_create(channel_id=row.pop('channel_id'), defaults={'guild_id': gid, **row})
+        storage.bump_version(gid)
+
+def bootstrap_sync(gid: str, member_count: int, channels: list[dict], profiles: dict[str, dict],
+                   in_voice: dict[str, str], at: _dt.datetime) -> dict[str, _dt.datetime]:
+    """Everything on_ready needs for one guild, in one transaction with multi-row upserts."""
+    with transaction.atomic():
+        ensure_daily_sync(gid, member_count)
+        storage.upsert_channels(gid, channels)
+        storage.upsert_profiles(gid, profiles)
+        storage.bump_version(gid)
+        return reconcile_voice_sessions_sync(gid, in_voice, at)
+
+def flush_voice_batch_sync(gid: str, batch: dict[str, tuple[int, str | None, _dt.datetime]]):
+    """batch: uid -> (seconds, channel_id, checkpoint); credits and checkpoints in one transaction."""
     d = _today()
-
-    Daily.objects.filter(date=d).update(voice_seconds=F('voice_seconds') + sec)
-
-    row, _ = VoiceUserDaily.objects.get_or_create(date=d, user_id=uid, defaults={'seconds': 0})
-    VoiceUserDaily.objects.filter(pk=row.pk).update(seconds=F('seconds') + sec)
-    tot, _ = VoiceUserTotal.objects.get_or_create(user_id=uid, defaults={'seconds': 0})
-    VoiceUserTotal.objects.filter(pk=tot.pk).update(seconds=F('seconds') + sec)
-
-    if channel_id:
-        ch, _ = VoiceChannel.objects.get_or_create(channel_id=str(channel_id), defaults={'name': '', 'is_stage': False})
-        chrow, _ = VoiceChannelDaily.objects.get_or_create(date=d, channel_id=ch.channel_id, defaults={'seconds': 0})
-        VoiceChannelDaily.objects.filter(pk=chrow.pk).update(seconds=F('seconds') + sec)
-
-        urow, _ = VoiceUserChannelDaily.objects.get_or_create(
-            date=d, channel_id=ch.channel_id, user_id=uid, defaults={'seconds': 0}
-        )
-        VoiceUserChannelDaily.objects.filter(pk=urow.pk).update(seconds=F('seconds') + sec)
+    with transaction.atomic():
+        ensure_daily_sync(gid, d=d)
+        storage.apply_voice_deltas(gid, [(uid, ch_id, d, sec) for uid, (sec, ch_id, _) in batch.items()])
+        storage.bump_version(gid)
+        storage.checkpoint_voice_sessions(gid, {uid: (ch_id, ckpt) for uid, (_, ch_id, ckpt) in batch.items()})
+
+def voice_session_open_sync(gid: str, uid: str, channel_id: str, at: _dt.datetime):
+    with transaction.atomic():
+        # the profile / channel upsert may still be queued, or have been dropped
+        storage.insert_missing_profiles([uid])
+        storage.insert_missing_channels(gid, [channel_id])
+        VoiceSession.objects.filter(guild_id=gid, user_id=uid, ended_at__isnull=True).update(ended_at=at)
+        VoiceSession.objects.create(guild_id=gid, user_id=uid, channel_id=channel_id,
+                                    joined_at=at, last_checkpoint=at)
+
+def voice_session_close_sync(gid: str, uid: str, sec: int, channel_id: str | None, at: _dt.datetime,
+                             credited_to: _dt.datetime, new_channel_id: str | None = None):
+    """Credit the tail of a stay and close it; with new_channel_id it is a move."""
+    with transaction.atomic():
+        if sec > 0:
+            ensure_daily_sync(gid)
+            storage.apply_voice_deltas(gid, [(uid, channel_id, _today(), sec)])
+            storage.bump_version(gid)
+        VoiceSession.objects.filter(guild_id=gid, user_id=uid, ended_at__isnull=True)\
+            .update(ended_at=at, last_checkpoint=credited_to)
+        if new_channel_id:
+            storage.insert_missing_channels(gid, [new_channel_id])
+            VoiceSession.objects.create(guild_id=gid, user_id=uid, channel_id=new_channel_id,
+                                        joined_at=at, last_checkpoint=at)
+
+def reconcile_voice_sessions_sync(gid: str, current: dict[str, str], at: _dt.datetime) -> dict[str, _dt.datetime]:
+    """
+    Match open ledger rows of a guild against the gateway's voice states (uid -> channel_id).
+    Returns uid -> time already credited to, for every member in `current`.
+    Stays that ended while the bot was down are closed at their last checkpoint.
+    """
+    start: dict[str, _dt.datetime] = {}
+    open_rows = VoiceSession.objects.filter(guild_id=gid, ended_at__isnull=True)
+    with transaction.atomic():
+        resumed = []
+        for row in open_rows.order_by('joined_at'):
+            gap = (at - row.last_checkpoint).total_seconds()
+            if current.get(row.user_id) == row.channel_id and 0 <= gap <= VOICE_RESUME_MAX_GAP:
+                start[row.user_id] = row.last_checkpoint
+                resumed.append(row.pk)
+        open_rows.exclude(pk__in=resumed).update(ended_at=F('last_checkpoint'))
+        VoiceSession.objects.bulk_create([
+            VoiceSession(guild_id=gid, user_id=uid, channel_id=ch, joined_at=at, last_checkpoint=at)
+            for uid, ch in current.items() if uid not in start
+        ])
+        VoiceSession.objects.filter(guild_id=gid, ended_at__lt=at - _dt.timedelta(days=VOICE_LEDGER_KEEP_DAYS))\
+            .delete()
+    for uid in current:
+        start.setdefault(uid, at)
+    return start
+
+def flush_messages_sync(gid: str, days: dict[_dt.date, tuple[dict[str, int], dict[str, int]]]):
+    """days: date -> ({uid: messages}, {Daily field: delta}) of one guild, written in one transaction."""
+    with transaction.atomic():
+        # Daily.messages_total is seeded before this batch is counted, as before
+        for d in sorted(days):
+            ensure_daily_sync(gid, d=d)
+        storage.counter_add(gid, storage.MESSAGES_TOTAL,
+                            sum(sum(per_user.values()) for per_user, _ in days.values()))
+        for d, (per_user, daily) in sorted(days.items()):
+            storage.apply_message_deltas(gid, d, per_user, daily)
+        storage.bump_version(gid)
+
+# ===== DB execution
+def _run_db_job(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        # drop a broken connection so this lane reconnects on its next job
+        for conn in connections.all(initialized_only=True):
+            if conn.connection is not None and not conn.is_usable():
+                conn.close()
+        raise
+
+class DBExecutor:
+    """
+    N single-thread lanes, each with its own Django connection. Jobs with the same
+    key always land on the same lane, so they run in submission order.
+    """
+
+    def __init__(self, workers: int, name: str):
+        self._lanes = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{name}-{i}')
+            for i in range(max(workers, 1))
+        ]
+
+    def lane(self, key) -> ThreadPoolExecutor:
+        return self._lanes[hash(key) % len(self._lanes)]
+
+    async def run(self, key, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.lane(key), functools.partial(_run_db_job, fn, *args, **kwargs))
+
+    def shutdown(self):
+        for lane in self._lanes:
+            lane.shutdown(wait=True)
+
+db_pool     = DBExecutor(BOT_DB_WORKERS, 'db')
+export_pool = DBExecutor(1, 'export')
+
+def _on(pool: DBExecutor, fn, key=None):
+    """Async wrapper for a sync helper; key(*args) picks the lane, default is one lane per helper."""
+    name = fn.__name__.removeprefix('_').removesuffix('_sync')
+    labels = (('helper', name),)
+
+    async def run(*args, **kwargs):
+        t0 = time.monotonic()
+        try:
+            return await pool.run(key(*args) if key else fn.__name__, fn, *args, **kwargs)
+        except Exception:
+            metrics.inc('bot_db_errors_total', labels)
+            raise
+        finally:
+            metrics.observe('bot_db_seconds', labels, time.monotonic() - t0)
+    run.__name__ = name
+    return run
+
+# lanes: a user's jobs by (guild, user), guild-wide jobs by guild, so a busy guild
+# keeps to its own lanes
+_by_user  = lambda gid, uid, *a, **kw: (gid, uid)
+_by_guild = lambda name: (lambda gid, *a, **kw: (name, gid))
 
 # ===== async wrappers
-ensure_daily     = sync_to_async(ensure_daily_sync, thread_sensitive=True)
-inc_daily        = sync_to_async(inc_daily_sync, thread_sensitive=True)
-upsert_profile   = sync_to_async(upsert_profile_sync, thread_sensitive=True)
-upsert_channel   = sync_to_async(upsert_channel_sync, thread_sensitive=True)
-inc_message_user = sync_to_async(inc_message_user_sync, thread_sensitive=True)
-kv_get_total     = sync_to_async(kv_get_total_sync, thread_sensitive=True)
-kv_set_total     = sync_to_async(kv_set_total_sync, thread_sensitive=True)
-kv_get           = sync_to_async(kv_get_sync, thread_sensitive=True)
-kv_set           = sync_to_async(kv_set_sync, thread_sensitive=True)
-flush_voice      = sync_to_async(flush_voice_sync, thread_sensitive=True)
+ensure_daily     = _on(db_pool, ensure_daily_sync, key=_by_guild('daily'))
+inc_daily        = _on(db_pool, inc_daily_sync, key=_by_guild('daily'))
+_upsert_profile  = _on(db_pool, upsert_profile_sync, key=lambda gid, member, *a, **kw: (gid, str(member.id)))
+upsert_channel   = _on(db_pool, upsert_channel_sync, key=_by_guild('channel'))
+flush_messages   = _on(db_pool, flush_messages_sync, key=_by_guild('messages'))
+flush_voice_batch   = _on(db_pool, flush_voice_batch_sync, key=_by_guild('voice'))
+voice_session_open  = _on(db_pool, voice_session_open_sync, key=_by_user)
+voice_session_close = _on(db_pool, voice_session_close_sync, key=_by_user)
+bootstrap        = _on(db_pool, bootstrap_sync, key=_by_guild('voice'))
+close_days       = _on(db_pool, rollups.close_days, key=_by_guild('rollup'))
 
 # ============= runtime state =============
-# uid -> (start_dt, channel_id)
-voice_start: dict[str, tuple[datetime.datetime, str | None]] = {}
+class ProfileCache:
+    """
+    LRU of (guild id, uid) -> profile fingerprint hash. An entry also means the profile
+    and that guild's totals rows are in the DB. Entries are ints, so 250k members is a few MB.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._fps: OrderedDict[tuple[str, str], int] = OrderedDict()
+
+    def get(self, uid: tuple[str, str]) -> int | None:
+        fp = self._fps.get(uid)
+        if fp is not None:
+            self._fps.move_to_end(uid)
+        return fp
+
+    def put(self, uid: tuple[str, str], fp: int):
+        self._fps[uid] = fp
+        self._fps.move_to_end(uid)
+        while len(self._fps) > self.size:
+            self._fps.popitem(last=False)
+
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE)
+
+async def upsert_profile(gid: str, member: discord.Member):
+    key = (gid, str(member.id))
+    fp = _profile_fingerprint(member)
+    known = profile_cache.get(key)
+    if known == fp:
+        return
+    await _upsert_profile(gid, member, ensure_totals=known is None)
+    profile_cache.put(key, fp)
 
-def _add_local_delta(uid: str) -> tuple[int, str | None]:
-    t = voice_start.get(uid)
+# (guild id, uid) -> (start_dt, channel_id)
+voice_start: dict[tuple[str, str], tuple[datetime.datetime, str | None]] = {}
+
+def _add_local_delta(key: tuple[str, str], now: _dt.datetime | None = None) -> tuple[int, str | None]:
+    """Take the whole seconds accrued since the last credit; the start moves by exactly that much."""
+    t = voice_start.get(key)
     if not t:
         return 0, None
     start_dt, ch_id = t
-    sec = int((_now() - start_dt).total_seconds())
+    sec = int(((now or _now()) - start_dt).total_seconds())
     if sec > 0:
-        voice_start[uid] = (_now(), ch_id)
+        voice_start[key] = (start_dt + _dt.timedelta(seconds=sec), ch_id)
     return max(sec, 0), ch_id
 
-# ============= Google Sheets export (PIVOT) =============
-def _gs_log(*args):
-    print("[GSHEETS]", *args, flush=True)
-
-def _col_idx_to_letter(idx: int) -> str:
-    s = ""
-    while idx > 0:
-        idx, r = divmod(idx - 1, 26)
-        s = chr(65 + r) + s
-    return s
-
-def _load_service_account():
-    if not (GS_SHEET_ID and GS_SA):
-        _gs_log("NO CREDS: GOOGLE_SHEETS_SPREADSHEET_ID or GOOGLE_SERVICE_ACCOUNT_JSON is empty")
-        return None, None
-    import gspread
-    from google.oauth2.service_account import Credentials
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    if GS_SA.strip().startswith('{'):
-        info = json.loads(GS_SA)
-        creds = Credentials.from_service_account_info(info, scopes=scopes)
-    else:
-        creds = Credentials.from_service_account_file(GS_SA, scopes=scopes)
-    gc = gspread.authorize(creds)
-    return creds, gc
-
-def _ws_upsert(sh, title):
-    try:
-        return sh.worksheet(title)
-    except Exception:
-        return sh.add_worksheet(title=title, rows=1000, cols=26)
-
-def _ensure_pivot_sheet_with_header(sh, title: str, base_header: list[str]):
-
-    ws = _ws_upsert(sh, title)
-    vals = ws.get_all_values() or []
-    if not vals:
-        ws.update(values=[base_header], range_name='A1')
-    return ws
-
-def _trim_old_date_columns(ws, base_cols_count: int):
-
-    header = ws.row_values(1) or []
-    if len(header) <= base_cols_count:
-        return
-    date_cols = header[base_cols_count:]
-    if len(date_cols) <= MAX_PIVOT_DATES:
-        return
-   
-    to_remove = len(date_cols) - MAX_PIVOT_DATES
-
-    start = base_cols_count       
-    end   = base_cols_count + to_remove  
-    ws.spreadsheet.batch_update({
-        "requests": [{
-            "deleteDimension": {
-                "range": {
-                    "sheetId": ws.id,
-                    "dimension": "COLUMNS",
-                    "startIndex": start,
-                    "endIndex": end
-                }
-            }
-        }]
-    })
-
-def _pivot_incremental_sync(export_date: _dt.date):
-
-    date_str = str(export_date)
-    _gs_log(f"INCREMENTAL: start for {date_str}")
-    creds, gc = _load_service_account()
-    if not gc:
-        _gs_log("INCREMENTAL: aborted — no creds")
-        return
-    sh = gc.open_by_key(GS_SHEET_ID)
-
-    # ===== USERS PIVOT =====
-    base_users_header = ['user_id', 'username', 'total_hours']
-    ws = _ensure_pivot_sheet_with_header(sh, "VoiceUsersPivot", base_users_header)
-    header = ws.row_values(1) or base_users_header
-
-   
-    if date_str not in header:
-        ws.update(values=[header + [date_str]], range_name='1:1')
-        _trim_old_date_columns(ws, base_cols_count=len(base_users_header))
-        header = ws.row_values(1) or base_users_header
-
-    col_total = 3 
-    col_date  = header.index(date_str) + 1
-
-    values = ws.get_all_values() or [header]
-    uid_to_row = {}
-    for i in range(2, len(values) + 1):
-        row = values[i - 1]
-        if row and len(row) >= 1 and row[0].strip():
-            uid_to_row[row[0].strip()] = i
-
-    last_row = max(uid_to_row.values()) if uid_to_row else 1
-    if last_row >= 2:
-        col_letter = _col_idx_to_letter(col_date)
-        ws.spreadsheet.values_update(
-            f"VoiceUsersPivot!{col_letter}2:{col_letter}{last_row}",
-            params={"valueInputOption": "RAW"},
-            body={"values": [[0.0]] * (last_row - 1)},
-        )
-
-
-    day_map = {
-        str(r['user_id']): round((int(r['sec'] or 0))/3600, 2)
-        for r in VoiceUserDaily.objects.filter(date=export_date).values('user_id').annotate(sec=Sum('seconds'))
-    }
-
-    totals = {
-        str(r['user_id']): round((int(r['sec'] or 0))/3600, 2)
-        for r in VoiceUserTotal.objects.values('user_id').annotate(sec=Sum('seconds'))
-    }
-    usernames = {str(p['user_id']): (p.get('username') or '')
-                 for p in UserProfile.objects.values('user_id', 'username')}
-
-
-    updates = []
-    for uid, hours in day_map.items():
-        if uid in uid_to_row:
-            rnum = uid_to_row[uid]
-            updates.append({"range": f"VoiceUsersPivot!{_col_idx_to_letter(col_date)}{rnum}",
-                            "majorDimension": "ROWS", "values": [[hours]]})
-            updates.append({"range": f"VoiceUsersPivot!{_col_idx_to_letter(col_total)}{rnum}",
-                            "majorDimension": "ROWS", "values": [[totals.get(uid, 0.0)]]})
-    if updates:
-        ws.spreadsheet.values_batch_update(body={"valueInputOption": "RAW", "data": updates})
-
-
-    width = len(header)
-    new_rows = []
-    for uid, hours in day_map.items():
-        if uid not in uid_to_row:
-            row = [''] * width
-            row[0] = uid
-            row[1] = usernames.get(uid, '')
-            row[2] = totals.get(uid, 0.0)
-
-            for c in range(4, width + 1):
-                row[c - 1] = 0.0
-            row[col_date - 1] = hours
-            new_rows.append(row)
-    if new_rows:
-        ws.append_rows(new_rows, value_input_option="RAW", table_range="A1")
-
-    _gs_log(f"INCREMENTAL: UsersPivot set {len(day_map)} values for {date_str} (+{len(new_rows)} new rows)")
-
-    # ===== CHANNELS PIVOT =====
-    base_ch_header = ['channel_id', 'channel_name', 'total_hours']
-    ws = _ensure_pivot_sheet_with_header(sh, "VoiceChannelsPivot", base_ch_header)
-    header = ws.row_values(1) or base_ch_header
-
-    if date_str not in header:
-        ws.update(values=[header + [date_str]], range_name='1:1')
-        _trim_old_date_columns(ws, base_cols_count=len(base_ch_header))
-        header = ws.row_values(1) or base_ch_header
-
-    col_total = 3
-    col_date  = header.index(date_str) + 1
-
-    values = ws.get_all_values() or [header]
-    cid_to_row = {}
-    for i in range(2, len(values) + 1):
-        row = values[i - 1]
-        if row and len(row) >= 1 and row[0].strip():
-            cid_to_row[row[0].strip()] = i
-
-    last_row = max(cid_to_row.values()) if cid_to_row else 1
-    if last_row >= 2:
-        col_letter = _col_idx_to_letter(col_date)
-        ws.spreadsheet.values_update(
-            f"VoiceChannelsPivot!{col_letter}2:{col_letter}{last_row}",
-            params={"valueInputOption": "RAW"},
-            body={"values": [[0.0]] * (last_row - 1)},
-        )
-
-    day_map = {
-        str(r['channel_id']): round((int(r['sec'] or 0))/3600, 2)
-        for r in VoiceChannelDaily.objects.filter(date=export_date).values('channel_id').annotate(sec=Sum('seconds'))
-    }
-    totals = {
-        str(r['channel_id']): round((int(r['sec'] or 0))/3600, 2)
-        for r in VoiceChannelDaily.objects.values('channel_id').annotate(sec=Sum('seconds'))
-    }
-    names = {str(c['channel_id']): (c.get('name') or '')
-             for c in VoiceChannel.objects.values('channel_id', 'name')}
-
-    updates = []
-    for cid, hours in day_map.items():
-        if cid in cid_to_row:
-            rnum = cid_to_row[cid]
-            updates.append({"range": f"VoiceChannelsPivot!{_col_idx_to_letter(col_date)}{rnum}",
-                            "majorDimension": "ROWS", "values": [[hours]]})
-            updates.append({"range": f"VoiceChannelsPivot!{_col_idx_to_letter(col_total)}{rnum}",
-                            "majorDimension": "ROWS", "values": [[totals.get(cid, 0.0)]]})
-    if updates:
-        ws.spreadsheet.values_batch_update(body={"valueInputOption": "RAW", "data": updates})
-
-    width = len(header)
-    new_rows = []
-    for cid, hours in day_map.items():
-        if cid not in cid_to_row:
-            row = [''] * width
-            row[0] = cid
-            row[1] = names.get(cid, '')
-            row[2] = totals.get(cid, 0.0)
-            for c in range(4, width + 1):
-                row[c - 1] = 0.0
-            row[col_date - 1] = hours
-            new_rows.append(row)
-    if new_rows:
-        ws.append_rows(new_rows, value_input_option="RAW", table_range="A1")
-
-    _gs_log(f"INCREMENTAL: ChannelsPivot set {len(day_map)} values for {date_str} (+{len(new_rows)} new rows)")
-    _gs_log("INCREMENTAL: done")
-
-pivot_incremental = sync_to_async(_pivot_incremental_sync, thread_sensitive=True)
-
-
-async def _settle_voice_until(cutoff_dt: _dt.datetime):
-    cutoff_dt = cutoff_dt.astimezone(timezone.get_current_timezone())
-    for uid, (start_dt, ch_id) in list(voice_start.items()):
-        if ch_id and start_dt < cutoff_dt:
-            sec = int((cutoff_dt - start_dt).total_seconds())
-            if sec > 0:
-                await flush_voice(uid, sec, ch_id)
-                voice_start[uid] = (cutoff_dt, ch_id)
+class MessageBuffer:
+    """
+    Write-behind accumulator for message counters.
+
+    Per-user and Daily deltas are merged in memory per guild and day and written
+    every `flush_ms` or after `flush_events` events, one transaction per guild, so a
+    crash loses at most that window. The first event of a new day forces a flush.
+    """
+
+    def __init__(self, flush_ms: int, flush_events: int):
+        self.flush_ms = flush_ms
+        self.flush_events = flush_events
+        self.day: _dt.date | None = None
+        # (guild, date, uid) -> messages ; (guild, date, Daily field) -> delta
+        self.per_user: dict[tuple[str, _dt.date, str], int] = {}
+        self.daily: dict[tuple[str, _dt.date, str], int] = {}
+        self.events = 0
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    def _merge(self, per_user: dict, daily: dict):
+        for k, by in per_user.items():
+            self.per_user[k] = self.per_user.get(k, 0) + by
+        for k, by in daily.items():
+            self.daily[k] = self.daily.get(k, 0) + by
+
+    def add_message(self, gid: str, uid: str, by: int = 1):
+        d = _today()
+        if self.day != d:
+            if self.day is not None:
+                self._wake.set()
+            self.day = d
+        self._merge({(gid, d, uid): by}, {(gid, d, 'messages'): by})
+        self.events += 1
+        if self.events >= self.flush_events:
+            self._wake.set()
+
+    async def flush(self):
+        async with self._lock:
+            per_user, daily = self.per_user, self.daily
+            if not per_user and not daily:
+                return
+            self.per_user, self.daily, self.events = {}, {}, 0
+            guilds: dict[str, dict[_dt.date, tuple[dict[str, int], dict[str, int]]]] = {}
+            for (gid, d, uid), by in per_user.items():
+                guilds.setdefault(gid, {}).setdefault(d, ({}, {}))[0][uid] = by
+            for (gid, d, f), by in daily.items():
+                guilds.setdefault(gid, {}).setdefault(d, ({}, {}))[1][f] = by
+            gids = list(guilds)
+            results = await asyncio.gather(*(flush_messages(gid, guilds[gid]) for gid in gids),
+                                           return_exceptions=True)
+            for gid, r in zip(gids, results):
+                if isinstance(r, Exception):
+                    print(f"[BUFFER] message flush for guild {gid} failed, will retry:", repr(r), flush=True)
+                    self._merge({k: v for k, v in per_user.items() if k[0] == gid},
+                                {k: v for k, v in daily.items() if k[0] == gid})
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+msg_buffer = MessageBuffer(MSG_FLUSH_MS, MSG_FLUSH_EVENTS)
+
+class _Pending:
+    __slots__ = ('merged', 'ordered', 'since')
+
+    def __init__(self):
+        self.merged: dict[str, object] = {}
+        self.ordered: list[tuple[str, object]] = []
+        self.since = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return len(self.merged) + len(self.ordered)
+
+class IngestQueue:
+    """
+    Bounded queue of DB work keyed by user (or guild, channel).
+
+    Kinds registered with `combine` coalesce: a second item of that kind for a key
+    that is still pending merges into the first and takes no room. Other kinds keep
+    their order. A key is always served by the same consumer, which runs its merged
+    kinds in registration order and then its ordered items.
+
+    Only coalescing items count toward `capacity` and can be dropped on overflow.
+    Ordered items carry state that cannot be rebuilt later (a voice session closing
+    with its credited seconds), so they are always admitted.
+    """
+
+    def __init__(self, capacity: int, workers: int, overflow: str = 'block', block_timeout: float | None = None):
+        self.capacity = capacity
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._kinds: dict[str, tuple] = {}
+        self._parts: list[OrderedDict] = [OrderedDict() for _ in range(max(workers, 1))]
+        self._wake = [asyncio.Event() for _ in self._parts]
+        self._space = asyncio.Event()
+        self._busy = 0
+        self.depth = 0      # all pending items
+        self.bounded = 0    # pending coalescing items, held to capacity
+        self.stats = {'enqueued': 0, 'coalesced': 0, 'dropped': 0, 'processed': 0, 'errors': 0}
+
+    def kind(self, name: str, run, combine=None):
+        self._kinds[name] = (run, combine)
+
+    def lag(self) -> float:
+        """Age in seconds of the oldest pending item."""
+        oldest = [next(iter(p.values())).since for p in self._parts if p]
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    async def _wait_space(self) -> bool:
+        if self.overflow == 'drop':
+            return False
+        deadline = time.monotonic() + self.block_timeout if self.block_timeout else None
+        while self.bounded >= self.capacity:
+            self._space.clear()
+            timeout = deadline - time.monotonic() if deadline else None
+            if timeout is not None and timeout <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._space.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def put(self, key, kind: str, payload) -> bool:
+        _, combine = self._kinds[kind]
+        i = hash(key) % len(self._parts)
+        part = self._parts[i]
+        entry = part.get(key)
+        if combine and (entry is None or kind not in entry.merged):
+            if self.bounded >= self.capacity and not await self._wait_space():
+                self.stats['dropped'] += 1
+                return False
+            entry = part.get(key)
+        if entry is None:
+            entry = part[key] = _Pending()
+        if combine and kind in entry.merged:
+            entry.merged[kind] = combine(entry.merged[kind], payload)
+            self.stats['coalesced'] += 1
+            return True
+        if combine:
+            entry.merged[kind] = payload
+            self.bounded += 1
+        else:
+            entry.ordered.append((kind, payload))
+        self.depth += 1
+        self.stats['enqueued'] += 1
+        self._wake[i].set()
+        return True
+
+    async def _run(self, key, kind: str, payload):
+        try:
+            r = self._kinds[kind][0](key, payload)
+            if inspect.isawaitable(r):
+                await r
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"[INGEST] {kind} for {key!r} failed:", repr(e), flush=True)
+
+    async def _consume(self, i: int):
+        part, wake = self._parts[i], self._wake[i]
+        while True:
+            if not part:
+                wake.clear()
+                await wake.wait()
+                continue
+            key, entry = part.popitem(last=False)
+            self._busy += 1
+            try:
+                for kind in self._kinds:
+                    if kind in entry.merged:
+                        await self._run(key, kind, entry.merged[kind])
+                for kind, payload in entry.ordered:
+                    await self._run(key, kind, payload)
+            finally:
+                self._busy -= 1
+                self.depth -= entry.size
+                self.bounded -= len(entry.merged)
+                self.stats['processed'] += entry.size
+                self._space.set()
+
+    def start(self):
+        for i in range(len(self._parts)):
+            asyncio.create_task(self._consume(i))
+
+    async def drain(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while (self.depth or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+ingest = IngestQueue(INGEST_QUEUE_SIZE, BOT_DB_WORKERS, INGEST_OVERFLOW, INGEST_BLOCK_TIMEOUT)
+
+def _sum_dicts(a: dict, b: dict) -> dict:
+    return {k: a.get(k, 0) + b.get(k, 0) for k in a.keys() | b.keys()}
+
+async def _run_daily(key, deltas: dict):
+    for field, by in deltas.items():
+        await inc_daily(key[0], field, by)
+
+# keys are (guild id, uid), (guild id, 'guild') or (guild id, 'ch', channel id)
+ingest.kind('profile', lambda key, member: upsert_profile(key[0], member), combine=lambda old, new: new)
+ingest.kind('channel', lambda key, ch: upsert_channel(key[0], ch), combine=lambda old, new: new)
+ingest.kind('message', lambda key, n: msg_buffer.add_message(key[0], key[1], n), combine=lambda a, b: a + b)
+ingest.kind('daily', _run_daily, combine=_sum_dicts)
+ingest.kind('members', lambda key, n: ensure_daily(key[0], n), combine=lambda old, new: new)
+ingest.kind('voice', lambda key, job: job[0](*job[1], **job[2]))
+
+# ============= exports (run by `manage.py export_worker`) =============
+def enqueue_export_sync(export_date: _dt.date):
+    # the spreadsheet holds one guild: the default one (GUILD_ID)
+    jobs.enqueue(jobs.SHEETS_PIVOT, settings.DEFAULT_GUILD_ID, export_date)
+
+enqueue_export = _on(export_pool, enqueue_export_sync)
+export_status  = _on(export_pool, jobs.status_summary)
+
+def enqueue_snapshot_sync(gid: str, through: _dt.date):
+    jobs.enqueue(jobs.XLSX_SNAPSHOT, gid, through)
+
+enqueue_snapshot = _on(export_pool, enqueue_snapshot_sync)
+
+# export queue as seen by the worker, refreshed for the metrics endpoint
+export_stats = {'pending': 0, 'last_outcome': '', 'last_duration': 0.0, 'last_finished': 0.0}
+
+async def _export_status_refresher(period: int = 60):
+    while True:
+        try:
+            export_stats.update(await export_status())
+        except Exception as e:
+            print("[EXPORT] status refresh failed:", repr(e), flush=True)
+        await asyncio.sleep(period)
 
 
 async def _daily_noon_export():
@@ -407,113 +755,216 @@ async def _daily_noon_export():
 
 
         try:
-            export_date = _today() - datetime.timedelta(days=1)
-            await pivot_incremental(export_date)
+            await enqueue_export(_today() - datetime.timedelta(days=1))
         except Exception as e:
-            print("[GSHEETS] noon export failed:", repr(e), flush=True)
+            print("[EXPORT] noon enqueue failed:", repr(e), flush=True)
+
+async def _day_closer(period: int = 3600):
+    await client.wait_until_ready()
+    while True:
+        closed = (timezone.localtime() - datetime.timedelta(minutes=ROLLUP_GRACE_MINUTES)).date() \
+            - datetime.timedelta(days=1)
+        guilds = [_gid(g) for g in client.guilds if _tracked(g)] or [settings.DEFAULT_GUILD_ID]
+        for gid in guilds:
+            try:
+                n = await close_days(gid, closed)
+                if n:
+                    print(f"[ROLLUP] guild {gid}: {n} days folded through {closed}", flush=True)
+                    # the full XLSX export is rebuilt once per closed day, off the request path
+                    await enqueue_snapshot(gid, closed)
+            except Exception as e:
+                print(f"[ROLLUP] guild {gid} failed:", repr(e), flush=True)
+        await asyncio.sleep(period)
 
 # ============= Discord events =============
+async def _bootstrap_guild(g):
+    gid = _gid(g)
+    t0 = time.monotonic()
+    channels = [row for row in map(_channel_fields, g.channels) if row]
+    in_voice, profiles, fps = {}, {}, {}
+    for m in g.members:
+        if getattr(m, "voice", None) and m.voice and m.voice.channel and not getattr(m, "bot", False):
+            uid = str(m.id)
+            in_voice[uid] = str(m.voice.channel.id)
+            profiles[uid] = _profile_fields(m)
+            fps[uid] = _profile_fingerprint(m)
+
+    # resume stays from the ledger instead of restarting every clock at _now()
+    start = await bootstrap(gid, g.member_count or 0, channels, profiles, in_voice, _now())
+    for key in [k for k in voice_start if k[0] == gid]:
+        del voice_start[key]
+    voice_start.update({(gid, uid): (start[uid], ch_id) for uid, ch_id in in_voice.items()})
+    for uid, fp in fps.items():
+        profile_cache.put((gid, uid), fp)
+    print(f"[BOOT] guild {gid}: {len(channels)} channels, {len(in_voice)} members in voice "
+          f"in {(time.monotonic() - t0) * 1000:.0f} ms", flush=True)
+
 @client.event
 async def on_ready():
-    g = client.get_guild(GUILD_ID)
-    await ensure_daily(g.member_count if g else 0)
-
-   
-    if g:
-        for ch in g.channels:
-            if str(getattr(ch, 'type', '')) in ('voice', 'stage_voice'):
-                await upsert_channel(ch)
-
-        for m in g.members:
-            if getattr(m, "voice", None) and m.voice and m.voice.channel and not getattr(m, "bot", False):
-                await upsert_channel(m.voice.channel)
-                voice_start[str(m.id)] = (_now(), str(m.voice.channel.id))
+    guilds = [g for g in client.guilds if _tracked(g)]
+    if not guilds:
+        await ensure_daily(settings.DEFAULT_GUILD_ID, 0)
+    # guilds run on their own lanes, so they bootstrap side by side
+    results = await asyncio.gather(*(_bootstrap_guild(g) for g in guilds), return_exceptions=True)
+    for g, r in zip(guilds, results):
+        if isinstance(r, Exception):
+            print(f"[BOOT] guild {g.id} failed:", repr(r), flush=True)
 
 
     try:
-        await pivot_incremental(_today() - datetime.timedelta(days=1))
+        await enqueue_export(_today() - datetime.timedelta(days=1))
     except Exception as e:
-        print("[GSHEETS] initial incremental error:", repr(e), flush=True)
-
-    
-    asyncio.create_task(_voice_flusher(60))
+        print("[EXPORT] initial enqueue failed:", repr(e), flush=True)
 
-    asyncio.create_task(_daily_noon_export())
+@client.event
+async def on_guild_join(guild):
+    if _tracked(guild):
+        await _bootstrap_guild(guild)
 
+# handlers only touch memory and enqueue; DB work happens on the ingest consumers
 @client.event
 async def on_message(msg):
-    if not msg.guild or msg.guild.id != GUILD_ID or msg.author.bot:
+    if not _tracked(msg.guild) or msg.author.bot:
         return
-    await upsert_profile(msg.author)
-    await inc_daily('messages', 1)
-    total = await kv_get_total()
-    await kv_set_total(total + 1)
-    await inc_message_user(str(msg.author.id), 1)
+    key = (_gid(msg.guild), str(msg.author.id))
+    await ingest.put(key, 'profile', msg.author)
+    await ingest.put(key, 'message', 1)
 
 @client.event
 async def on_member_join(member):
-    if member.guild.id != GUILD_ID or member.bot:
+    g = member.guild
+    if not _tracked(g) or member.bot:
         return
-    await upsert_profile(member)
-    await inc_daily('joins', 1)
-    g = client.get_guild(GUILD_ID)
-    await ensure_daily(g.member_count if g else None)
+    gid = _gid(g)
+    await ingest.put((gid, str(member.id)), 'profile', member)
+    await ingest.put((gid, 'guild'), 'daily', {'joins': 1})
+    await ingest.put((gid, 'guild'), 'members', g.member_count)
 
 @client.event
 async def on_member_remove(member):
-    if member.guild.id != GUILD_ID or member.bot:
+    g = member.guild
+    if not _tracked(g) or member.bot:
         return
-    await inc_daily('leaves', 1)
-    g = client.get_guild(GUILD_ID)
-    await ensure_daily(g.member_count if g else None)
+    gid = _gid(g)
+    await ingest.put((gid, 'guild'), 'daily', {'leaves': 1})
+    await ingest.put((gid, 'guild'), 'members', g.member_count)
 
 @client.event
 async def on_member_update(before, after):
-    if after.guild.id != GUILD_ID or after.bot:
+    if not _tracked(after.guild) or after.bot:
         return
-    await upsert_profile(after)
+    await ingest.put((_gid(after.guild), str(after.id)), 'profile', after)
 
 @client.event
 async def on_user_update(before, after):
     for g in client.guilds:
         m = g.get_member(after.id)
-        if m and g.id == GUILD_ID and not m.bot:
-            await upsert_profile(m)
+        if m and _tracked(g) and not m.bot:
+            await ingest.put((_gid(g), str(m.id)), 'profile', m)
 
 @client.event
 async def on_voice_state_update(member, before, after):
-    if member.guild.id != GUILD_ID or member.bot:
+    if not _tracked(member.guild) or member.bot:
         return
-    await upsert_profile(member)
-    uid = str(member.id)
+    gid, uid = _gid(member.guild), str(member.id)
+    key = (gid, uid)
+    # settle the stay before the first await: a put waiting for room in the queue
+    # must not let this member's next event (the leave after a join) run first
+    now = _now()
+    channel, job = None, None
 
     if not before.channel and after.channel:
-        await upsert_channel(after.channel)
-        voice_start[uid] = (_now(), str(after.channel.id))
-        return
+        channel = after.channel
+        voice_start[key] = (now, str(channel.id))
+        job = (voice_session_open, (gid, uid, str(channel.id), now), {})
+    elif before.channel and not after.channel:
+        sec, ch_id = _add_local_delta(key, now)
+        credited_to = voice_start.pop(key, (now, None))[0]
+        job = (voice_session_close, (gid, uid, sec, ch_id, now, credited_to), {})
+    elif before.channel and after.channel and before.channel.id != after.channel.id:
+        channel = after.channel
+        sec, ch_id = _add_local_delta(key, now)
+        credited_to = voice_start.get(key, (now, None))[0]
+        voice_start[key] = (now, str(channel.id))
+        job = (voice_session_close, (gid, uid, sec, ch_id, now, credited_to),
+               {'new_channel_id': str(channel.id)})
+
+    if job:
+        # ordered items are always admitted, so this put never waits
+        await ingest.put(key, 'voice', job)
+    await ingest.put(key, 'profile', member)
+    if channel:
+        await ingest.put((gid, 'ch', channel.id), 'channel', channel)
 
-    if before.channel and not after.channel:
-        sec, ch_id = _add_local_delta(uid)
-        voice_start.pop(uid, None)
-        if sec:
-            await flush_voice(uid, sec, ch_id)
-        return
+# ============= background tasks =============
+_voice_flush_lock = asyncio.Lock()
+voice_flush_stats = {'ticks': 0, 'last_duration': 0.0, 'last_batch': 0, 'skipped': 0}
 
-    if before.channel and after.channel and before.channel.id != after.channel.id:
-        sec, ch_id = _add_local_delta(uid)
-        if sec:
-            await flush_voice(uid, sec, ch_id)
-        await upsert_channel(after.channel)
-        voice_start[uid] = (_now(), str(after.channel.id))
+async def _flush_guild_voice(gid: str, batch: dict) -> None:
+    try:
+        await flush_voice_batch(gid, batch)
+    except Exception as e:
+        print(f"[VOICE] batch flush for guild {gid} failed, will retry:", repr(e), flush=True)
+        # hand the seconds back unless the stay moved on meanwhile
+        for uid, (sec, ch_id, ckpt) in batch.items():
+            if voice_start.get((gid, uid)) == (ckpt, ch_id):
+                voice_start[(gid, uid)] = (ckpt - _dt.timedelta(seconds=sec), ch_id)
+
+async def _flush_all_voice():
+    async with _voice_flush_lock:
+        t0 = time.monotonic()
+        now = _now()
+        batches: dict[str, dict] = {}
+        for key in list(voice_start.keys()):
+            sec, ch_id = _add_local_delta(key, now)
+            if sec:
+                batches.setdefault(key[0], {})[key[1]] = (sec, ch_id, voice_start[key][0])
+        # one transaction per guild, guilds side by side on their own lanes
+        await asyncio.gather(*(_flush_guild_voice(gid, b) for gid, b in batches.items()))
+        voice_flush_stats['ticks'] += 1
+        voice_flush_stats['last_duration'] = time.monotonic() - t0
+        voice_flush_stats['last_batch'] = sum(len(b) for b in batches.values())
 
-# ============= background tasks =============
 async def _voice_flusher(period: int = 60):
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time() + period
     while True:
-        await asyncio.sleep(period)
-        for uid in list(voice_start.keys()):
-            sec, ch_id = _add_local_delta(uid)
-            if sec:
-                await flush_voice(uid, sec, ch_id)
+        await asyncio.sleep(max(next_tick - loop.time(), 0))
+        await _flush_all_voice()
+        dur = voice_flush_stats['last_duration']
+        print(f"[VOICE] tick: {voice_flush_stats['last_batch']} users in {dur * 1000:.0f} ms; "
+              f"ingest depth {ingest.depth}, lag {ingest.lag():.1f}s", flush=True)
+        # ticks never overlap: a slow tick skips the slots it overran
+        next_tick += period
+        if next_tick <= loop.time():
+            missed = int((loop.time() - next_tick) // period) + 1
+            voice_flush_stats['skipped'] += missed
+            next_tick += missed * period
+
+metrics.gauge('bot_voice_in_flight', 'Members with a running voice clock (size of voice_start).',
+              lambda: len(voice_start))
+metrics.gauge('bot_voice_flush_ticks_total', 'Voice flush ticks run.',
+              lambda: voice_flush_stats['ticks'], kind='counter')
+metrics.gauge('bot_voice_flush_skipped_total', 'Voice flush slots skipped because a tick overran.',
+              lambda: voice_flush_stats['skipped'], kind='counter')
+metrics.gauge('bot_voice_flush_last_seconds', 'Duration of the last voice flush tick.',
+              lambda: voice_flush_stats['last_duration'])
+metrics.gauge('bot_voice_flush_last_batch', 'Members credited by the last voice flush tick.',
+              lambda: voice_flush_stats['last_batch'])
+metrics.gauge('bot_ingest_depth', 'Pending ingest queue items.', lambda: ingest.depth)
+metrics.gauge('bot_ingest_lag_seconds', 'Age of the oldest pending ingest item.', lambda: ingest.lag())
+metrics.gauge('bot_ingest_items_total', 'Ingest queue items since start, by outcome.',
+              lambda: {(('outcome', k),): v for k, v in ingest.stats.items()}, kind='counter')
+metrics.gauge('bot_message_buffer_pending', 'Buffered per-user message deltas not yet written.',
+              lambda: len(msg_buffer.per_user))
+metrics.gauge('bot_sheets_export_last_finish_timestamp', 'Unix time the last export job finished.',
+              lambda: export_stats['last_finished'])
+metrics.gauge('bot_sheets_export_last_seconds', 'Duration of the last export job.',
+              lambda: export_stats['last_duration'])
+metrics.gauge('bot_sheets_export_last_outcome', 'Outcome of the last export job (1 for the current one).',
+              lambda: {(('outcome', o),): int(export_stats['last_outcome'] == o)
+                       for o in (jobs.DONE, jobs.SKIPPED, jobs.FAILED)})
+metrics.gauge('bot_export_jobs_pending', 'Export jobs queued or running.', lambda: export_stats['pending'])
 
 # ============= run =============
 if __name__ == "__main__" and not os.getenv("BOT_NO_RUN"):
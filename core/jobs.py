@@ -0,0 +1,74 @@
+"""
+Export job queue on top of ExportJob. Any number of workers can poll it: a job is
+claimed with a conditional UPDATE, and a claim expires after its lease so a job
+held by a crashed worker is picked up again.
+"""
+import datetime
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ExportJob
+
+PENDING, RUNNING, DONE, FAILED, SKIPPED = 'pending', 'running', 'done', 'failed', 'skipped'
+
+SHEETS_PIVOT = 'sheets_pivot'
+# export_date is the last day in the file
+XLSX_SNAPSHOT = 'xlsx_snapshot'
+
+
+def enqueue(kind: str, guild_id: str, d: datetime.date, delay: float = 0) -> ExportJob:
+    """Idempotent: an export already queued for the same date is reset, not duplicated."""
+    run_after = timezone.now() + datetime.timedelta(seconds=delay)
+    job, created = ExportJob.objects.get_or_create(
+        kind=kind, guild_id=guild_id, export_date=d,
+        defaults={'run_after': run_after},
+    )
+    if not created:
+        # a running job keeps its claim; the next enqueue after it finishes re-runs it
+        ExportJob.objects.filter(pk=job.pk).exclude(status=RUNNING).update(
+            status=PENDING, attempts=0, run_after=run_after, last_error='', locked_until=None,
+        )
+    return job
+
+
+def claim(lease_seconds: float) -> ExportJob | None:
+    now = timezone.now()
+    due = ExportJob.objects.filter(
+        Q(status=PENDING, run_after__lte=now) | Q(status=RUNNING, locked_until__lt=now)
+    ).order_by('run_after')
+    for job in due[:10]:
+        won = ExportJob.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+            status=RUNNING, attempts=F('attempts') + 1,
+            locked_until=now + datetime.timedelta(seconds=lease_seconds),
+        )
+        if won:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def finish(job: ExportJob, status: str, duration: float, error: str = ''):
+    ExportJob.objects.filter(pk=job.pk, status=RUNNING).update(
+        status=status, duration=duration, last_error=error[:2000],
+        locked_until=None, finished_at=timezone.now(),
+    )
+
+
+def retry(job: ExportJob, error: str, delay: float, duration: float):
+    ExportJob.objects.filter(pk=job.pk, status=RUNNING).update(
+        status=PENDING, run_after=timezone.now() + datetime.timedelta(seconds=delay),
+        last_error=error[:2000], duration=duration, locked_until=None,
+    )
+
+
+def status_summary() -> dict:
+    """Last finished job and queue depth, for the bot's metrics."""
+    last = ExportJob.objects.filter(finished_at__isnull=False).order_by('-finished_at')\
+        .values('status', 'duration', 'finished_at').first()
+    return {
+        'pending': ExportJob.objects.filter(status__in=(PENDING, RUNNING)).count(),
+        'last_outcome': last['status'] if last else '',
+        'last_duration': last['duration'] if last else 0.0,
+        'last_finished': last['finished_at'].timestamp() if last else 0.0,
+    }
@@ -0,0 +1,36 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import rollups
+from core.models import Daily
+
+
+class Command(BaseCommand):
+    help = "Fold closed days into the weekly/monthly rollups (the bot does this on its own every hour)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--guild', dest='guild', help='only this guild id, default every guild with data')
+        parser.add_argument('--upto', help='YYYY-MM-DD, last day to fold; default yesterday')
+        parser.add_argument('--rebuild', action='store_true', help='drop the rollups first and fold every day again')
+        parser.add_argument('--from', dest='date_from',
+                            help='YYYY-MM-DD; with --rebuild only recompute the closed weeks and months from this '
+                                 'day on (after writes to days that were already folded)')
+
+    def handle(self, *args, guild=None, upto=None, rebuild=False, date_from=None, **opts):
+        upto = datetime.date.fromisoformat(upto) if upto else timezone.localdate() - datetime.timedelta(days=1)
+        date_from = datetime.date.fromisoformat(date_from) if date_from else None
+        if date_from and not rebuild:
+            raise CommandError("--from goes with --rebuild")
+        guilds = [guild] if guild else sorted(set(Daily.objects.values_list('guild_id', flat=True))) \
+            or [settings.DEFAULT_GUILD_ID]
+        for gid in guilds:
+            if rebuild and date_from:
+                m = rollups.refold(gid, date_from)
+                self.stdout.write(f"guild {gid}: {m} weeks/months recomputed from {date_from}")
+            elif rebuild:
+                rollups.clear(gid)
+            n = rollups.close_days(gid, upto)
+            self.stdout.write(f"guild {gid}: {n} days folded, rollups closed through {rollups.watermark(gid)}")
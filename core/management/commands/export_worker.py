@@ -0,0 +1,143 @@
+import os
+import time
+import datetime
+import random
+import traceback
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from django.conf import settings
+
+from core import jobs, rollups, sheets, snapshots
+
+GS_SHEET_ID = os.getenv('GOOGLE_SHEETS_SPREADSHEET_ID', '').strip()
+GS_SA       = os.getenv('GOOGLE_SERVICE_ACCOUNT_JSON', '').strip()
+# point at a local fake server (tools/fake_sheets.py) to test without Google
+GS_API_BASE = os.getenv('GS_API_BASE', sheets.API_BASE).strip()
+MAX_PIVOT_DATES = int(os.getenv('GS_MAX_PIVOT_DATES', '31'))
+
+# Sheets quotas are per minute and per project/user; stay at or under them
+SHEETS_READS_PER_MIN  = float(os.getenv('SHEETS_READS_PER_MIN', '60'))
+SHEETS_WRITES_PER_MIN = float(os.getenv('SHEETS_WRITES_PER_MIN', '60'))
+
+# retries: delay = min(base * 2^(attempt-1), max) with jitter, or Retry-After if longer
+EXPORT_MAX_ATTEMPTS  = int(os.getenv('EXPORT_MAX_ATTEMPTS', '8'))
+EXPORT_BACKOFF_BASE  = float(os.getenv('EXPORT_BACKOFF_BASE', '30'))
+EXPORT_BACKOFF_MAX   = float(os.getenv('EXPORT_BACKOFF_MAX', '3600'))
+EXPORT_POLL_SECONDS  = float(os.getenv('EXPORT_POLL_SECONDS', '5'))
+EXPORT_LEASE_SECONDS = float(os.getenv('EXPORT_LEASE_SECONDS', '900'))
+
+
+def _log(*args):
+    print("[EXPORT]", *args, flush=True)
+
+
+def _backoff(attempt: int, retry_after: float | None) -> float:
+    delay = min(EXPORT_BACKOFF_BASE * 2 ** (attempt - 1), EXPORT_BACKOFF_MAX)
+    return max(delay * random.uniform(0.5, 1.0), retry_after or 0)
+
+
+class Command(BaseCommand):
+    help = "Run queued exports (Google Sheets pivots, XLSX snapshots) with rate limiting and retries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit when no job is due')
+        parser.add_argument('--from', dest='date_from',
+                            help='YYYY-MM-DD: export this date range to Sheets now and exit (no queue)')
+        parser.add_argument('--to', dest='date_to', help='YYYY-MM-DD, inclusive; default --from')
+        parser.add_argument('--guild', dest='guild', help='guild id for --from/--to/--snapshot, default GUILD_ID')
+        parser.add_argument('--snapshot', action='store_true',
+                            help='build the XLSX snapshot through the last closed day now and exit (no queue)')
+
+    def handle(self, *args, once=False, date_from=None, date_to=None, guild=None, snapshot=False, **opts):
+        self.quota = sheets.Quota(SHEETS_READS_PER_MIN, SHEETS_WRITES_PER_MIN)
+        self.runners = {jobs.SHEETS_PIVOT: self.sheets_pivot, jobs.XLSX_SNAPSHOT: self.xlsx_snapshot}
+        _log(f"worker up: {GS_API_BASE}, {SHEETS_READS_PER_MIN:g} reads/{SHEETS_WRITES_PER_MIN:g} writes per min")
+        if date_from:
+            start = datetime.date.fromisoformat(date_from)
+            end = datetime.date.fromisoformat(date_to) if date_to else start
+            dates = [start + datetime.timedelta(days=n) for n in range((end - start).days + 1)]
+            self.export_now(guild or settings.DEFAULT_GUILD_ID, dates)
+            return
+        if snapshot:
+            gid = guild or settings.DEFAULT_GUILD_ID
+            through = rollups.watermark(gid)
+            if through is None:
+                _log(f"guild {gid}: no closed day yet (run close_days first)")
+                return
+            self.snapshot(gid, through)
+            return
+        while True:
+            close_old_connections()
+            job = jobs.claim(EXPORT_LEASE_SECONDS)
+            if job is None:
+                if once:
+                    return
+                time.sleep(EXPORT_POLL_SECONDS)
+                continue
+            self.run(job)
+
+    def run(self, job):
+        label = f"{job.kind} guild={job.guild_id} date={job.export_date} attempt={job.attempts}"
+        t0 = time.monotonic()
+        try:
+            status = self.runners[job.kind](job)
+        except sheets.SheetsError as e:
+            self.failed(job, label, e, e.retryable, e.retry_after, time.monotonic() - t0)
+        except Exception as e:
+            traceback.print_exc()
+            self.failed(job, label, e, True, None, time.monotonic() - t0)
+        else:
+            jobs.finish(job, status, time.monotonic() - t0)
+            _log(f"{label}: {status} in {time.monotonic() - t0:.1f}s")
+
+    def failed(self, job, label, err, retryable, retry_after, duration):
+        if not retryable or job.attempts >= EXPORT_MAX_ATTEMPTS:
+            jobs.finish(job, jobs.FAILED, duration, repr(err))
+            _log(f"{label}: failed for good:", repr(err))
+            return
+        delay = _backoff(job.attempts, retry_after)
+        jobs.retry(job, repr(err), delay, duration)
+        _log(f"{label}: {err!r}, retry in {delay:.0f}s")
+
+    def export_now(self, gid: str, dates: list[datetime.date]):
+        # same retry policy as a queued job, waited out in place
+        for attempt in range(1, EXPORT_MAX_ATTEMPTS + 1):
+            try:
+                self.export(gid, dates, catch_up=False)
+                return
+            except sheets.SheetsError as e:
+                if not e.retryable or attempt >= EXPORT_MAX_ATTEMPTS:
+                    raise CommandError(f"export failed after {attempt} attempts: {e!r}")
+                delay = _backoff(attempt, e.retry_after)
+                _log(f"{e!r}, retry in {delay:.0f}s")
+                time.sleep(delay)
+
+    def sheets_pivot(self, job) -> str:
+        # a daily job also picks up the days an earlier run missed
+        return self.export(job.guild_id, [job.export_date], catch_up=True)
+
+    def export(self, gid: str, dates: list[datetime.date], catch_up: bool) -> str:
+        if not GS_SHEET_ID or not (GS_SA or GS_API_BASE != sheets.API_BASE):
+            _log("NO CREDS: GOOGLE_SHEETS_SPREADSHEET_ID or GOOGLE_SERVICE_ACCOUNT_JSON is empty")
+            return jobs.SKIPPED
+        backend = sheets.RestBackend(sheets.session(GS_SA), GS_SHEET_ID, GS_API_BASE, self.quota)
+        summary = sheets.export_pivots(backend, GS_SHEET_ID, gid, dates, MAX_PIVOT_DATES, catch_up=catch_up)
+        for title, n in summary.items():
+            written = ', '.join(n['dates']) or 'no dates'
+            _log(f"{title}: {n['values']} values for {written} (+{n['new_rows']} new rows)"
+                 + (f", {len(n['skipped'])} dates older than the kept window skipped" if n['skipped'] else ''))
+        _log(f"{backend.calls} API calls")
+        return jobs.DONE
+
+    def xlsx_snapshot(self, job) -> str:
+        self.snapshot(job.guild_id, job.export_date)
+        return jobs.DONE
+
+    def snapshot(self, gid: str, through: datetime.date):
+        t0 = time.monotonic()
+        snap = snapshots.build(gid, through)
+        removed = snapshots.prune(gid)
+        _log(f"snapshot {snap.path}: {os.path.getsize(snap.path) / 2 ** 20:.1f} MB in {time.monotonic() - t0:.1f}s"
+             + (f", {len(removed)} old files removed" if removed else ''))
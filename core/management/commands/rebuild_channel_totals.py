@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from core.models import VoiceChannelDaily, VoiceChannelTotal
+
+
+class Command(BaseCommand):
+    help = "Recompute VoiceChannelTotal from VoiceChannelDaily (one-off backfill)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--guild', dest='guild', help='only this guild id')
+
+    def handle(self, *args, guild=None, **opts):
+        daily = VoiceChannelDaily.objects.all()
+        totals = VoiceChannelTotal.objects.all()
+        if guild:
+            daily = daily.filter(guild_id=guild)
+            totals = totals.filter(guild_id=guild)
+        with transaction.atomic():
+            # hold off voice flushes until the new totals are in; a flush already past
+            # its daily upsert adds its delta on top once we commit (sqlite: the delete
+            # below takes the database write lock)
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cur:
+                    cur.execute(f"LOCK TABLE {connection.ops.quote_name(VoiceChannelTotal._meta.db_table)} "
+                                f"IN SHARE ROW EXCLUSIVE MODE")
+            totals.delete()
+            rows = [
+                VoiceChannelTotal(guild_id=g, channel_id=c, seconds=s or 0)
+                for g, c, s in daily.values('guild_id', 'channel_id').annotate(s=Sum('seconds'))
+                .values_list('guild_id', 'channel_id', 's')
+            ]
+            VoiceChannelTotal.objects.bulk_create(rows, batch_size=1000)
+        self.stdout.write(f"rebuilt {len(rows)} VoiceChannelTotal rows")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from core.models import Daily, MessageUserDaily, VoiceUserDaily
+
+
+class Command(BaseCommand):
+    help = "Recompute Daily distinct-member metrics from the per-user tables (one-off backfill)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='YYYY-MM-DD, inclusive')
+        parser.add_argument('--to', dest='date_to', help='YYYY-MM-DD, inclusive')
+        parser.add_argument('--guild', dest='guild', help='only this guild id')
+
+    def handle(self, *args, date_from=None, date_to=None, guild=None, **opts):
+        rng = {}
+        if guild:
+            rng['guild_id'] = guild
+        if date_from:
+            rng['date__gte'] = date_from
+        if date_to:
+            rng['date__lte'] = date_to
+
+        authors = dict(
+            ((g, d), c) for g, d, c in
+            MessageUserDaily.objects.filter(**rng).values('guild_id', 'date')
+            .annotate(c=Count('user_id', distinct=True)).values_list('guild_id', 'date', 'c')
+        )
+        voice = dict(
+            ((g, d), c) for g, d, c in
+            VoiceUserDaily.objects.filter(**rng).values('guild_id', 'date')
+            .annotate(c=Count('user_id', distinct=True)).values_list('guild_id', 'date', 'c')
+        )
+        rows = list(Daily.objects.filter(**rng))
+        now = timezone.now()
+        for row in rows:
+            row.updated_at = now
+            row.unique_message_members = authors.get((row.guild_id, row.date), 0)
+            row.unique_voice_members = voice.get((row.guild_id, row.date), 0)
+            row.visitors = max(row.unique_message_members, row.unique_voice_members)
+            row.avg_messages_per_active_member = (
+                row.messages / row.unique_message_members if row.unique_message_members else 0.0
+            )
+        with transaction.atomic():
+            Daily.objects.bulk_update(
+                rows,
+                ['unique_message_members', 'unique_voice_members', 'visitors', 'avg_messages_per_active_member',
+                 'updated_at'],
+                batch_size=500,
+            )
+        self.stdout.write(f"updated {len(rows)} Daily rows")
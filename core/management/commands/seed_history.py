@@ -0,0 +1,138 @@
+import random
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import rollups, storage
+from core.models import (
+    Counter, Daily, UserProfile,
+    VoiceUserDaily, VoiceUserTotal,
+    MessageUserDaily, MessageUserTotal,
+    VoiceChannel, VoiceChannelDaily, VoiceChannelTotal, VoiceUserChannelDaily,
+)
+
+BATCH = 5000
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic history (users x channels x days) for load testing. Use a scratch database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--channels', type=int, default=20)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--active', type=float, default=0.05, help='share of members active on a day')
+        parser.add_argument('--voice-share', type=float, default=0.4, help='share of active members in voice')
+        parser.add_argument('--guild', default=None, help='guild id, default GUILD_ID')
+        parser.add_argument('--end', default=None, help='last day YYYY-MM-DD, default today')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help="delete the guild's stats rows first")
+
+    def handle(self, *args, users, channels, days, active, voice_share, guild, end, seed, clear, **opts):
+        gid = guild or settings.DEFAULT_GUILD_ID
+        rnd = random.Random(seed)
+        end_date = datetime.date.fromisoformat(end) if end else timezone.localdate()
+        start_date = end_date - datetime.timedelta(days=days - 1)
+
+        if clear:
+            for model in (VoiceUserChannelDaily, VoiceChannelTotal, VoiceChannelDaily, VoiceUserDaily, VoiceUserTotal,
+                          MessageUserDaily, MessageUserTotal, Daily, Counter, VoiceChannel):
+                model.objects.filter(guild_id=gid).delete()
+            rollups.clear(gid)
+
+        # synthetic ids never look like snowflakes; deterministic, so reruns reuse the profiles
+        uids = [f"s{gid}-{i}" for i in range(users)]
+        cids = [f"s{gid}-c{c}" for c in range(channels)]
+        UserProfile.objects.bulk_create(
+            [UserProfile(user_id=u, username=f'user{i}', display_name=f'User {i}',
+                         avatar_url="https://cdn.discordapp.com/embed/avatars/0.png")
+             for i, u in enumerate(uids)],
+            batch_size=BATCH, ignore_conflicts=True,
+        )
+        VoiceChannel.objects.bulk_create(
+            [VoiceChannel(channel_id=c, guild_id=gid, name=f'voice-{i}') for i, c in enumerate(cids)],
+            ignore_conflicts=True,
+        )
+
+        # a few members do most of the talking: weight ~ 1 / rank^0.8
+        cum, acc = [], 0.0
+        for rank in range(1, users + 1):
+            acc += rank ** -0.8
+            cum.append(acc)
+        ch_cum = [sum(1 / (i + 1) for i in range(j + 1)) for j in range(channels)]
+
+        msg_tot: dict[str, int] = {}
+        voice_tot: dict[str, int] = {}
+        ch_tot: dict[str, int] = {}
+        members, messages_total = int(users * 0.8), 0
+        n_rows = 0
+        d = start_date
+        while d <= end_date:
+            with transaction.atomic():
+                day_users = set(rnd.choices(uids, cum_weights=cum, k=max(int(users * active), 1)))
+                per_msg = {u: int(rnd.lognormvariate(1.5, 1.0)) + 1 for u in day_users}
+                in_voice = [u for u in day_users if rnd.random() < voice_share]
+                uc: dict[tuple[str, str], int] = {}
+                for u in in_voice:
+                    for c in set(rnd.choices(cids, cum_weights=ch_cum, k=rnd.randint(1, 2))):
+                        uc[(u, c)] = min(int(rnd.lognormvariate(8.0, 1.0)), 43200)
+                per_voice: dict[str, int] = {}
+                per_ch: dict[str, int] = {}
+                for (u, c), sec in uc.items():
+                    per_voice[u] = per_voice.get(u, 0) + sec
+                    per_ch[c] = per_ch.get(c, 0) + sec
+
+                MessageUserDaily.objects.bulk_create(
+                    [MessageUserDaily(guild_id=gid, date=d, user_id=u, messages=n) for u, n in per_msg.items()],
+                    batch_size=BATCH, ignore_conflicts=True,
+                )
+                VoiceUserDaily.objects.bulk_create(
+                    [VoiceUserDaily(guild_id=gid, date=d, user_id=u, seconds=s) for u, s in per_voice.items()],
+                    batch_size=BATCH, ignore_conflicts=True,
+                )
+                VoiceChannelDaily.objects.bulk_create(
+                    [VoiceChannelDaily(guild_id=gid, date=d, channel_id=c, seconds=s) for c, s in per_ch.items()],
+                    batch_size=BATCH, ignore_conflicts=True,
+                )
+                VoiceUserChannelDaily.objects.bulk_create(
+                    [VoiceUserChannelDaily(guild_id=gid, date=d, channel_id=c, user_id=u, seconds=s)
+                     for (u, c), s in uc.items()],
+                    batch_size=BATCH, ignore_conflicts=True,
+                )
+
+                joins, leaves = rnd.randint(0, 20), rnd.randint(0, 15)
+                members += joins - leaves
+                msgs = sum(per_msg.values())
+                Daily.objects.update_or_create(guild_id=gid, date=d, defaults=dict(
+                    members=members, joins=joins, leaves=leaves,
+                    messages=msgs, messages_total=messages_total,
+                    voice_seconds=sum(per_voice.values()),
+                    unique_message_members=len(per_msg), unique_voice_members=len(per_voice),
+                    visitors=max(len(per_msg), len(per_voice)),
+                    avg_messages_per_active_member=msgs / len(per_msg) if per_msg else 0.0,
+                ))
+                messages_total += msgs
+            for u, n in per_msg.items():
+                msg_tot[u] = msg_tot.get(u, 0) + n
+            for u, s in per_voice.items():
+                voice_tot[u] = voice_tot.get(u, 0) + s
+            for c, s in per_ch.items():
+                ch_tot[c] = ch_tot.get(c, 0) + s
+            n_rows += len(per_msg) + len(per_voice) + len(per_ch) + len(uc) + 1
+            d += datetime.timedelta(days=1)
+
+        with transaction.atomic():
+            storage.upsert_add(MessageUserTotal, ('guild_id', 'user'), 'messages',
+                               {(gid, u): n for u, n in msg_tot.items()})
+            storage.upsert_add(VoiceUserTotal, ('guild_id', 'user'), 'seconds',
+                               {(gid, u): s for u, s in voice_tot.items()})
+            storage.upsert_add(VoiceChannelTotal, ('guild_id', 'channel'), 'seconds',
+                               {(gid, c): s for c, s in ch_tot.items()})
+            storage.counter_add(gid, storage.MESSAGES_TOTAL, messages_total)
+        # days already folded into the weekly / monthly rollups got new rows
+        rollups.refold(gid, start_date, end_date)
+        self.stdout.write(f"guild {gid}: {days} days {start_date}..{end_date}, {users} users, "
+                          f"{channels} channels, {n_rows} daily rows, {messages_total} messages")
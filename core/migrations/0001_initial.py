@@ -0,0 +1,146 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Daily',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('members', models.IntegerField(default=0)),
+                ('joins', models.IntegerField(default=0)),
+                ('leaves', models.IntegerField(default=0)),
+                ('messages', models.IntegerField(default=0)),
+                ('messages_total', models.BigIntegerField(default=0)),
+                ('voice_seconds', models.BigIntegerField(default=0)),
+                ('unique_message_members', models.IntegerField(default=0)),
+                ('avg_messages_per_active_member', models.FloatField(default=0)),
+                ('visitors', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_daily',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='KV',
+            fields=[
+                ('key', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('val', models.TextField()),
+            ],
+            options={
+                'db_table': 'core_kv',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('user_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('username', models.CharField(blank=True, default='', max_length=255)),
+                ('display_name', models.CharField(blank=True, default='', max_length=255)),
+                ('avatar_url', models.TextField(blank=True, default='')),
+                ('joined_at', models.DateTimeField(blank=True, null=True)),
+                ('is_bot', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'core_userprofile',
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceChannel',
+            fields=[
+                ('channel_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('is_stage', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'core_voicechannel',
+            },
+        ),
+        migrations.CreateModel(
+            name='MessageUserTotal',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.userprofile')),
+                ('messages', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_messageusertotal',
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceUserTotal',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.userprofile')),
+                ('seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_voiceusertotal',
+            },
+        ),
+        migrations.CreateModel(
+            name='MessageUserDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('messages', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'core_messageuserdaily',
+                'indexes': [models.Index(fields=['date'], name='core_messag_date_8e983a_idx'), models.Index(fields=['user'], name='core_messag_user_id_0dedea_idx')],
+                'unique_together': {('date', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceChannelDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seconds', models.BigIntegerField(default=0)),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.voicechannel')),
+            ],
+            options={
+                'db_table': 'core_voicechanneldaily',
+                'indexes': [models.Index(fields=['date'], name='core_voicec_date_2cd6a8_idx'), models.Index(fields=['channel'], name='core_voicec_channel_dc26bb_idx')],
+                'unique_together': {('date', 'channel')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceUserChannelDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seconds', models.BigIntegerField(default=0)),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.voicechannel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'core_voiceuserchanneldaily',
+                'indexes': [models.Index(fields=['date'], name='core_voiceu_date_3464fa_idx'), models.Index(fields=['channel'], name='core_voiceu_channel_3978b2_idx'), models.Index(fields=['user'], name='core_voiceu_user_id_ab6056_idx')],
+                'unique_together': {('date', 'channel', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceUserDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seconds', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'core_voiceuserdaily',
+                'indexes': [models.Index(fields=['date'], name='core_voiceu_date_a53de1_idx'), models.Index(fields=['user'], name='core_voiceu_user_id_e21207_idx')],
+                'unique_together': {('date', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='daily',
+            name='unique_voice_members',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('shard', models.SmallIntegerField(default=0)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_counter',
+                'unique_together': {('name', 'shard')},
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_id', models.CharField(max_length=32)),
+                ('joined_at', models.DateTimeField()),
+                ('last_checkpoint', models.DateTimeField()),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile')),
+            ],
+            options={
+                'db_table': 'core_voicesession',
+                'indexes': [models.Index(condition=models.Q(('ended_at__isnull', True)), fields=['user'], name='voicesession_open_user'), models.Index(fields=['ended_at'], name='core_voices_ended_a_a1db85_idx')],
+            },
+        ),
+    ]
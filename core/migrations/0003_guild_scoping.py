@@ -0,0 +1,313 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:25
+"""
+Guild-scoped rows. Every stats table gets guild_id; rows already in the table get
+MIGRATE_GUILD_ID, or else the GUILD_ID the migration runs with (the AddField
+default). Set one of them to the guild the bot used to track: with history in
+the tables and neither set, the migration stops before changing anything
+rather than file it all under the placeholder guild '0'.
+
+Daily (keyed by date) and the two totals tables (keyed by user) move to a
+surrogate id: the column is added empty, numbered, and only then made the
+primary key in place of the old one (swap_primary_keys); the identity sequence is
+moved past the numbers handed out.
+"""
+import os
+
+import core.models
+import django.db.models.deletion
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+RE_KEYED = ('Daily', 'VoiceUserTotal', 'MessageUserTotal')
+GUILD_SCOPED = (
+    'Counter', 'Daily', 'MessageUserDaily', 'MessageUserTotal', 'VoiceChannel', 'VoiceChannelDaily',
+    'VoiceSession', 'VoiceUserChannelDaily', 'VoiceUserDaily', 'VoiceUserTotal',
+)
+
+
+def _legacy_guild_id() -> str:
+    return (os.getenv('MIGRATE_GUILD_ID') or os.getenv('GUILD_ID') or '').strip()
+
+
+def check_legacy_guild(apps, schema_editor):
+    if _legacy_guild_id():
+        return
+    db = schema_editor.connection.alias
+    used = [name for name in GUILD_SCOPED if apps.get_model('core', name).objects.using(db).exists()]
+    if used:
+        raise ImproperlyConfigured(
+            f"{', '.join(used)} already hold rows, and this migration gives them a guild id. "
+            "Set MIGRATE_GUILD_ID (or GUILD_ID) to the id of the guild the bot has been tracking "
+            "and run migrate again."
+        )
+
+
+def assign_legacy_guild(apps, schema_editor):
+    gid = _legacy_guild_id()
+    if not gid or gid == settings.DEFAULT_GUILD_ID:
+        return  # the AddField default already did it
+    db = schema_editor.connection.alias
+    for name in GUILD_SCOPED:
+        apps.get_model('core', name).objects.using(db).update(guild_id=gid)
+
+
+def number_rows(apps, schema_editor):
+    db = schema_editor.connection.alias
+    for name in RE_KEYED:
+        model = apps.get_model('core', name)
+        batch = []
+        rows = model.objects.using(db).order_by('pk').only(model._meta.pk.name).iterator(chunk_size=2000)
+        for n, row in enumerate(rows, 1):
+            row.id = n
+            batch.append(row)
+            if len(batch) >= 2000:
+                model.objects.using(db).bulk_update(batch, ['id'])
+                batch = []
+        if batch:
+            model.objects.using(db).bulk_update(batch, ['id'])
+
+
+def swap_primary_keys(apps, schema_editor):
+    # runs on the new state: id is the primary key, date / user are plain columns
+    conn = schema_editor.connection
+    for name in RE_KEYED:
+        model = apps.get_model('core', name)
+        table = model._meta.db_table
+        if conn.vendor == 'sqlite':
+            # SQLite cannot drop a primary key; rebuild the table from the new state
+            schema_editor._remake_table(model)
+            continue
+        if conn.vendor != 'postgresql':
+            raise NotImplementedError(f"no primary key swap for {conn.vendor}")
+        with conn.cursor() as cursor:
+            constraints = conn.introspection.get_constraints(cursor, table)
+        for pk in [n for n, c in constraints.items() if c['primary_key']]:
+            schema_editor.execute(f'ALTER TABLE {schema_editor.quote_name(table)} DROP CONSTRAINT {schema_editor.quote_name(pk)}')
+        q = schema_editor.quote_name(table)
+        schema_editor.execute(f'ALTER TABLE {q} ALTER COLUMN "id" SET NOT NULL')
+        schema_editor.execute(f'ALTER TABLE {q} ALTER COLUMN "id" ADD GENERATED BY DEFAULT AS IDENTITY')
+        schema_editor.execute(f'ALTER TABLE {q} ADD PRIMARY KEY ("id")')
+        if name != 'Daily':
+            # the old key was the user; as a plain foreign key it gets its own index
+            schema_editor.execute(schema_editor._create_index_sql(model, fields=[model._meta.get_field('user')]))
+        for statement in conn.ops.sequence_reset_sql(no_style(), [model]):
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_counter_voicesession_daily_members'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_legacy_guild, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='messageuserdaily',
+            name='core_messag_date_8e983a_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voicechanneldaily',
+            name='core_voicec_date_2cd6a8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voicesession',
+            name='voicesession_open_user',
+        ),
+        migrations.RemoveIndex(
+            model_name='voiceuserchanneldaily',
+            name='core_voiceu_date_3464fa_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voiceuserdaily',
+            name='core_voiceu_date_a53de1_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='counter',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='messageuserdaily',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voicechanneldaily',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voiceuserchanneldaily',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voiceuserdaily',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='counter',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='daily',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='daily',
+            name='id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='messageuserdaily',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='messageusertotal',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='messageusertotal',
+            name='id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='voicechannel',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='voicechanneldaily',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='voicesession',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='voiceuserchanneldaily',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='voiceuserdaily',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='voiceusertotal',
+            name='guild_id',
+            field=models.CharField(default=core.models.default_guild_id, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='voiceusertotal',
+            name='id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(assign_legacy_guild, migrations.RunPython.noop),
+        migrations.RunPython(number_rows, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='daily',
+                    name='id',
+                    field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+                ),
+                migrations.AlterField(
+                    model_name='messageusertotal',
+                    name='id',
+                    field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+                ),
+                migrations.AlterField(
+                    model_name='voiceusertotal',
+                    name='id',
+                    field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+                ),
+                migrations.AlterField(
+                    model_name='daily',
+                    name='date',
+                    field=models.DateField(),
+                ),
+                migrations.AlterField(
+                    model_name='messageusertotal',
+                    name='user',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile'),
+                ),
+                migrations.AlterField(
+                    model_name='voiceusertotal',
+                    name='user',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile'),
+                ),
+            ],
+        ),
+        migrations.RunPython(swap_primary_keys, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='counter',
+            unique_together={('guild_id', 'name', 'shard')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='daily',
+            unique_together={('guild_id', 'date')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='messageuserdaily',
+            unique_together={('guild_id', 'date', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='messageusertotal',
+            unique_together={('guild_id', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voicechanneldaily',
+            unique_together={('guild_id', 'date', 'channel')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voiceuserchanneldaily',
+            unique_together={('guild_id', 'date', 'channel', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voiceuserdaily',
+            unique_together={('guild_id', 'date', 'user')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voiceusertotal',
+            unique_together={('guild_id', 'user')},
+        ),
+        migrations.AddIndex(
+            model_name='messageuserdaily',
+            index=models.Index(fields=['guild_id', 'date'], name='core_messag_guild_i_848433_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messageusertotal',
+            index=models.Index(fields=['user'], name='core_messag_user_id_e19e81_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voicechannel',
+            index=models.Index(fields=['guild_id'], name='core_voicec_guild_i_7eca9c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voicechanneldaily',
+            index=models.Index(fields=['guild_id', 'date'], name='core_voicec_guild_i_cd3722_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voicesession',
+            index=models.Index(condition=models.Q(('ended_at__isnull', True)), fields=['guild_id', 'user'], name='voicesession_open_user'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceuserchanneldaily',
+            index=models.Index(fields=['guild_id', 'date'], name='core_voiceu_guild_i_3c14d9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceuserdaily',
+            index=models.Index(fields=['guild_id', 'date'], name='core_voiceu_guild_i_fc741f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceusertotal',
+            index=models.Index(fields=['user'], name='core_voiceu_user_id_5ee0ef_idx'),
+        ),
+    ]
@@ -0,0 +1,255 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:25
+
+import core.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_guild_scoping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guild_id', models.CharField(default=core.models.default_guild_id, max_length=32)),
+                ('period', models.CharField(max_length=8)),
+                ('start', models.DateField()),
+                ('days', models.IntegerField(default=0)),
+                ('members', models.IntegerField(default=0)),
+                ('joins', models.IntegerField(default=0)),
+                ('leaves', models.IntegerField(default=0)),
+                ('messages', models.BigIntegerField(default=0)),
+                ('messages_total', models.BigIntegerField(default=0)),
+                ('voice_seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_dailyrollup',
+            },
+        ),
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32)),
+                ('guild_id', models.CharField(default=core.models.default_guild_id, max_length=32)),
+                ('export_date', models.DateField()),
+                ('status', models.CharField(default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_after', models.DateTimeField()),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('duration', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'core_exportjob',
+            },
+        ),
+        migrations.CreateModel(
+            name='MessageUserRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guild_id', models.CharField(default=core.models.default_guild_id, max_length=32)),
+                ('period', models.CharField(max_length=8)),
+                ('start', models.DateField()),
+                ('messages', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_messageuserrollup',
+            },
+        ),
+        migrations.CreateModel(
+            name='SheetLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spreadsheet_id', models.CharField(max_length=128)),
+                ('title', models.CharField(max_length=128)),
+                ('sheet_id', models.BigIntegerField()),
+                ('header', models.JSONField(default=list)),
+                ('header_checksum', models.CharField(blank=True, default='', max_length=40)),
+                ('rows', models.JSONField(default=dict)),
+                ('exported_through', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'core_sheetlayout',
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceChannelRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guild_id', models.CharField(default=core.models.default_guild_id, max_length=32)),
+                ('period', models.CharField(max_length=8)),
+                ('start', models.DateField()),
+                ('seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_voicechannelrollup',
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceChannelTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guild_id', models.CharField(default=core.models.default_guild_id, max_length=32)),
+                ('seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_voicechanneltotal',
+            },
+        ),
+        migrations.CreateModel(
+            name='VoiceUserRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guild_id', models.CharField(default=core.models.default_guild_id, max_length=32)),
+                ('period', models.CharField(max_length=8)),
+                ('start', models.DateField()),
+                ('seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'core_voiceuserrollup',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='messageuserdaily',
+            name='core_messag_guild_i_848433_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voiceuserchanneldaily',
+            name='core_voiceu_guild_i_3c14d9_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voiceuserdaily',
+            name='core_voiceu_guild_i_fc741f_idx',
+        ),
+        migrations.AddField(
+            model_name='daily',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='messageuserdaily',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='voicechanneldaily',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='voiceuserchanneldaily',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='voiceuserdaily',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='daily',
+            index=models.Index(fields=['guild_id', 'updated_at'], name='core_daily_guild_i_de133f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messageuserdaily',
+            index=models.Index(fields=['guild_id', 'date', '-messages', 'user'], name='core_messag_guild_i_ea3e78_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messageuserdaily',
+            index=models.Index(fields=['guild_id', 'updated_at'], name='core_messag_guild_i_bb4c99_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['updated_at'], name='core_userpr_updated_134d62_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voicechanneldaily',
+            index=models.Index(fields=['guild_id', 'updated_at'], name='core_voicec_guild_i_b71577_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceuserchanneldaily',
+            index=models.Index(fields=['guild_id', 'date', 'channel', '-seconds', 'user'], name='core_voiceu_guild_i_d79dc3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceuserchanneldaily',
+            index=models.Index(fields=['guild_id', 'updated_at'], name='core_voiceu_guild_i_805eb9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceuserdaily',
+            index=models.Index(fields=['guild_id', 'date', '-seconds', 'user'], name='core_voiceu_guild_i_8a6850_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voiceuserdaily',
+            index=models.Index(fields=['guild_id', 'updated_at'], name='core_voiceu_guild_i_e0909c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyrollup',
+            unique_together={('guild_id', 'period', 'start')},
+        ),
+        migrations.AddIndex(
+            model_name='exportjob',
+            index=models.Index(fields=['status', 'run_after'], name='core_export_status_251e26_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='exportjob',
+            unique_together={('kind', 'guild_id', 'export_date')},
+        ),
+        migrations.AddField(
+            model_name='messageuserrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sheetlayout',
+            unique_together={('spreadsheet_id', 'title')},
+        ),
+        migrations.AddField(
+            model_name='voicechannelrollup',
+            name='channel',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.voicechannel'),
+        ),
+        migrations.AddField(
+            model_name='voicechanneltotal',
+            name='channel',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.voicechannel'),
+        ),
+        migrations.AddField(
+            model_name='voiceuserrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.userprofile'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='messageuserrollup',
+            unique_together={('guild_id', 'user', 'period', 'start')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voicechannelrollup',
+            unique_together={('guild_id', 'channel', 'period', 'start')},
+        ),
+        migrations.AddIndex(
+            model_name='voicechanneltotal',
+            index=models.Index(fields=['channel'], name='core_voicec_channel_8b4fc5_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voicechanneltotal',
+            unique_together={('guild_id', 'channel')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='voiceuserrollup',
+            unique_together={('guild_id', 'user', 'period', 'start')},
+        ),
+    ]
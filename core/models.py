@@ -1,5 +1,22 @@
+from django.conf import settings
 from django.db import models
 
+
+def default_guild_id() -> str:
+    return settings.DEFAULT_GUILD_ID
+
+
+def guild_field():
+    # every stats row belongs to one guild; rows from the single-guild era get GUILD_ID
+    return models.CharField(max_length=32, default=default_guild_id)
+
+
+def changed_field():
+    # change marker for incremental exports (core.views.export_table); raw upserts and
+    # .update() calls set it explicitly, auto_now covers save() and bulk_create()
+    return models.DateTimeField(auto_now=True)
+
+
 class KV(models.Model):
     key = models.CharField(max_length=128, primary_key=True)
     val = models.TextField()
@@ -8,8 +25,21 @@ class KV(models.Model):
         db_table = 'core_kv'
 
 
+class Counter(models.Model):
+    # sharded counter: value = SUM over shards, writers add to a random shard
+    guild_id = guild_field()
+    name = models.CharField(max_length=64)
+    shard = models.SmallIntegerField(default=0)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_counter'
+        unique_together = (('guild_id', 'name', 'shard'),)
+
+
 class Daily(models.Model):
-    date = models.DateField(primary_key=True)
+    guild_id = guild_field()
+    date = models.DateField()
     members = models.IntegerField(default=0)
     joins = models.IntegerField(default=0)
     leaves = models.IntegerField(default=0)
@@ -17,13 +47,18 @@ class Daily(models.Model):
     messages_total = models.BigIntegerField(default=0)
     voice_seconds = models.BigIntegerField(default=0)
 
+    # maintained by the bot at ingest time (core.storage.bump_daily)
     unique_message_members = models.IntegerField(default=0)       # <= default=0
+    unique_voice_members = models.IntegerField(default=0)
     avg_messages_per_active_member = models.FloatField(default=0) # <= default=0.0
     visitors = models.IntegerField(default=0)   
+    updated_at = changed_field()
 
     class Meta:
         db_table = 'core_daily'
         ordering = ['-date']
+        unique_together = (('guild_id', 'date'),)
+        indexes = [models.Index(fields=['guild_id', 'updated_at'])]
 
 
 class UserProfile(models.Model):
@@ -33,83 +68,248 @@ class UserProfile(models.Model):
     avatar_url = models.TextField(blank=True, default='')
     joined_at = models.DateTimeField(null=True, blank=True)
     is_bot = models.BooleanField(default=False)
+    updated_at = changed_field()
 
     class Meta:
         db_table = 'core_userprofile'
+        indexes = [models.Index(fields=['updated_at'])]
 
 
 # ------ Voice (per user aggregate & per day) ------
 class VoiceUserTotal(models.Model):
-    user = models.OneToOneField(UserProfile, to_field='user_id', on_delete=models.CASCADE, primary_key=True)
+    guild_id = guild_field()
+    user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
     seconds = models.BigIntegerField(default=0)
 
     class Meta:
         db_table = 'core_voiceusertotal'
+        unique_together = (('guild_id', 'user'),)
+        indexes = [models.Index(fields=['user'])]
 
 
 class VoiceUserDaily(models.Model):
+    guild_id = guild_field()
     date = models.DateField()
     user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
     seconds = models.BigIntegerField(default=0)
+    updated_at = changed_field()
 
     class Meta:
         db_table = 'core_voiceuserdaily'
-        unique_together = (('date', 'user'),)
-        indexes = [models.Index(fields=['date']), models.Index(fields=['user'])]
+        unique_together = (('guild_id', 'date', 'user'),)
+        # also serves plain (guild, date) lookups; the order is the leaderboard's keyset
+        indexes = [
+            models.Index(fields=['guild_id', 'date', '-seconds', 'user']),
+            models.Index(fields=['user']),
+            models.Index(fields=['guild_id', 'updated_at']),
+        ]
 
 
 # ------ Messages (per user aggregate & per day) ------
 class MessageUserTotal(models.Model):
-    user = models.OneToOneField(UserProfile, to_field='user_id', on_delete=models.CASCADE, primary_key=True)
+    guild_id = guild_field()
+    user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
     messages = models.BigIntegerField(default=0)
 
     class Meta:
         db_table = 'core_messageusertotal'
+        unique_together = (('guild_id', 'user'),)
+        indexes = [models.Index(fields=['user'])]
 
 
 class MessageUserDaily(models.Model):
+    guild_id = guild_field()
     date = models.DateField()
     user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
     messages = models.IntegerField(default=0)
+    updated_at = changed_field()
 
     class Meta:
         db_table = 'core_messageuserdaily'
-        unique_together = (('date', 'user'),)
-        indexes = [models.Index(fields=['date']), models.Index(fields=['user'])]
+        unique_together = (('guild_id', 'date', 'user'),)
+        indexes = [
+            models.Index(fields=['guild_id', 'date', '-messages', 'user']),
+            models.Index(fields=['user']),
+            models.Index(fields=['guild_id', 'updated_at']),
+        ]
 
 
 # ------ NEW: Voice Channels ------
 class VoiceChannel(models.Model):
     channel_id = models.CharField(max_length=32, primary_key=True)
+    guild_id = guild_field()
     name = models.CharField(max_length=255, blank=True, default='')
     is_stage = models.BooleanField(default=False)
 
     class Meta:
         db_table = 'core_voicechannel'
+        indexes = [models.Index(fields=['guild_id'])]
+
+
+class VoiceChannelTotal(models.Model):
+    guild_id = guild_field()
+    channel = models.ForeignKey(VoiceChannel, to_field='channel_id', on_delete=models.CASCADE)
+    seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_voicechanneltotal'
+        unique_together = (('guild_id', 'channel'),)
+        indexes = [models.Index(fields=['channel'])]
 
 
 class VoiceChannelDaily(models.Model):
+    guild_id = guild_field()
     date = models.DateField()
     channel = models.ForeignKey(VoiceChannel, to_field='channel_id', on_delete=models.CASCADE)
     seconds = models.BigIntegerField(default=0)
+    updated_at = changed_field()
 
     class Meta:
         db_table = 'core_voicechanneldaily'
-        unique_together = (('date', 'channel'),)
-        indexes = [models.Index(fields=['date']), models.Index(fields=['channel'])]
+        unique_together = (('guild_id', 'date', 'channel'),)
+        indexes = [
+            models.Index(fields=['guild_id', 'date']),
+            models.Index(fields=['channel']),
+            models.Index(fields=['guild_id', 'updated_at']),
+        ]
 
 
 class VoiceUserChannelDaily(models.Model):
+    guild_id = guild_field()
     date = models.DateField()
     channel = models.ForeignKey(VoiceChannel, to_field='channel_id', on_delete=models.CASCADE)
     user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
     seconds = models.BigIntegerField(default=0)
+    updated_at = changed_field()
 
     class Meta:
         db_table = 'core_voiceuserchanneldaily'
-        unique_together = (('date', 'channel', 'user'),)
+        unique_together = (('guild_id', 'date', 'channel', 'user'),)
         indexes = [
-            models.Index(fields=['date']),
+            models.Index(fields=['guild_id', 'date', 'channel', '-seconds', 'user']),
             models.Index(fields=['channel']),
             models.Index(fields=['user']),
-        ]
\ No newline at end of file
+            models.Index(fields=['guild_id', 'updated_at']),
+        ]
+
+
+# ------ Rollups: weekly / monthly sums of the daily tables (core.rollups) ------
+class DailyRollup(models.Model):
+    """
+    Daily summed over a period: period 'week' starts on Monday, 'month' on the 1st.
+    members and messages_total are as of the last closed day of the period.
+    """
+    guild_id = guild_field()
+    period = models.CharField(max_length=8)
+    start = models.DateField()
+    days = models.IntegerField(default=0)
+    members = models.IntegerField(default=0)
+    joins = models.IntegerField(default=0)
+    leaves = models.IntegerField(default=0)
+    messages = models.BigIntegerField(default=0)
+    messages_total = models.BigIntegerField(default=0)
+    voice_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_dailyrollup'
+        unique_together = (('guild_id', 'period', 'start'),)
+
+
+class VoiceUserRollup(models.Model):
+    guild_id = guild_field()
+    user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
+    period = models.CharField(max_length=8)
+    start = models.DateField()
+    seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_voiceuserrollup'
+        unique_together = (('guild_id', 'user', 'period', 'start'),)
+
+
+class MessageUserRollup(models.Model):
+    guild_id = guild_field()
+    user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
+    period = models.CharField(max_length=8)
+    start = models.DateField()
+    messages = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_messageuserrollup'
+        unique_together = (('guild_id', 'user', 'period', 'start'),)
+
+
+class VoiceChannelRollup(models.Model):
+    guild_id = guild_field()
+    channel = models.ForeignKey(VoiceChannel, to_field='channel_id', on_delete=models.CASCADE)
+    period = models.CharField(max_length=8)
+    start = models.DateField()
+    seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'core_voicechannelrollup'
+        unique_together = (('guild_id', 'channel', 'period', 'start'),)
+
+
+class VoiceSession(models.Model):
+    """
+    Voice ledger: one row per stay in a channel. `last_checkpoint` is the time up to
+    which the stay has been credited to the voice tables; open rows have no ended_at.
+    """
+    guild_id = guild_field()
+    user = models.ForeignKey(UserProfile, to_field='user_id', on_delete=models.CASCADE)
+    channel_id = models.CharField(max_length=32)
+    joined_at = models.DateTimeField()
+    last_checkpoint = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'core_voicesession'
+        indexes = [
+            models.Index(fields=['guild_id', 'user'], condition=models.Q(ended_at__isnull=True),
+                         name='voicesession_open_user'),
+            models.Index(fields=['ended_at']),
+        ]
+
+
+class SheetLayout(models.Model):
+    """
+    Cached layout of an exported pivot worksheet: the header as last written and
+    id -> row. Exports trust it while the live header still matches the checksum.
+    `exported_through` is the newest date written, the watermark catch-up runs start from.
+    """
+    spreadsheet_id = models.CharField(max_length=128)
+    title = models.CharField(max_length=128)
+    sheet_id = models.BigIntegerField()
+    header = models.JSONField(default=list)
+    header_checksum = models.CharField(max_length=40, blank=True, default='')
+    rows = models.JSONField(default=dict)
+    exported_through = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'core_sheetlayout'
+        unique_together = (('spreadsheet_id', 'title'),)
+
+
+class ExportJob(models.Model):
+    """
+    Persisted export queue, worked by `manage.py export_worker`. One row per
+    (kind, guild, date): enqueueing the same export again resets that row.
+    """
+    kind = models.CharField(max_length=32)
+    guild_id = guild_field()
+    export_date = models.DateField()
+    status = models.CharField(max_length=16, default='pending')  # pending/running/done/failed/skipped
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField()
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    duration = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'core_exportjob'
+        unique_together = (('kind', 'guild_id', 'export_date'),)
+        indexes = [models.Index(fields=['status', 'run_after'])]
@@ -0,0 +1,175 @@
+"""
+Weekly and monthly rollups of the daily tables. A day is folded in once, when it
+closes: close_days() adds every day after the guild's watermark (KV
+'rollups_closed:<guild>') to the week and the month it belongs to, one
+transaction per day, and moves the watermark in the same transaction. Readers
+combine the rollups with the few daily rows after the watermark (open_days).
+Writes to days that are already closed (backfills, seed_history) are picked up
+by refold(), which recomputes the weeks and months they fall into.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Min
+
+from . import storage
+from .models import (
+    KV, Daily, DailyRollup,
+    VoiceUserDaily, VoiceUserRollup,
+    MessageUserDaily, MessageUserRollup,
+    VoiceChannelDaily, VoiceChannelRollup,
+)
+
+DAY, WEEK, MONTH = 'day', 'week', 'month'
+PERIODS = (WEEK, MONTH)
+
+# Daily fields that add up over a period; members / messages_total are snapshots
+DAILY_SUMS = ('joins', 'leaves', 'messages', 'voice_seconds')
+
+
+def period_start(period: str, d: datetime.date) -> datetime.date:
+    if period == WEEK:
+        return d - datetime.timedelta(days=d.weekday())
+    if period == MONTH:
+        return d.replace(day=1)
+    return d
+
+
+def _key(guild_id: str) -> str:
+    return f'rollups_closed:{guild_id}'
+
+
+def watermark(guild_id: str) -> datetime.date | None:
+    """Last day folded into the rollups, None before the first close."""
+    val = KV.objects.filter(pk=_key(guild_id)).values_list('val', flat=True).first()
+    return datetime.date.fromisoformat(val) if val else None
+
+
+def _first_day(guild_id: str) -> datetime.date | None:
+    firsts = [m.objects.filter(guild_id=guild_id).aggregate(d=Min('date'))['d']
+              for m in (Daily, VoiceUserDaily, MessageUserDaily)]
+    return min((d for d in firsts if d), default=None)
+
+
+def _fold_day(guild_id: str, d: datetime.date, periods: tuple[str, ...] = PERIODS):
+    for table, model, key, val in (
+        (VoiceUserDaily, VoiceUserRollup, 'user', 'seconds'),
+        (MessageUserDaily, MessageUserRollup, 'user', 'messages'),
+        (VoiceChannelDaily, VoiceChannelRollup, 'channel', 'seconds'),
+    ):
+        rows = table.objects.filter(guild_id=guild_id, date=d).values_list(f'{key}_id', val)
+        deltas = {}
+        for ref, v in rows:
+            for p in periods:
+                deltas[(guild_id, ref, p, period_start(p, d))] = v
+        storage.upsert_add(model, ('guild_id', key, 'period', 'start'), val, deltas)
+
+    day = Daily.objects.filter(guild_id=guild_id, date=d).values(
+        'members', 'messages_total', *DAILY_SUMS).first()
+    if day is None:
+        # `days` counts Daily rows, as series() does for the days not closed yet
+        return
+    for p in periods:
+        row, _ = DailyRollup.objects.select_for_update().get_or_create(
+            guild_id=guild_id, period=p, start=period_start(p, d))
+        row.days += 1
+        for f in DAILY_SUMS:
+            setattr(row, f, getattr(row, f) + int(day[f] or 0))
+        row.members = day['members']
+        row.messages_total = day['messages_total']
+        row.save()
+
+
+def close_days(guild_id: str, upto: datetime.date) -> int:
+    """Fold every day after the watermark up to `upto` into the rollups; returns the days folded."""
+    last = watermark(guild_id)
+    d = last + datetime.timedelta(days=1) if last else _first_day(guild_id)
+    n = 0
+    while d is not None and d <= upto:
+        with transaction.atomic():
+            kv, _ = KV.objects.select_for_update().get_or_create(pk=_key(guild_id), defaults={'val': ''})
+            # another closer got here first
+            if kv.val and datetime.date.fromisoformat(kv.val) >= d:
+                d = datetime.date.fromisoformat(kv.val) + datetime.timedelta(days=1)
+                continue
+            _fold_day(guild_id, d)
+            kv.val = d.isoformat()
+            kv.save()
+        n += 1
+        d += datetime.timedelta(days=1)
+    return n
+
+
+def refold(guild_id: str, date_from: datetime.date, date_to: datetime.date | None = None) -> int:
+    """
+    Recompute every closed week and month overlapping [date_from, date_to] from the
+    daily tables, one transaction per period; days after the watermark are left to
+    close_days. Returns the periods rebuilt.
+    """
+    first = _first_day(guild_id)
+    n = 0
+    for p in PERIODS:
+        start = period_start(p, date_from)
+        while date_to is None or start <= date_to:
+            with transaction.atomic():
+                kv = KV.objects.select_for_update().filter(pk=_key(guild_id)).first()
+                closed = datetime.date.fromisoformat(kv.val) if kv and kv.val else None
+                if closed is None or start > closed:
+                    break
+                for model in (DailyRollup, VoiceUserRollup, MessageUserRollup, VoiceChannelRollup):
+                    model.objects.filter(guild_id=guild_id, period=p, start=start).delete()
+                # close_days starts at the first day with data; count the same days
+                d = max(start, first) if first else start
+                while d <= min(period_end(p, start), closed):
+                    _fold_day(guild_id, d, (p,))
+                    d += datetime.timedelta(days=1)
+            n += 1
+            start = period_end(p, start) + datetime.timedelta(days=1)
+    return n
+
+
+def clear(guild_id: str):
+    """Drop a guild's rollups and watermark, so the next close_days rebuilds them from day one."""
+    with transaction.atomic():
+        for model in (DailyRollup, VoiceUserRollup, MessageUserRollup, VoiceChannelRollup):
+            model.objects.filter(guild_id=guild_id).delete()
+        KV.objects.filter(pk=_key(guild_id)).delete()
+
+
+def period_end(period: str, d: datetime.date) -> datetime.date:
+    start = period_start(period, d)
+    if period == WEEK:
+        return start + datetime.timedelta(days=6)
+    if period == MONTH:
+        return (start + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    return d
+
+
+def series(rollup_qs, daily_qs, closed: datetime.date | None, period: str, fields: list[str],
+           date_from: datetime.date | None = None, date_to: datetime.date | None = None,
+           snapshots: tuple[str, ...] = ()) -> list[dict]:
+    """
+    One row per `period` ({'start', *fields}), newest first. Days up to `closed` (the
+    watermark) come from `rollup_qs`, later ones are summed from `daily_qs` on the
+    fly; both use the same field names. Periods overlapping [date_from, date_to] are
+    returned whole. `snapshots` fields take the latest day's value instead of a sum;
+    a 'days' field counts the days seen.
+    """
+    rq = rollup_qs.filter(period=period)
+    dq = daily_qs.filter(date__gt=closed) if closed else daily_qs
+    if date_from:
+        rq = rq.filter(start__gte=period_start(period, date_from))
+        dq = dq.filter(date__gte=period_start(period, date_from))
+    if date_to:
+        rq = rq.filter(start__lte=date_to)
+        dq = dq.filter(date__lte=period_end(period, date_to))
+    counted = [f for f in fields if f != 'days']
+    out = {r['start']: r for r in rq.values('start', *fields)}
+    for r in dq.order_by('date').values('date', *counted):
+        start = period_start(period, r['date'])
+        row = out.setdefault(start, {'start': start, **dict.fromkeys(fields, 0)})
+        for f in counted:
+            row[f] = int(r[f] or 0) if f in snapshots else int(row[f] or 0) + int(r[f] or 0)
+        if 'days' in row:
+            row['days'] += 1
+    return [out[k] for k in sorted(out, reverse=True)]
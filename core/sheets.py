@@ -0,0 +1,436 @@
+"""
+Google Sheets pivot export: one worksheet per pivot, rows are ids, columns the base
+fields followed by one column per exported date.
+
+A run costs three API calls whatever the sheet size or the number of dates: the
+sheet metadata, the header rows of all pivots, and one spreadsheets.batchUpdate
+carrying every write. A catch-up run also fills the days missing since the
+watermark (SheetLayout.exported_through) or from gaps in the header.
+Runs are idempotent: a retry after a lost response finds the header changed,
+rebuilds the layout from column A and rewrites the same cells.
+The id -> row layout is cached in SheetLayout and trusted while the live header
+still matches its checksum; otherwise column A is read back once to rebuild it.
+"""
+import json
+import time
+import zlib
+import bisect
+import hashlib
+import datetime
+import threading
+
+from django.db.models import Sum
+
+from .models import (
+    SheetLayout, UserProfile,
+    VoiceUserDaily, VoiceUserTotal,
+    VoiceChannel, VoiceChannelDaily, VoiceChannelTotal,
+)
+
+API_BASE = 'https://sheets.googleapis.com/v4'
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+META_FIELDS = 'sheets(properties(sheetId,title,gridProperties(rowCount,columnCount)))'
+NEW_SHEET_ROWS = 1000
+NEW_SHEET_COLS = 26
+
+# worth another attempt later; anything else (400, 403, 404) will not get better
+RETRYABLE = {408, 429, 500, 502, 503, 504}
+
+
+class SheetsError(Exception):
+    def __init__(self, status: int, message: str, retry_after: float | None = None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in RETRYABLE
+
+
+class TokenBucket:
+    """`rate` tokens per minute, up to `burst` saved up; acquire() blocks until one is free."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.per_sec = rate / 60
+        self.burst = burst or max(int(rate // 6), 1)
+        self.tokens = float(self.burst)
+        self.at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.at) * self.per_sec)
+                self.at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.per_sec
+            time.sleep(wait)
+
+
+class Quota:
+    """Sheets counts read and write requests per minute separately."""
+
+    def __init__(self, reads_per_min: float, writes_per_min: float):
+        self.buckets = {'read': TokenBucket(reads_per_min), 'write': TokenBucket(writes_per_min)}
+
+    def acquire(self, kind: str):
+        self.buckets[kind].acquire()
+
+
+_sessions: dict[str, object] = {}
+_sessions_lock = threading.Lock()
+
+
+def session(service_account: str):
+    """
+    HTTP session for the Sheets API, built once per process: the service account
+    is parsed once and the access token refreshed only when it expires. Without a
+    service account (a local fake server) a plain session is returned.
+    """
+    with _sessions_lock:
+        if service_account not in _sessions:
+            if not service_account:
+                import requests
+                _sessions[service_account] = requests.Session()
+            else:
+                from google.auth.transport.requests import AuthorizedSession
+                from google.oauth2.service_account import Credentials
+                if service_account.startswith('{'):
+                    creds = Credentials.from_service_account_info(json.loads(service_account), scopes=SCOPES)
+                else:
+                    creds = Credentials.from_service_account_file(service_account, scopes=SCOPES)
+                _sessions[service_account] = AuthorizedSession(creds)
+        return _sessions[service_account]
+
+
+class RestBackend:
+    """The three calls an export needs, straight against the Sheets REST API (or `base`)."""
+
+    def __init__(self, http, spreadsheet_id: str, base: str = API_BASE, quota: Quota | None = None,
+                 timeout: float = 60):
+        self.http = http
+        self.url = f"{base.rstrip('/')}/spreadsheets/{spreadsheet_id}"
+        self.quota = quota
+        self.timeout = timeout
+        self.calls = 0
+
+    def _call(self, kind: str, method: str, url: str, **kw) -> dict:
+        if self.quota:
+            self.quota.acquire(kind)
+        self.calls += 1
+        try:
+            r = self.http.request(method, url, timeout=self.timeout, **kw)
+        except OSError as e:
+            # connection reset, timeout, DNS: transient
+            raise SheetsError(503, repr(e)) from e
+        if r.status_code >= 400:
+            ra = r.headers.get('Retry-After')
+            raise SheetsError(r.status_code, r.text[:500], float(ra) if ra and ra.isdigit() else None)
+        return r.json() if r.content else {}
+
+    def metadata(self) -> dict:
+        return self._call('read', 'GET', self.url, params={'fields': META_FIELDS})
+
+    def get_values(self, ranges: list[str]) -> list[list[list]]:
+        resp = self._call('read', 'GET', self.url + '/values:batchGet', params={'ranges': ranges})
+        return [vr.get('values', []) for vr in resp.get('valueRanges', [])]
+
+    def batch_update(self, requests: list[dict]):
+        return self._call('write', 'POST', self.url + ':batchUpdate', json={'requests': requests})
+
+
+class Pivot:
+    """
+    One exported worksheet. `days(gid, dates)` returns {date_str: {id: hours}} for
+    a set of dates in one query, `totals(gid)` {id: hours} and `names(ids)` the
+    label for rows that are new to the sheet.
+    """
+
+    def __init__(self, title: str, base_header: list[str], days, totals, names):
+        self.title = title
+        self.base_header = base_header
+        self.days = days
+        self.totals = totals
+        self.names = names
+
+
+def _hours(rows, key: str) -> dict[str, float]:
+    return {str(r[key]): round(int(r['sec'] or 0) / 3600, 2) for r in rows}
+
+
+def _hours_by_date(rows, key: str) -> dict[str, dict[str, float]]:
+    out: dict[str, dict[str, float]] = {}
+    for r in rows:
+        out.setdefault(str(r['date']), {})[str(r[key])] = round(int(r['sec'] or 0) / 3600, 2)
+    return out
+
+
+def _users_days(gid: str, dates: list[datetime.date]) -> dict[str, dict[str, float]]:
+    return _hours_by_date(VoiceUserDaily.objects.filter(guild_id=gid, date__in=dates)
+                          .values('date', 'user_id').annotate(sec=Sum('seconds')), 'user_id')
+
+
+def _users_totals(gid: str) -> dict[str, float]:
+    return _hours(VoiceUserTotal.objects.filter(guild_id=gid)
+                  .values('user_id').annotate(sec=Sum('seconds')), 'user_id')
+
+
+def _user_names(ids: list[str]) -> dict[str, str]:
+    return dict(UserProfile.objects.filter(user_id__in=ids).values_list('user_id', 'username'))
+
+
+def _channels_days(gid: str, dates: list[datetime.date]) -> dict[str, dict[str, float]]:
+    return _hours_by_date(VoiceChannelDaily.objects.filter(guild_id=gid, date__in=dates)
+                          .values('date', 'channel_id').annotate(sec=Sum('seconds')), 'channel_id')
+
+
+def _channels_totals(gid: str) -> dict[str, float]:
+    return _hours(VoiceChannelTotal.objects.filter(guild_id=gid)
+                  .values('channel_id').annotate(sec=Sum('seconds')), 'channel_id')
+
+
+def _channel_names(ids: list[str]) -> dict[str, str]:
+    return dict(VoiceChannel.objects.filter(channel_id__in=ids).values_list('channel_id', 'name'))
+
+
+PIVOTS = [
+    Pivot('VoiceUsersPivot', ['user_id', 'username', 'total_hours'], _users_days, _users_totals, _user_names),
+    Pivot('VoiceChannelsPivot', ['channel_id', 'channel_name', 'total_hours'],
+          _channels_days, _channels_totals, _channel_names),
+]
+
+TOTAL_COL = 2  # 0-based: the total_hours column of every pivot
+
+
+def _checksum(header: list) -> str:
+    return hashlib.sha1('\x1f'.join(map(str, header)).encode()).hexdigest()
+
+
+def _a1(title: str, rng: str) -> str:
+    return "'" + title.replace("'", "''") + "'!" + rng
+
+
+def _cell(v) -> dict:
+    if isinstance(v, (int, float)):
+        return {'userEnteredValue': {'numberValue': v}}
+    return {'userEnteredValue': {'stringValue': str(v)}}
+
+
+def _write(sheet_id: int, row: int, col: int, values: list[list]) -> dict:
+    """updateCells for a block of values, top-left at 0-based (row, col)."""
+    return {'updateCells': {
+        'start': {'sheetId': sheet_id, 'rowIndex': row, 'columnIndex': col},
+        'rows': [{'values': [_cell(v) for v in r]} for r in values],
+        'fields': 'userEnteredValue',
+    }}
+
+
+def _grow(sheet_id: int, dimension: str, length: int) -> dict:
+    return {'appendDimension': {'sheetId': sheet_id, 'dimension': dimension, 'length': length}}
+
+
+def _load_layouts(backend, spreadsheet_id: str, pivots: list[Pivot]) -> dict[str, dict]:
+    """
+    title -> {'sheet_id', 'header', 'rows', 'grid': [rows, cols], 'exists', 'exported_through'};
+    reads the sheet as little as possible.
+    """
+    sheets = {s['properties']['title']: s['properties'] for s in backend.metadata().get('sheets', [])}
+    taken = {p['sheetId'] for p in sheets.values()}
+    cached = {l.title: l for l in SheetLayout.objects.filter(spreadsheet_id=spreadsheet_id,
+                                                             title__in=[p.title for p in pivots])}
+    present = [p for p in pivots if p.title in sheets]
+    live = dict(zip([p.title for p in present],
+                    backend.get_values([_a1(p.title, '1:1') for p in present]) if present else []))
+
+    out, rebuild = {}, []
+    for p in pivots:
+        props = sheets.get(p.title)
+        if props is None:
+            sid = zlib.crc32(p.title.encode()) & 0x7fffffff
+            while sid in taken:
+                sid += 1
+            taken.add(sid)
+            out[p.title] = {'sheet_id': sid, 'header': list(p.base_header), 'rows': {},
+                            'grid': [NEW_SHEET_ROWS, NEW_SHEET_COLS], 'exists': False, 'exported_through': None}
+            continue
+        grid = props.get('gridProperties', {})
+        values = live.get(p.title) or []
+        header = values[0] if values else []
+        entry = {'sheet_id': props['sheetId'], 'header': list(header) or list(p.base_header), 'rows': {},
+                 'grid': [grid.get('rowCount', NEW_SHEET_ROWS), grid.get('columnCount', NEW_SHEET_COLS)],
+                 'exists': True, 'header_written': bool(header), 'exported_through': None}
+        c = cached.get(p.title)
+        if c and c.sheet_id == props['sheetId']:
+            entry['exported_through'] = c.exported_through
+        if (c and header and c.sheet_id == props['sheetId'] and c.header_checksum == _checksum(header)
+                and max(c.rows.values(), default=1) <= entry['grid'][0]):
+            entry['rows'] = dict(c.rows)
+        else:
+            rebuild.append(p.title)
+        out[p.title] = entry
+
+    if rebuild:
+        for title, col in zip(rebuild, backend.get_values([_a1(t, 'A2:A') for t in rebuild])):
+            out[title]['rows'] = {str(r[0]).strip(): i + 2 for i, r in enumerate(col) if r and str(r[0]).strip()}
+    return out
+
+
+def missing_dates(lay: dict, base: int, upto: datetime.date, max_dates: int) -> set[str]:
+    """
+    Dates up to `upto` that belong in the sheet but have no column: every day of the
+    kept window since the sheet's oldest date column or the day after the watermark
+    (the newest date exported), whichever is earlier. A sheet without either only
+    gets `upto`.
+    """
+    have = set(lay['header'][base:])
+    starts = [datetime.date.fromisoformat(d) for d in have if _is_date(d)]
+    if lay['exported_through']:
+        starts.append(lay['exported_through'] + datetime.timedelta(days=1))
+    lo = max(min(starts, default=upto), upto - datetime.timedelta(days=max_dates - 1))
+    out = set()
+    while lo <= upto:
+        if str(lo) not in have:
+            out.add(str(lo))
+        lo += datetime.timedelta(days=1)
+    return out
+
+
+def _is_date(v) -> bool:
+    try:
+        datetime.date.fromisoformat(str(v))
+    except ValueError:
+        return False
+    return True
+
+
+def _runs(cols: list[int]) -> list[tuple[int, int]]:
+    """Sorted column indexes -> (first, count) of each contiguous run."""
+    out: list[list[int]] = []
+    for c in cols:
+        if out and out[-1][0] + out[-1][1] == c:
+            out[-1][1] += 1
+        else:
+            out.append([c, 1])
+    return [(a, n) for a, n in out]
+
+
+def _pivot_requests(p: Pivot, lay: dict, day_maps: dict[str, dict[str, float]], totals: dict[str, float],
+                    max_dates: int):
+    sid, header, rows = lay['sheet_id'], lay['header'], lay['rows']
+    grid_rows, grid_cols = lay['grid']
+    base = len(p.base_header)
+    reqs = []
+    if not lay['exists']:
+        reqs.append({'addSheet': {'properties': {
+            'sheetId': sid, 'title': p.title,
+            'gridProperties': {'rowCount': grid_rows, 'columnCount': grid_cols},
+        }}})
+
+    header_changed = not lay.get('header_written')
+    dates = header[base:]
+    # a date older than everything kept would be trimmed right away
+    keep = set(sorted(set(dates) | set(day_maps))[-max_dates:])
+    skipped = sorted(d for d in day_maps if d not in keep)
+    day_maps = {d: m for d, m in day_maps.items() if d in keep}
+    new = sorted(d for d in day_maps if d not in dates)
+    if new:
+        # date columns stay in order: each gap in the old header gets one insertDimension,
+        # right to left so the indexes of the gaps still to come do not move
+        at: dict[int, list[str]] = {}
+        for d in new:
+            at.setdefault(bisect.bisect(dates, d), []).append(d)
+        for pos in sorted(at, reverse=True):
+            n = len(at[pos])
+            if base + pos < len(header):
+                reqs.append({'insertDimension': {'range': {
+                    'sheetId': sid, 'dimension': 'COLUMNS', 'startIndex': base + pos, 'endIndex': base + pos + n,
+                }, 'inheritFromBefore': False}})
+                grid_cols += n
+            header[base + pos:base + pos] = at[pos]
+        header_changed = True
+    dates = header[base:]
+    if len(dates) > max_dates:
+        # the oldest date columns go; everything right of them shifts left
+        k = len(dates) - max_dates
+        if lay['exists']:
+            reqs.append({'deleteDimension': {'range': {
+                'sheetId': sid, 'dimension': 'COLUMNS', 'startIndex': base, 'endIndex': base + k,
+            }}})
+            grid_cols -= k
+        header[base:] = dates[k:]
+        header_changed = True
+    cols = {d: header.index(d) for d in day_maps}
+    if len(header) > grid_cols:
+        reqs.append(_grow(sid, 'COLUMNS', len(header) - grid_cols))
+
+    last_row = max(rows.values(), default=1)
+    new_ids = sorted({i for m in day_maps.values() for i in m if i not in rows})
+    names = p.names(new_ids) if new_ids else {}
+    if last_row + len(new_ids) > grid_rows:
+        reqs.append(_grow(sid, 'ROWS', last_row + len(new_ids) - grid_rows))
+
+    if header_changed:
+        reqs.append(_write(sid, 0, 0, [header]))
+    if last_row >= 2 and day_maps:
+        # rows already in the sheet: the exported days (0 when idle), one block per run of
+        # adjacent columns, and the totals
+        by_row = {r: i for i, r in rows.items()}
+        ids = [by_row.get(r) for r in range(2, last_row + 1)]
+        for first, n in _runs(sorted(cols.values())):
+            maps = [day_maps[d] for d in header[first:first + n]]
+            reqs.append(_write(sid, 1, first, [[m.get(i, 0.0) if i else 0.0 for m in maps] for i in ids]))
+        reqs.append(_write(sid, 1, TOTAL_COL, [[totals.get(i, 0.0) if i else 0.0] for i in ids]))
+    if new_ids:
+        block = []
+        for i in new_ids:
+            row = [i, names.get(i, '') or '', totals.get(i, 0.0)] + [0.0] * (len(header) - base)
+            for d, c in cols.items():
+                row[c] = day_maps[d].get(i, 0.0)
+            block.append(row)
+            last_row += 1
+            rows[i] = last_row
+        reqs.append(_write(sid, last_row - len(new_ids), 0, block))
+    return reqs, {'dates': sorted(day_maps), 'skipped': skipped,
+                  'values': sum(len(m) for m in day_maps.values()), 'new_rows': len(new_ids)}
+
+
+def export_pivots(backend, spreadsheet_id: str, gid: str, dates: list[datetime.date], max_dates: int,
+                  catch_up: bool = False, pivots: list[Pivot] = PIVOTS) -> dict[str, dict]:
+    """
+    Write `dates` of guild `gid` into every pivot with a single batchUpdate; with
+    `catch_up` also every date the sheets are missing up to the newest of `dates`
+    (see missing_dates). The per-day maps of all dates come from one query per
+    table. Returns per-pivot counts.
+    """
+    layouts = _load_layouts(backend, spreadsheet_id, pivots)
+    wanted = {str(d) for d in dates}
+    if catch_up and dates:
+        for p in pivots:
+            wanted |= missing_dates(layouts[p.title], len(p.base_header), max(dates), max_dates)
+    wanted_dates = sorted(datetime.date.fromisoformat(d) for d in wanted)
+    requests, summary = [], {}
+    for p in pivots:
+        by_date = p.days(gid, wanted_dates)
+        day_maps = {d: by_date.get(d, {}) for d in sorted(wanted)}
+        reqs, summary[p.title] = _pivot_requests(p, layouts[p.title], day_maps, p.totals(gid), max_dates)
+        requests += reqs
+    if requests:
+        backend.batch_update(requests)
+
+    for p in pivots:
+        lay, written = layouts[p.title], summary[p.title]['dates']
+        through = lay['exported_through']
+        if written:
+            newest = datetime.date.fromisoformat(written[-1])
+            through = max(through, newest) if through else newest
+        SheetLayout.objects.update_or_create(
+            spreadsheet_id=spreadsheet_id, title=p.title,
+            defaults={'sheet_id': lay['sheet_id'], 'header': lay['header'],
+                      'header_checksum': _checksum(lay['header']), 'rows': lay['rows'],
+                      'exported_through': through},
+        )
+    return summary
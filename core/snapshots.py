@@ -0,0 +1,214 @@
+"""
+The full XLSX export, and prebuilt copies of it on disk. After the day close the
+export worker writes the workbook of every day through the closed one to
+SNAPSHOT_DIR/<guild>/export-<last day>.xlsx. The API copies the rows of the newest
+file and reads only the days after it from the DB (with_open_days), or serves the
+file as is. The SNAPSHOT_KEEP newest files per guild are kept.
+"""
+import os
+import re
+import time
+import datetime
+import itertools
+from typing import Any, Dict, List, NamedTuple
+
+from django.conf import settings
+from django.db.models import Q
+
+from . import xlsx_stream
+from .models import (
+    Daily, UserProfile, VoiceChannel, VoiceChannelDaily, VoiceUserChannelDaily, MessageUserDaily,
+)
+
+# rows per round trip of the server-side cursors behind the export
+CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '2000'))
+# shared by the worker (writes) and the web service (reads)
+SNAPSHOT_DIR = os.getenv('EXPORT_SNAPSHOT_DIR', '').strip() or os.path.join(settings.BASE_DIR, 'snapshots')
+SNAPSHOT_KEEP = int(os.getenv('EXPORT_SNAPSHOT_KEEP', '7'))
+
+_NAME = re.compile(r'^export-(\d{4}-\d{2}-\d{2})\.xlsx$')
+_XML_ILLEGAL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def excel_safe(v: Any):
+    if isinstance(v, datetime.datetime):
+        return v.replace(tzinfo=None)
+    if isinstance(v, str):
+        # control characters (e.g. in a display name) are not allowed in the sheet XML
+        return _XML_ILLEGAL.sub('', v)
+    try:
+        return v.isoformat()  # type: ignore[attr-defined]
+    except Exception:
+        return v
+
+
+def workbook(g: str, date_from: datetime.date | None = None, date_to: datetime.date | None = None) -> List[tuple]:
+    """
+    (title, rows) of the export, optionally limited to a date range (Profiles is
+    always whole); rows are generators over DB iterators, header first.
+    """
+    n = CHUNK_ROWS
+
+    def dated(qs):
+        if date_from:
+            qs = qs.filter(date__gte=date_from)
+        if date_to:
+            qs = qs.filter(date__lte=date_to)
+        return qs
+
+    def daily():
+        yield [
+            'date', 'members', 'joins', 'leaves',
+            'messages', 'messages_total', 'voice_seconds', 'voice_hours',
+            'unique_message_members', 'avg_messages_per_active_member',
+        ]
+        for r in dated(Daily.objects.filter(guild_id=g)).order_by('date').values(
+            'date', 'members', 'joins', 'leaves', 'messages', 'messages_total', 'voice_seconds',
+            'unique_message_members', 'avg_messages_per_active_member',
+        ).iterator(chunk_size=n):
+            yield [
+                excel_safe(r['date']),
+                r['members'] or 0, r['joins'] or 0, r['leaves'] or 0,
+                int(r['messages'] or 0), r['messages_total'] or 0,
+                r['voice_seconds'] or 0, round((int(r['voice_seconds'] or 0)) / 3600, 2),
+                int(r['unique_message_members'] or 0), round(float(r['avg_messages_per_active_member'] or 0), 2),
+            ]
+
+    id2name: Dict[str, str] = {}
+
+    def voice_by_channel():
+        id2name.update(VoiceChannel.objects.filter(guild_id=g).values_list('channel_id', 'name'))
+        yield ['date', 'channel_id', 'channel_name', 'seconds', 'hours']
+        for r in dated(VoiceChannelDaily.objects.filter(guild_id=g)).order_by('date', 'channel_id')\
+                .values('date', 'channel_id', 'seconds').iterator(chunk_size=n):
+            sec = int(r['seconds'] or 0)
+            yield [excel_safe(r['date']), r['channel_id'], id2name.get(r['channel_id'], ''), sec, round(sec / 3600, 2)]
+
+    def voice_user_by_channel():
+        yield ['date', 'channel_id', 'channel_name', 'user_id', 'seconds', 'hours']
+        for r in dated(VoiceUserChannelDaily.objects.filter(guild_id=g)).order_by('date', 'channel_id', 'user_id')\
+                .values('date', 'channel_id', 'user_id', 'seconds').iterator(chunk_size=n):
+            sec = int(r['seconds'] or 0)
+            yield [
+                excel_safe(r['date']), r['channel_id'], id2name.get(r['channel_id'], ''),
+                r['user_id'], sec, round(sec / 3600, 2),
+            ]
+
+    def messages_by_day():
+        yield ['user_id', 'date', 'messages']
+        for r in dated(MessageUserDaily.objects.filter(guild_id=g)).order_by('date', 'user_id')\
+                .values('user_id', 'date', 'messages').iterator(chunk_size=n):
+            yield [r['user_id'], excel_safe(r['date']), int(r['messages'] or 0)]
+
+    def profiles():
+        yield ['user_id', 'username', 'display_name', 'avatar_url', 'joined_at', 'is_bot']
+        members = Q(voiceusertotal__guild_id=g) | Q(messageusertotal__guild_id=g)
+        for p in UserProfile.objects.filter(members).distinct().order_by('user_id').values(
+            'user_id', 'username', 'display_name', 'avatar_url', 'joined_at', 'is_bot'
+        ).iterator(chunk_size=n):
+            yield [
+                p['user_id'], excel_safe(p.get('username') or ''), excel_safe(p.get('display_name') or ''),
+                excel_safe(p.get('avatar_url') or ''), excel_safe(p.get('joined_at') or ''), bool(p.get('is_bot')),
+            ]
+
+    return [
+        ('Daily', daily()),
+        ('VoiceByChannelDay', voice_by_channel()),
+        ('VoiceUserByChannelDay', voice_user_by_channel()),
+        ('MessagesByDay', messages_by_day()),
+        ('Profiles', profiles()),
+    ]
+
+
+class Snapshot(NamedTuple):
+    path: str
+    through: datetime.date
+
+
+def _dir(guild_id: str) -> str | None:
+    # the guild id comes from the query string when reading
+    if not re.fullmatch(r'[\w-]+', guild_id or ''):
+        return None
+    return os.path.join(SNAPSHOT_DIR, guild_id)
+
+
+def available(guild_id: str) -> List[Snapshot]:
+    """Snapshots on disk, newest first."""
+    d = _dir(guild_id)
+    try:
+        names = os.listdir(d) if d else []
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        m = _NAME.match(name)
+        if m:
+            found.append(Snapshot(os.path.join(d, name), datetime.date.fromisoformat(m.group(1))))
+    return sorted(found, key=lambda s: s.through, reverse=True)
+
+
+def latest(guild_id: str, through: datetime.date | None = None) -> Snapshot | None:
+    """The newest snapshot, or the one ending on `through`."""
+    for s in available(guild_id):
+        if through is None or s.through == through:
+            return s
+    return None
+
+
+def build(guild_id: str, through: datetime.date) -> Snapshot:
+    """Write the export of every day up to `through`; readers only ever see a complete file."""
+    d = _dir(guild_id)
+    if d is None:
+        raise ValueError(f"bad guild id: {guild_id!r}")
+    os.makedirs(d, exist_ok=True)
+    path = os.path.join(d, f'export-{through.isoformat()}.xlsx')
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in xlsx_stream.stream(workbook(guild_id, date_to=through)):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return Snapshot(path, through)
+
+
+def _after_header(rows):
+    next(rows, None)
+    yield from rows
+
+
+def with_open_days(snap: Snapshot, g: str) -> List[tuple] | None:
+    """
+    The full export from a snapshot: its rows as stored, then the days after it
+    from the DB. Profiles has no dates and is always read whole. None when the
+    snapshot was written with other sheets than workbook() has now.
+    """
+    live = workbook(g, date_from=snap.through + datetime.timedelta(days=1))
+    if xlsx_stream.sheet_titles(snap.path) != [title for title, _ in live]:
+        return None
+    return [
+        (title, rows if title == 'Profiles'
+         else itertools.chain(xlsx_stream.sheet_rows(snap.path, i), _after_header(rows)))
+        for i, (title, rows) in enumerate(live, 1)
+    ]
+
+
+def prune(guild_id: str, keep: int = SNAPSHOT_KEEP) -> List[str]:
+    """Remove all but the `keep` newest snapshots, and temp files of builds that died; returns removed paths."""
+    removed = [s.path for s in available(guild_id)[max(keep, 1):]]
+    d = _dir(guild_id)
+    if d and os.path.isdir(d):
+        stale = time.time() - 3600
+        removed += [os.path.join(d, n) for n in os.listdir(d)
+                    if n.endswith('.tmp') and os.path.getmtime(os.path.join(d, n)) < stale]
+    for path in removed:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,318 @@
+import os
+import random
+import datetime
+from typing import Iterable, Sequence
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf
+from django.utils import timezone
+
+from .models import (
+    KV, Counter, Daily, VoiceSession,
+    UserProfile,
+    VoiceUserDaily, VoiceUserTotal,
+    MessageUserDaily, MessageUserTotal,
+    VoiceChannel, VoiceChannelDaily, VoiceChannelTotal, VoiceUserChannelDaily,
+)
+
+# rows per INSERT statement; keeps the parameter count well under driver limits
+BATCH_ROWS = 1000
+
+# writers spread increments over shards 1..COUNTER_SHARDS; shard 0 holds the legacy KV value
+COUNTER_SHARDS = int(os.getenv('COUNTER_SHARDS', '8'))
+
+MESSAGES_TOTAL = 'messages_total'
+# bumped with every write the API can see; cached API responses are keyed by it
+DATA_VERSION = 'data_version'
+
+# all writes below are scoped to one guild, so each guild's batch is its own transaction
+
+# (user_id, channel_id or None, date, seconds)
+VoiceDelta = tuple[str, str | None, datetime.date, int]
+
+
+def _table(model) -> str:
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _col(model, field: str) -> str:
+    return connection.ops.quote_name(model._meta.get_field(field).column)
+
+
+def _chunks(rows: list, n: int = BATCH_ROWS):
+    for i in range(0, len(rows), n):
+        yield rows[i:i + n]
+
+
+def _existing_keys(model, key_fields: Sequence[str], keys: list[tuple]) -> set[tuple]:
+    table = _table(model)
+    cols = [_col(model, f) for f in key_fields]
+    fields = [model._meta.get_field(f) for f in key_fields]
+    one = "(" + ", ".join(["%s"] * len(cols)) + ")"
+    found = set()
+    with connection.cursor() as cur:
+        for chunk in _chunks(keys):
+            cur.execute(
+                f"SELECT {', '.join(cols)} FROM {table} "
+                f"WHERE ({', '.join(cols)}) IN (VALUES {', '.join([one] * len(chunk))})",
+                [v for k in chunk for v in k],
+            )
+            found.update(tuple(f.to_python(v) for f, v in zip(fields, r)) for r in cur.fetchall())
+    return found
+
+
+def upsert_add(model, key_fields: Sequence[str], val_field: str, deltas: dict,
+               returning_inserted: bool = False) -> set[tuple] | None:
+    """
+    Multi-row `INSERT ... ON CONFLICT (key) DO UPDATE SET val = val + EXCLUDED.val`.
+    `deltas` maps a key tuple (or a single key) to the amount to add; keys must
+    match a unique constraint of the table. A model's `updated_at` is set on both paths.
+    With `returning_inserted` the keys of the rows that did not exist yet are returned.
+    """
+    # sorted so concurrent writers lock rows in the same order
+    rows = [(*(k if isinstance(k, tuple) else (k,)), v) for k, v in sorted(deltas.items()) if v]
+    if not rows:
+        return set() if returning_inserted else None
+    table = _table(model)
+    keys = [_col(model, f) for f in key_fields]
+    val = _col(model, val_field)
+    extra, extra_set = [], ""
+    if _has_field(model, 'updated_at'):
+        changed = _col(model, 'updated_at')
+        rows = [r + (_changed_value(model),) for r in rows]
+        extra, extra_set = [changed], f", {changed} = EXCLUDED.{changed}"
+    cols = ", ".join(keys + [val] + extra)
+    one = "(" + ", ".join(["%s"] * (len(keys) + 1 + len(extra))) + ")"
+    # postgres tells fresh rows apart by xmax = 0; elsewhere look them up first
+    use_xmax = returning_inserted and connection.vendor == 'postgresql'
+    inserted = set()
+    if returning_inserted and not use_xmax:
+        existing = _existing_keys(model, key_fields, [r[:len(keys)] for r in rows])
+        inserted = {r[:len(keys)] for r in rows} - existing
+    returning = f" RETURNING {', '.join(keys)}, (xmax = 0)" if use_xmax else ""
+    with connection.cursor() as cur:
+        for chunk in _chunks(rows):
+            cur.execute(
+                f"INSERT INTO {table} ({cols}) VALUES {', '.join([one] * len(chunk))} "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {val} = {table}.{val} + EXCLUDED.{val}"
+                + extra_set + returning,
+                [v for r in chunk for v in r],
+            )
+            if use_xmax:
+                inserted.update(tuple(r[:-1]) for r in cur.fetchall() if r[-1])
+    return inserted if returning_inserted else None
+
+
+def _has_field(model, name: str) -> bool:
+    return any(f.name == name for f in model._meta.concrete_fields)
+
+
+def _changed_value(model):
+    """timezone.now() as the DB stores `updated_at` (raw SQL skips the field's own conversion)."""
+    return model._meta.get_field('updated_at').get_db_prep_save(timezone.now(), connection)
+
+
+def _per_date(keys: set[tuple]) -> dict[datetime.date, int]:
+    """Count (guild_id, date, ...) keys per date."""
+    out: dict[datetime.date, int] = {}
+    for k in keys:
+        out[k[1]] = out.get(k[1], 0) + 1
+    return out
+
+
+def bump_daily(guild_id: str, d: datetime.date, deltas: dict[str, int] | None = None,
+               new_authors: int = 0, new_voice_members: int = 0):
+    """
+    Add counter deltas to a Daily row and keep the distinct-member metrics current:
+    unique_message_members / unique_voice_members grow by the members seen for the
+    first time that day, visitors is the larger of the two and the average follows.
+    """
+    deltas = {f: v for f, v in (deltas or {}).items() if v}
+    if not deltas and not new_authors and not new_voice_members:
+        return
+    upd = {f: F(f) + v for f, v in deltas.items()}
+    authors = F('unique_message_members') + new_authors
+    voice = F('unique_voice_members') + new_voice_members
+    upd['unique_message_members'] = authors
+    upd['unique_voice_members'] = voice
+    upd['visitors'] = Greatest(authors, voice)
+    upd['updated_at'] = timezone.now()
+    upd['avg_messages_per_active_member'] = Coalesce(
+        Cast(F('messages') + deltas.get('messages', 0), FloatField()) / NullIf(authors, 0),
+        Value(0.0),
+    )
+    Daily.objects.filter(guild_id=guild_id, date=d).update(**upd)
+
+
+_counters_seeded: set[tuple[str, str]] = set()
+
+def _seed_counter(guild_id: str, name: str):
+    """Carry over a value kept in KV under the same name before counters existed."""
+    if (guild_id, name) in _counters_seeded:
+        return
+    if guild_id == settings.DEFAULT_GUILD_ID:
+        kv = KV.objects.filter(pk=name).values_list('val', flat=True).first()
+        Counter.objects.bulk_create(
+            [Counter(guild_id=guild_id, name=name, shard=0, value=int(kv or '0'))], ignore_conflicts=True,
+        )
+    # a rolled-back seed must be retried, so remember it only once it is committed
+    transaction.on_commit(lambda: _counters_seeded.add((guild_id, name)))
+
+
+def counter_add(guild_id: str, name: str, by: int = 1):
+    """Atomic, contention-free increment; `by` may be a batched delta."""
+    if not by:
+        return
+    _seed_counter(guild_id, name)
+    upsert_add(Counter, ('guild_id', 'name', 'shard'), 'value',
+               {(guild_id, name, random.randint(1, COUNTER_SHARDS)): by})
+
+
+def counter_get(guild_id: str, name: str) -> int:
+    _seed_counter(guild_id, name)
+    return int(Counter.objects.filter(guild_id=guild_id, name=name).aggregate(v=Sum('value'))['v'] or 0)
+
+
+def bump_version(guild_id: str):
+    """Call inside the transaction of the write, so the new version and the data commit together."""
+    counter_add(guild_id, DATA_VERSION)
+
+
+def data_version(guild_id: str) -> int:
+    return counter_get(guild_id, DATA_VERSION)
+
+
+def insert_missing_channels(guild_id: str, channel_ids: Iterable[str]):
+    ids = sorted({str(c) for c in channel_ids if c})
+    if not ids:
+        return
+    table = _table(VoiceChannel)
+    cols = ", ".join(_col(VoiceChannel, f) for f in ('channel_id', 'guild_id', 'name', 'is_stage'))
+    with connection.cursor() as cur:
+        for chunk in _chunks(ids):
+            cur.execute(
+                f"INSERT INTO {table} ({cols}) VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))} "
+                f"ON CONFLICT ({_col(VoiceChannel, 'channel_id')}) DO NOTHING",
+                [v for cid in chunk for v in (cid, guild_id, '', False)],
+            )
+
+
+def insert_missing_profiles(user_ids: Iterable[str]):
+    """Placeholder parents so counters never fail on the FK; the bot fills them in later."""
+    ids = sorted({str(u) for u in user_ids if u})
+    if ids:
+        UserProfile.objects.bulk_create(
+            [UserProfile(user_id=uid) for uid in ids], batch_size=BATCH_ROWS, ignore_conflicts=True,
+        )
+
+
+def upsert_channels(guild_id: str, rows: list[dict]):
+    """rows of VoiceChannel fields; one multi-row upsert per BATCH_ROWS."""
+    VoiceChannel.objects.bulk_create(
+        [VoiceChannel(guild_id=guild_id, **r) for r in rows], batch_size=BATCH_ROWS,
+        update_conflicts=True, unique_fields=['channel_id'], update_fields=['guild_id', 'name', 'is_stage'],
+    )
+
+
+def ensure_totals(guild_id: str, user_ids: Iterable[str]):
+    ids = sorted(set(user_ids))
+    VoiceUserTotal.objects.bulk_create(
+        [VoiceUserTotal(guild_id=guild_id, user_id=uid) for uid in ids], batch_size=BATCH_ROWS,
+        ignore_conflicts=True,
+    )
+    MessageUserTotal.objects.bulk_create(
+        [MessageUserTotal(guild_id=guild_id, user_id=uid) for uid in ids], batch_size=BATCH_ROWS,
+        ignore_conflicts=True,
+    )
+
+
+def upsert_profiles(guild_id: str, profiles: dict[str, dict]):
+    """user_id -> UserProfile fields; also makes sure the guild's totals rows exist."""
+    if not profiles:
+        return
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=uid, **f) for uid, f in sorted(profiles.items())], batch_size=BATCH_ROWS,
+        update_conflicts=True, unique_fields=['user_id'],
+        update_fields=['username', 'display_name', 'avatar_url', 'joined_at', 'is_bot', 'updated_at'],
+    )
+    ensure_totals(guild_id, profiles)
+
+
+def apply_voice_deltas(guild_id: str, deltas: Iterable[VoiceDelta]):
+    """
+    Apply a batch of voice deltas in one transaction with a fixed number of
+    statements per table, whatever the number of users. Profiles must exist.
+    """
+    user_daily: dict = {}
+    user_total: dict = {}
+    ch_daily: dict = {}
+    ch_total: dict = {}
+    user_ch_daily: dict = {}
+    daily: dict = {}
+    for uid, ch_id, d, sec in deltas:
+        if sec <= 0:
+            continue
+        uid = str(uid)
+        g = guild_id
+        user_daily[(g, d, uid)] = user_daily.get((g, d, uid), 0) + sec
+        user_total[(g, uid)] = user_total.get((g, uid), 0) + sec
+        daily[d] = daily.get(d, 0) + sec
+        if ch_id:
+            ch_id = str(ch_id)
+            ch_daily[(g, d, ch_id)] = ch_daily.get((g, d, ch_id), 0) + sec
+            ch_total[(g, ch_id)] = ch_total.get((g, ch_id), 0) + sec
+            user_ch_daily[(g, d, ch_id, uid)] = user_ch_daily.get((g, d, ch_id, uid), 0) + sec
+    if not daily:
+        return
+
+    with transaction.atomic():
+        insert_missing_profiles(uid for _, uid in user_total)
+        new_members = _per_date(upsert_add(VoiceUserDaily, ('guild_id', 'date', 'user'), 'seconds', user_daily,
+                                           returning_inserted=True))
+        for d, sec in sorted(daily.items()):
+            bump_daily(guild_id, d, {'voice_seconds': sec}, new_voice_members=new_members.get(d, 0))
+        upsert_add(VoiceUserTotal, ('guild_id', 'user'), 'seconds', user_total)
+        insert_missing_channels(guild_id, (ch for _, _, ch in ch_daily))
+        upsert_add(VoiceChannelDaily, ('guild_id', 'date', 'channel'), 'seconds', ch_daily)
+        upsert_add(VoiceChannelTotal, ('guild_id', 'channel'), 'seconds', ch_total)
+        upsert_add(VoiceUserChannelDaily, ('guild_id', 'date', 'channel', 'user'), 'seconds', user_ch_daily)
+
+
+def apply_message_deltas(guild_id: str, d: datetime.date, per_user: dict[str, int],
+                         daily: dict[str, int] | None = None):
+    """Per-user message counts of one day plus the matching Daily deltas."""
+    insert_missing_profiles(per_user)
+    new_authors = upsert_add(MessageUserDaily, ('guild_id', 'date', 'user'), 'messages',
+                             {(guild_id, d, uid): by for uid, by in per_user.items()}, returning_inserted=True)
+    upsert_add(MessageUserTotal, ('guild_id', 'user'), 'messages',
+               {(guild_id, uid): by for uid, by in per_user.items()})
+    bump_daily(guild_id, d, daily, new_authors=len(new_authors))
+
+
+def checkpoint_voice_sessions(guild_id: str, checkpoints: dict[str, tuple[str | None, datetime.datetime]]):
+    """
+    Move last_checkpoint of the open sessions of many users (uid -> (channel_id, checkpoint)),
+    one UPDATE per chunk. A row is only moved forward and only for the same channel, so a
+    checkpoint that lands after a concurrent leave/move cannot touch the next stay.
+    """
+    rows = sorted(checkpoints.items())
+    if not rows:
+        return
+    table = _table(VoiceSession)
+    guild, user, chan, ckpt, ended = (
+        _col(VoiceSession, f) for f in ('guild_id', 'user', 'channel_id', 'last_checkpoint', 'ended_at')
+    )
+    when = f"WHEN {user} = %s AND {chan} = %s AND {ckpt} < %s THEN %s"
+    # raw SQL skips the field's own conversion (aware datetimes, naive on a non-tz backend)
+    prep = VoiceSession._meta.get_field('last_checkpoint').get_db_prep_value
+    with connection.cursor() as cur:
+        for chunk in _chunks(rows):
+            cur.execute(
+                f"UPDATE {table} SET {ckpt} = CASE {' '.join([when] * len(chunk))} ELSE {ckpt} END "
+                f"WHERE {ended} IS NULL AND {guild} = %s AND {user} IN ({', '.join(['%s'] * len(chunk))})",
+                [v for uid, (ch_id, at) in chunk
+                 for v in (uid, ch_id or '', prep(at, connection), prep(at, connection))]
+                + [guild_id] + [uid for uid, _ in chunk],
+            )
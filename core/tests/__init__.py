@@ -0,0 +1 @@
+# DB_ENGINE=sqlite python manage.py test core  (or against postgres with the usual DB_* env)
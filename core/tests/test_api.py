@@ -0,0 +1,126 @@
+import io
+import json
+import datetime
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase
+from django.utils import timezone
+
+from core import rollups, storage
+from core.models import MessageUserDaily, VoiceChannelDaily, VoiceUserDaily
+
+G = 'g1'
+
+
+class ApiTests(TestCase):
+    """The read endpoints over seed_history data, with part of it folded into the rollups."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        call_command('seed_history', users=40, channels=4, days=45, active=0.3, guild=G,
+                     end=str(cls.today), stdout=io.StringIO())
+        rollups.close_days(G, cls.today - datetime.timedelta(days=9))
+        cls.top_user = VoiceUserDaily.objects.filter(guild_id=G).order_by('-seconds')\
+            .values_list('user_id', flat=True).first()
+        cls.top_channel = VoiceChannelDaily.objects.filter(guild_id=G).order_by('-seconds')\
+            .values_list('channel_id', flat=True).first()
+
+    def setUp(self):
+        # responses are cached by data version, which starts over with every test
+        cache.clear()
+
+    def get(self, path, **params):
+        resp = self.client.get(f'/api/{path}', {'guild': G, **params})
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_history_adds_up_the_member_rows(self):
+        days = self.get('history')
+        self.assertEqual(len(days), 45)
+        self.assertEqual(days[0]['date'], str(self.today))
+        voice = dict(VoiceUserDaily.objects.filter(guild_id=G).values('date').annotate(s=Sum('seconds'))
+                     .values_list('date', 's'))
+        msgs = dict(MessageUserDaily.objects.filter(guild_id=G).values('date').annotate(s=Sum('messages'))
+                    .values_list('date', 's'))
+        for r in days:
+            d = datetime.date.fromisoformat(r['date'])
+            self.assertEqual((r['voice_seconds'], r['messages']), (voice.get(d, 0), msgs.get(d, 0)), d)
+        now = self.get('now')
+        self.assertEqual((now['messages_today'], now['members']), (days[0]['messages'], days[0]['members']))
+
+    def test_history_granularities_agree(self):
+        days = self.get('history')
+        for period in rollups.PERIODS:
+            rows = self.get('history', granularity=period)
+            by_period = {}
+            for r in days:
+                s = str(rollups.period_start(period, datetime.date.fromisoformat(r['date'])))
+                by_period.setdefault(s, []).append(r)
+            self.assertEqual([r['date'] for r in rows], sorted(by_period, reverse=True))
+            for r in rows:
+                group = by_period[r['date']]
+                for f in ('messages', 'joins', 'leaves', 'voice_seconds'):
+                    self.assertEqual(r[f], sum(d[f] for d in group), (period, r['date'], f))
+                self.assertEqual(r['days'], len(group))
+                # the newest day of the period
+                self.assertEqual(r['members'], group[0]['members'])
+
+    def test_member_and_channel_history_granularities_agree(self):
+        for path, field in ((f'voice/user/{self.top_user}/history', 'seconds'),
+                            (f'voice/channel/{self.top_channel}/history', 'seconds'),
+                            (f'messages/user/{self.top_user}/history', 'messages')):
+            frm = self.today - datetime.timedelta(days=20)
+            total = sum(r[field] for r in self.get(path))
+            for period in rollups.PERIODS:
+                rows = self.get(path, granularity=period)
+                self.assertEqual(sum(r[field] for r in rows), total, (path, period))
+                # ranged: periods touching the range come back whole
+                self.assertEqual(self.get(path, granularity=period, **{'from': str(frm)}), [
+                    r for r in rows
+                    if rollups.period_end(period, datetime.date.fromisoformat(r['date'])) >= frm
+                ])
+
+    def test_member_totals_match_their_history(self):
+        ids = [self.top_user] + list(MessageUserDaily.objects.filter(guild_id=G)
+                                     .values_list('user_id', flat=True).distinct()[:5])
+        for uid in ids:
+            self.assertEqual(self.get(f'voice/user/{uid}/total')['seconds'],
+                             sum(r['seconds'] for r in self.get(f'voice/user/{uid}/history')))
+            self.assertEqual(self.get(f'messages/user/{uid}/total')['messages'],
+                             sum(r['messages'] for r in self.get(f'messages/user/{uid}/history')))
+
+    def test_users_batch_matches_the_single_endpoints(self):
+        ids = [self.top_user, 'nobody'] + list(VoiceUserDaily.objects.filter(guild_id=G)
+                                                .exclude(user_id=self.top_user).order_by('user_id')
+                                                .values_list('user_id', flat=True).distinct()[:5])
+        frm, to = str(self.today - datetime.timedelta(days=10)), str(self.today - datetime.timedelta(days=3))
+        got = self.get('users/batch', ids=','.join(ids), **{'from': frm, 'to': to})
+        self.assertEqual([u['user_id'] for u in got['users']], ids)
+        for u in got['users']:
+            uid = u['user_id']
+            self.assertEqual(u['total']['voice_seconds'], self.get(f'voice/user/{uid}/total')['seconds'])
+            self.assertEqual(u['total']['messages'], self.get(f'messages/user/{uid}/total')['messages'])
+            self.assertEqual(u['today']['voice_seconds'], self.get(f'voice/user/{uid}/today')['seconds'])
+            hist = self.get(f'voice/user/{uid}/history', **{'from': frm, 'to': to})
+            self.assertEqual(u['range']['voice_seconds'], sum(r['seconds'] for r in hist))
+
+        posted = self.client.post(f'/api/users/batch?guild={G}&from={frm}&to={to}',
+                                  json.dumps({'ids': ids}), content_type='application/json')
+        self.assertEqual(posted.json(), got)
+
+    def test_users_batch_rejects_bad_input(self):
+        self.assertEqual(self.client.get('/api/users/batch', {'ids': 'a', 'from': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/users/batch', 'not json',
+                                          content_type='application/json').status_code, 400)
+
+    def test_etag_until_the_next_write(self):
+        resp = self.client.get('/api/now', {'guild': G})
+        etag = resp['ETag']
+        self.assertEqual(self.client.get('/api/now', {'guild': G}, headers={'if-none-match': etag}).status_code, 304)
+        storage.bump_version(G)
+        resp = self.client.get('/api/now', {'guild': G}, headers={'if-none-match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
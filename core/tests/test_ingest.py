@@ -0,0 +1,142 @@
+import io
+import datetime
+import asyncio
+import unittest
+import contextlib
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+import bot
+from bot import IngestQueue
+from core import storage
+from core.models import UserProfile, VoiceChannel, VoiceSession
+
+
+class IngestQueueTests(unittest.IsolatedAsyncioTestCase):
+    def queue(self, capacity=10, overflow='drop', block_timeout=None):
+        self.ran = []
+        q = IngestQueue(capacity, workers=2, overflow=overflow, block_timeout=block_timeout)
+        q.kind('message', lambda key, n: self.ran.append((key, 'message', n)), combine=lambda a, b: a + b)
+        q.kind('profile', lambda key, p: self.ran.append((key, 'profile', p)), combine=lambda old, new: new)
+        q.kind('voice', lambda key, job: self.ran.append((key, 'voice', job)))
+        return q
+
+    async def test_same_kind_and_key_coalesces(self):
+        q = self.queue()
+        for n in (1, 2, 3):
+            self.assertTrue(await q.put(('g', 'u1'), 'message', n))
+        await q.put(('g', 'u2'), 'message', 5)
+        self.assertEqual((q.depth, q.bounded), (2, 2))
+        self.assertEqual(q.stats['coalesced'], 2)
+        q.start()
+        await q.drain(1)
+        self.assertCountEqual(self.ran, [(('g', 'u1'), 'message', 6), (('g', 'u2'), 'message', 5)])
+        self.assertEqual((q.depth, q.bounded, q.stats['processed']), (0, 0, 2))
+
+    async def test_merged_kinds_run_first_then_ordered_items_in_order(self):
+        q = self.queue()
+        key = ('g', 'u1')
+        await q.put(key, 'voice', 'open')
+        await q.put(key, 'profile', 'old')
+        await q.put(key, 'message', 1)
+        await q.put(key, 'voice', 'close')
+        await q.put(key, 'profile', 'new')
+        q.start()
+        await q.drain(1)
+        self.assertEqual([(kind, v) for _, kind, v in self.ran],
+                         [('message', 1), ('profile', 'new'), ('voice', 'open'), ('voice', 'close')])
+
+    async def test_drop_overflow_only_drops_coalescing_items(self):
+        q = self.queue(capacity=1)
+        self.assertTrue(await q.put(('g', 'u1'), 'message', 1))
+        self.assertFalse(await q.put(('g', 'u2'), 'message', 1))
+        # a pending kind still merges, and ordered items are always admitted
+        self.assertTrue(await q.put(('g', 'u1'), 'message', 1))
+        for i in range(3):
+            self.assertTrue(await q.put(('g', 'u2'), 'voice', i))
+        self.assertEqual(q.stats['dropped'], 1)
+        self.assertEqual((q.depth, q.bounded), (4, 1))
+        q.start()
+        await q.drain(1)
+        self.assertIn((('g', 'u1'), 'message', 2), self.ran)
+        self.assertEqual([v for _, kind, v in self.ran if kind == 'voice'], [0, 1, 2])
+
+    async def test_block_waits_for_space_then_gives_up(self):
+        q = self.queue(capacity=1, overflow='block', block_timeout=0.05)
+        await q.put(('g', 'u1'), 'message', 1)
+        self.assertFalse(await q.put(('g', 'u2'), 'message', 1))
+        self.assertEqual(q.stats['dropped'], 1)
+
+        q.block_timeout = 1
+        waiting = asyncio.create_task(q.put(('g', 'u3'), 'message', 1))
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+        q.start()
+        self.assertTrue(await waiting)
+        await q.drain(1)
+        self.assertEqual({key for key, _, _ in self.ran}, {('g', 'u1'), ('g', 'u3')})
+
+    async def test_failing_item_is_counted_and_the_rest_still_run(self):
+        q = self.queue()
+        q.kind('boom', lambda key, v: 1 / 0)
+        await q.put(('g', 'u1'), 'boom', None)
+        await q.put(('g', 'u1'), 'voice', 'after')
+        q.start()
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            await q.drain(1)
+        self.assertIn('boom', out.getvalue())
+        self.assertEqual(q.stats['errors'], 1)
+        self.assertEqual(self.ran, [(('g', 'u1'), 'voice', 'after')])
+
+
+class _Obj:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class VoiceStateTests(unittest.IsolatedAsyncioTestCase):
+    async def test_join_and_leave_keep_their_order_when_the_queue_is_full(self):
+        q = IngestQueue(1, workers=1, overflow='block')
+        q.kind('profile', lambda key, m: None, combine=lambda old, new: new)
+        q.kind('channel', lambda key, ch: None, combine=lambda old, new: new)
+        q.kind('voice', lambda key, job: None)
+        await q.put(('1', 'other'), 'profile', None)
+
+        guild, ch = _Obj(id=1), _Obj(id=7)
+        member = _Obj(id=7, guild=guild, bot=False)
+        joined, left = _Obj(channel=ch), _Obj(channel=None)
+        with mock.patch.object(bot, 'ingest', q), mock.patch.dict(bot.voice_start, clear=True):
+            join = asyncio.create_task(bot.on_voice_state_update(member, left, joined))
+            await asyncio.sleep(0.01)
+            self.assertIn(('1', '7'), bot.voice_start)
+            leave = asyncio.create_task(bot.on_voice_state_update(member, joined, left))
+            await asyncio.sleep(0.01)
+            self.assertNotIn(('1', '7'), bot.voice_start)
+            # both handlers wait for room, but the ledger items went in first, in order
+            entry = q._parts[0][('1', '7')]
+            self.assertEqual([job[0] for _, job in entry.ordered], [bot.voice_session_open, bot.voice_session_close])
+            join.cancel()
+            leave.cancel()
+
+
+class VoiceLedgerTests(TestCase):
+    def test_open_before_the_profile_upsert(self):
+        at = timezone.now()
+        bot.voice_session_open_sync('1', '7', '70', at)
+        self.assertTrue(UserProfile.objects.filter(user_id='7').exists())
+        self.assertTrue(VoiceChannel.objects.filter(channel_id='70', guild_id='1').exists())
+        self.assertEqual(VoiceSession.objects.get(user_id='7', ended_at__isnull=True).channel_id, '70')
+
+    def test_checkpoint_is_stored_like_the_orm_stores_it(self):
+        at = timezone.now().replace(microsecond=0)
+        bot.voice_session_open_sync('1', '7', '70', at)
+        later = at + datetime.timedelta(seconds=90)
+        storage.checkpoint_voice_sessions('1', {'7': ('70', later)})
+        session = VoiceSession.objects.get(user_id='7', ended_at__isnull=True)
+        self.assertEqual(session.last_checkpoint, later)
+        self.assertTrue(VoiceSession.objects.filter(last_checkpoint=later).exists())
+        # an older checkpoint does not move it back
+        storage.checkpoint_voice_sessions('1', {'7': ('70', at)})
+        self.assertEqual(VoiceSession.objects.get(pk=session.pk).last_checkpoint, later)
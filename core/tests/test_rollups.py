@@ -0,0 +1,116 @@
+import datetime
+
+from django.test import TestCase
+
+from core import rollups
+from core.models import Daily, DailyRollup, UserProfile, VoiceUserDaily, VoiceUserRollup
+
+G = 'g1'
+FIRST = datetime.date(2026, 9, 24)   # a Thursday, so the first week is partial
+DAYS = [FIRST + datetime.timedelta(days=i) for i in range(20)]
+FIELDS = ['members', 'messages', 'voice_seconds', 'days']
+
+
+def _by_hand(period, days=DAYS):
+    out = {}
+    for i, d in enumerate(days):
+        row = out.setdefault(rollups.period_start(period, d), {'messages': 0, 'voice_seconds': 0, 'days': 0})
+        row['messages'] += i + 1
+        row['voice_seconds'] += 60 * (i + 1)
+        row['members'] = 100 + i
+        row['days'] += 1
+    return [{'start': s, **out[s]} for s in sorted(out, reverse=True)]
+
+
+class RollupSeriesTests(TestCase):
+    def setUp(self):
+        UserProfile.objects.create(user_id='u1')
+        for i, d in enumerate(DAYS):
+            Daily.objects.create(guild_id=G, date=d, members=100 + i, messages=i + 1, voice_seconds=60 * (i + 1))
+            if i % 3 == 0:
+                VoiceUserDaily.objects.create(guild_id=G, date=d, user_id='u1', seconds=i + 1)
+
+    def series(self, period, **kw):
+        return rollups.series(
+            DailyRollup.objects.filter(guild_id=G), Daily.objects.filter(guild_id=G), rollups.watermark(G),
+            period, FIELDS, snapshots=('members',), **kw)
+
+    def test_nothing_closed_reads_the_days(self):
+        self.assertEqual(self.series(rollups.WEEK), _by_hand(rollups.WEEK))
+
+    def test_closed_rollups_and_open_days_combine(self):
+        # the watermark falls inside a week and a month, so both are split
+        closed = datetime.date(2026, 10, 7)
+        self.assertEqual(rollups.close_days(G, closed), (closed - FIRST).days + 1)
+        self.assertEqual(rollups.watermark(G), closed)
+        for period in rollups.PERIODS:
+            self.assertEqual(self.series(period), _by_hand(period))
+        self.assertFalse(DailyRollup.objects.filter(guild_id=G, start__gt=closed).exists())
+
+    def test_days_without_a_daily_row(self):
+        gaps = [DAYS[3], DAYS[9], DAYS[10]]
+        Daily.objects.filter(guild_id=G, date__in=gaps).delete()
+        live = {p: self.series(p) for p in rollups.PERIODS}
+        rollups.close_days(G, DAYS[-1])
+        for p in rollups.PERIODS:
+            self.assertEqual(self.series(p), live[p])
+        self.assertEqual(sum(r['days'] for r in live[rollups.WEEK]), len(DAYS) - len(gaps))
+
+    def test_range_returns_overlapping_periods_whole(self):
+        rollups.close_days(G, datetime.date(2026, 10, 1))
+        got = self.series(rollups.WEEK, date_from=datetime.date(2026, 10, 1), date_to=datetime.date(2026, 10, 6))
+        self.assertEqual(got, [r for r in _by_hand(rollups.WEEK)
+                               if r['start'] in (datetime.date(2026, 9, 28), datetime.date(2026, 10, 5))])
+
+    def test_close_days_is_idempotent(self):
+        rollups.close_days(G, datetime.date(2026, 10, 3))
+        self.assertEqual(rollups.close_days(G, datetime.date(2026, 10, 3)), 0)
+        self.assertEqual(self.series(rollups.MONTH), _by_hand(rollups.MONTH))
+
+    def test_user_rollups(self):
+        rollups.close_days(G, datetime.date(2026, 10, 4))
+        got = rollups.series(VoiceUserRollup.objects.filter(guild_id=G, user_id='u1'),
+                             VoiceUserDaily.objects.filter(guild_id=G, user_id='u1'),
+                             rollups.watermark(G), rollups.WEEK, ['seconds'])
+        want = {}
+        for i, d in enumerate(DAYS):
+            if i % 3 == 0:
+                s = rollups.period_start(rollups.WEEK, d)
+                want[s] = want.get(s, 0) + i + 1
+        self.assertEqual(got, [{'start': s, 'seconds': want[s]} for s in sorted(want, reverse=True)])
+
+
+class RefoldTests(TestCase):
+    def setUp(self):
+        for i, d in enumerate(DAYS):
+            Daily.objects.create(guild_id=G, date=d, members=100 + i, messages=i + 1, voice_seconds=60 * (i + 1))
+        self.closed = datetime.date(2026, 10, 7)
+        rollups.close_days(G, self.closed)
+
+    def rows(self):
+        return sorted(DailyRollup.objects.filter(guild_id=G)
+                      .values_list('period', 'start', 'days', 'members', 'messages', 'voice_seconds'))
+
+    def test_late_write_to_a_closed_day(self):
+        Daily.objects.filter(guild_id=G, date=datetime.date(2026, 9, 30)).update(messages=1000)
+        stale = self.rows()
+        # the week of 28 Sep and September
+        self.assertEqual(rollups.refold(G, datetime.date(2026, 9, 30), datetime.date(2026, 9, 30)), 2)
+        refolded = self.rows()
+        self.assertNotEqual(refolded, stale)
+        rollups.clear(G)
+        rollups.close_days(G, self.closed)
+        self.assertEqual(refolded, self.rows())
+
+    def test_open_days_are_left_to_close_days(self):
+        before = self.rows()
+        # the week of 12 Oct has no closed day yet; October does
+        self.assertEqual(rollups.refold(G, datetime.date(2026, 10, 12)), 1)
+        rollups.refold(G, FIRST)
+        self.assertEqual(self.rows(), before)
+        self.assertEqual(rollups.watermark(G), self.closed)
+
+    def test_nothing_closed(self):
+        rollups.clear(G)
+        self.assertEqual(rollups.refold(G, FIRST), 0)
+        self.assertFalse(DailyRollup.objects.exists())
@@ -0,0 +1,138 @@
+import copy
+
+from django.test import SimpleTestCase
+
+from core.sheets import Pivot, _pivot_requests
+
+BASE = ['id', 'name', 'total_hours']
+PIVOT = Pivot('P', BASE, days=None, totals=None, names=lambda ids: {i: f'name-{i}' for i in ids})
+
+
+def _apply(grid, reqs):
+    """Play a batchUpdate on a grid (list of rows), as the Sheets API would; cells outside it fail."""
+    for req in reqs:
+        (op, body), = req.items()
+        if op == 'addSheet':
+            g = body['properties']['gridProperties']
+            grid[:] = [[None] * g['columnCount'] for _ in range(g['rowCount'])]
+        elif op in ('insertDimension', 'deleteDimension'):
+            r = body['range']
+            assert r['dimension'] == 'COLUMNS'
+            for row in grid:
+                if op == 'insertDimension':
+                    assert r['startIndex'] <= len(row)
+                    row[r['startIndex']:r['startIndex']] = [None] * (r['endIndex'] - r['startIndex'])
+                else:
+                    del row[r['startIndex']:r['endIndex']]
+        elif op == 'appendDimension':
+            if body['dimension'] == 'ROWS':
+                grid += [[None] * len(grid[0]) for _ in range(body['length'])]
+            else:
+                for row in grid:
+                    row += [None] * body['length']
+        elif op == 'updateCells':
+            r0, c0 = body['start']['rowIndex'], body['start']['columnIndex']
+            for i, row in enumerate(body['rows']):
+                for j, cell in enumerate(row['values']):
+                    assert r0 + i < len(grid) and c0 + j < len(grid[r0 + i]), (op, r0 + i, c0 + j)
+                    v = cell['userEnteredValue']
+                    grid[r0 + i][c0 + j] = v.get('numberValue', v.get('stringValue'))
+        else:
+            raise AssertionError(op)
+    return grid
+
+
+def _sheet(header, rows, n_rows=10, n_cols=10):
+    """A grid holding `header` and `rows`, and the layout the exporter keeps for it."""
+    grid = [[None] * n_cols for _ in range(n_rows)]
+    for i, row in enumerate([header] + rows):
+        grid[i][:len(row)] = row
+    lay = {'sheet_id': 7, 'header': list(header), 'rows': {r[0]: i + 2 for i, r in enumerate(rows)},
+           'grid': [n_rows, n_cols], 'exists': True, 'header_written': True, 'exported_through': None}
+    return grid, lay
+
+
+def _table(grid):
+    """The filled part of a grid, trailing empty rows and columns cut."""
+    rows = [r for r in grid if any(v is not None for v in r)]
+    width = max((max(i for i, v in enumerate(r) if v is not None) + 1 for r in rows), default=0)
+    return [r[:width] for r in rows]
+
+
+class PivotRequestsTests(SimpleTestCase):
+    def run_export(self, grid, lay, day_maps, totals, max_dates=10):
+        reqs, summary = _pivot_requests(PIVOT, copy.deepcopy(lay), day_maps, totals, max_dates)
+        return _table(_apply(grid, reqs)), reqs, summary
+
+    def test_new_dates_fill_gaps_in_order(self):
+        grid, lay = _sheet(BASE + ['2026-10-01', '2026-10-04'], [
+            ['a', 'A', 3.0, 1.0, 2.0],
+            ['b', 'B', 4.0, 4.0, 0.0],
+        ])
+        table, reqs, summary = self.run_export(grid, lay, {
+            '2026-10-02': {'a': 1.5},
+            '2026-10-03': {'b': 2.0, 'c': 3.0},
+            '2026-10-05': {'a': 0.5},
+        }, {'a': 5.0, 'b': 6.0, 'c': 3.0})
+        self.assertEqual(table, [
+            BASE + ['2026-10-01', '2026-10-02', '2026-10-03', '2026-10-04', '2026-10-05'],
+            ['a', 'A', 5.0, 1.0, 1.5, 0.0, 2.0, 0.5],
+            ['b', 'B', 6.0, 4.0, 0.0, 2.0, 0.0, 0.0],
+            ['c', 'name-c', 3.0, 0.0, 0.0, 3.0, 0.0, 0.0],
+        ])
+        # one insert for the gap between 01 and 04; 05 goes after the last column
+        self.assertEqual([r['insertDimension']['range']['startIndex'] for r in reqs if 'insertDimension' in r], [4])
+        self.assertEqual(summary, {'dates': ['2026-10-02', '2026-10-03', '2026-10-05'], 'skipped': [],
+                                   'values': 4, 'new_rows': 1})
+
+    def test_several_gaps_right_to_left(self):
+        grid, lay = _sheet(BASE + ['2026-10-01', '2026-10-03', '2026-10-06'], [['a', 'A', 1.0, 0.1, 0.3, 0.6]])
+        table, reqs, _ = self.run_export(grid, lay, {'2026-10-02': {'a': 0.2}, '2026-10-04': {'a': 0.4},
+                                                     '2026-10-05': {'a': 0.5}}, {'a': 2.1})
+        self.assertEqual(table, [
+            BASE + ['2026-10-0%d' % d for d in range(1, 7)],
+            ['a', 'A', 2.1, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+        ])
+        inserts = [r['insertDimension']['range'] for r in reqs if 'insertDimension' in r]
+        self.assertEqual([(r['startIndex'], r['endIndex']) for r in inserts], [(5, 7), (4, 5)])
+
+    def test_oldest_dates_are_trimmed(self):
+        grid, lay = _sheet(BASE + ['2026-10-01', '2026-10-02', '2026-10-03'], [['a', 'A', 6.0, 1.0, 2.0, 3.0]],
+                           n_cols=6)
+        table, reqs, _ = self.run_export(grid, lay, {'2026-10-05': {'a': 5.0}, '2026-10-04': {'a': 4.0}},
+                                         {'a': 15.0}, max_dates=3)
+        self.assertEqual(table, [
+            BASE + ['2026-10-03', '2026-10-04', '2026-10-05'],
+            ['a', 'A', 15.0, 3.0, 4.0, 5.0],
+        ])
+        self.assertEqual(sum('deleteDimension' in r for r in reqs), 1)
+
+    def test_a_date_older_than_the_window_is_skipped(self):
+        header = BASE + ['2026-10-02', '2026-10-03', '2026-10-04']
+        grid, lay = _sheet(header, [['a', 'A', 9.0, 2.0, 3.0, 4.0]])
+        table, reqs, summary = self.run_export(grid, lay, {'2026-10-01': {'a': 1.0}}, {'a': 10.0}, max_dates=3)
+        self.assertEqual(summary['skipped'], ['2026-10-01'])
+        self.assertEqual(reqs, [])
+        self.assertEqual(table[0], header)
+
+    def test_rows_and_columns_grow_past_the_grid(self):
+        grid, lay = _sheet(BASE + ['2026-10-01'], [['a', 'A', 1.0, 1.0]], n_rows=2, n_cols=4)
+        table, _, _ = self.run_export(grid, lay, {'2026-10-02': {'a': 1.0, 'b': 2.0, 'c': 3.0}},
+                                      {'a': 2.0, 'b': 2.0, 'c': 3.0})
+        self.assertEqual(table, [
+            BASE + ['2026-10-01', '2026-10-02'],
+            ['a', 'A', 2.0, 1.0, 1.0],
+            ['b', 'name-b', 2.0, 0.0, 2.0],
+            ['c', 'name-c', 3.0, 0.0, 3.0],
+        ])
+
+    def test_new_sheet(self):
+        lay = {'sheet_id': 7, 'header': list(BASE), 'rows': {}, 'grid': [5, 4], 'exists': False,
+               'exported_through': None}
+        table, reqs, _ = self.run_export([], lay, {'2026-10-01': {'b': 1.0, 'a': 2.0}}, {'a': 2.0, 'b': 1.0})
+        self.assertIn('addSheet', reqs[0])
+        self.assertEqual(table, [
+            BASE + ['2026-10-01'],
+            ['a', 'name-a', 2.0, 2.0],
+            ['b', 'name-b', 1.0, 1.0],
+        ])
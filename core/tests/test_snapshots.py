@@ -0,0 +1,124 @@
+import io
+import os
+import shutil
+import datetime
+import tempfile
+from unittest import mock
+
+import openpyxl
+from django.test import SimpleTestCase, TestCase
+from django.utils.http import http_date
+
+from core import snapshots
+from core.models import Daily, MessageUserDaily, UserProfile, MessageUserTotal
+from core.views import _byte_range
+
+G = 'g1'
+THROUGH = datetime.date(2026, 10, 5)
+
+
+class ByteRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        for header, want in [
+            ('bytes=0-99', (0, 99)),
+            ('bytes=10-', (10, 999)),
+            ('bytes=-100', (900, 999)),
+            ('bytes=-5000', (0, 999)),
+            ('bytes=990-5000', (990, 999)),
+            (' bytes=5-5 ', (5, 5)),
+        ]:
+            self.assertEqual(_byte_range(header, 1000), want, header)
+
+    def test_whole_file(self):
+        # no header, a malformed or multi-part one, or last < first: the file is sent whole
+        for header in (None, '', 'bytes=-', 'items=0-5', 'bytes=0-5,10-20', 'bytes=9-3'):
+            self.assertIsNone(_byte_range(header, 1000), header)
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=2000-3000', 'bytes=-0'):
+            with self.assertRaises(ValueError, msg=header):
+                _byte_range(header, 1000)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(snapshots, 'SNAPSHOT_DIR', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.dir)
+        for i in range(10):
+            d = THROUGH - datetime.timedelta(days=6) + datetime.timedelta(days=i)
+            Daily.objects.create(guild_id=G, date=d, members=50 + i, messages=i, voice_seconds=i * 90)
+            UserProfile.objects.get_or_create(user_id=f'u{i % 3}', defaults={'username': f'user{i % 3}'})
+            MessageUserDaily.objects.create(guild_id=G, date=d, user_id=f'u{i % 3}', messages=i + 1)
+            MessageUserTotal.objects.update_or_create(guild_id=G, user_id=f'u{i % 3}')
+        self.snap = snapshots.build(G, THROUGH)
+
+    def get(self, query, **headers):
+        return self.client.get(f'/api/export.xlsx?guild={G}&{query}', headers=headers)
+
+    def body(self, resp) -> bytes:
+        return b''.join(resp.streaming_content) if resp.streaming else resp.content
+
+    def sheets(self, data: bytes):
+        wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+        return {ws.title: [list(r) for r in ws.iter_rows(values_only=True)] for ws in wb}
+
+    def test_default_export_is_snapshot_plus_open_days(self):
+        resp = self.get('')
+        self.assertEqual(resp['X-Snapshot-Through'], THROUGH.isoformat())
+        combined = self.sheets(self.body(resp))
+        live = self.sheets(self.body(self.get('live=1')))
+        self.assertEqual(combined, live)
+        # the days after the snapshot are there
+        self.assertEqual(len(combined['Daily']), 11)
+
+    def test_snapshot_file_with_validators(self):
+        resp = self.get('snapshot=1')
+        data = self.body(resp)
+        with open(self.snap.path, 'rb') as f:
+            self.assertEqual(data, f.read())
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+        self.assertEqual(resp['Content-Length'], str(len(data)))
+        self.assertEqual(self.get('snapshot=1', if_none_match=resp['ETag']).status_code, 304)
+        self.assertEqual(self.get(f'through={THROUGH}').status_code, 200)
+        self.assertEqual(self.get('through=2026-01-01').status_code, 404)
+
+    def test_range_and_if_range(self):
+        full = self.body(self.get('snapshot=1'))
+        etag, size = self.get('snapshot=1')['ETag'], len(full)
+
+        resp = self.get('snapshot=1', range='bytes=100-199')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp['Content-Range'], f'bytes 100-199/{size}')
+        self.assertEqual(self.body(resp), full[100:200])
+
+        # resuming the same file: by ETag or by its Last-Modified date
+        mtime = http_date(int(os.stat(self.snap.path).st_mtime))
+        for validator in (etag, mtime):
+            resp = self.get('snapshot=1', range='bytes=-10', if_range=validator)
+            self.assertEqual((resp.status_code, self.body(resp)), (206, full[-10:]), validator)
+
+        # a different file since: the whole new one
+        resp = self.get('snapshot=1', range='bytes=100-199', if_range='"20260101-0-0"')
+        self.assertEqual((resp.status_code, self.body(resp)), (200, full))
+
+        resp = self.get('snapshot=1', range=f'bytes={size}-')
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp['Content-Range'], f'bytes */{size}')
+
+    def test_prune_keeps_the_newest(self):
+        for i in range(1, 4):
+            snapshots.build(G, THROUGH - datetime.timedelta(days=i))
+        self.assertEqual(len(snapshots.available(G)), 4)
+        removed = snapshots.prune(G, keep=2)
+        self.assertEqual(len(removed), 2)
+        self.assertEqual([s.through for s in snapshots.available(G)],
+                         [THROUGH, THROUGH - datetime.timedelta(days=1)])
+        self.assertEqual(snapshots.latest(G), self.snap)
+
+    def test_bad_guild_id_has_no_snapshots(self):
+        self.assertEqual(snapshots.available('../etc'), [])
+        with self.assertRaises(ValueError):
+            snapshots.build('../etc', THROUGH)
@@ -0,0 +1,99 @@
+import io
+import os
+import datetime
+import tempfile
+import unittest
+import zipfile
+
+import openpyxl
+
+from core import xlsx_stream
+
+ROWS = [
+    ['date', 'user', 'seconds', 'hours', 'bot', 'joined'],
+    *[[datetime.date(2026, 10, 1) + datetime.timedelta(days=i % 7), f'user <{i}> & "co"', i * 60, round(i / 60, 2),
+       i % 2 == 0, datetime.datetime(2026, 1, 2, 3, 4, 5)] for i in range(1, 40)],
+]
+
+
+def _write(sheets, **kw) -> bytes:
+    return b''.join(xlsx_stream.stream(sheets, **kw))
+
+
+def _load(data: bytes):
+    return openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+
+
+def _values(ws):
+    return [list(r) for r in ws.iter_rows(values_only=True)]
+
+
+class StreamTests(unittest.TestCase):
+    def test_openpyxl_reads_it_back(self):
+        data = _write([('Voice', iter(ROWS)), ('Empty', iter([])), ('Odd', iter([['a\x01b', None, '', 1.5]]))],
+                      chunk_rows=7)
+        wb = _load(data)
+        self.assertEqual(wb.sheetnames, ['Voice', 'Empty', 'Odd'])
+        got = _values(wb['Voice'])
+        self.assertEqual(got[0], ROWS[0])
+        for want, row in zip(ROWS[1:], got[1:]):
+            self.assertEqual(row[0].date(), want[0])
+            self.assertEqual(row[1:5], want[1:5])
+            self.assertEqual(row[5], want[5])
+        self.assertEqual(len(got), len(ROWS))
+        self.assertEqual(_values(wb['Odd']), [['ab', None, None, 1.5]])
+
+    def test_rows_are_read_as_the_file_goes_out(self):
+        read = []
+
+        def rows():
+            for r in ROWS:
+                read.append(r)
+                yield r
+
+        chunks = xlsx_stream.stream([('S', rows())], chunk_rows=5)
+        first = next(chunks)
+        self.assertEqual(len(read), 5)
+        self.assertEqual(len(_values(_load(first + b''.join(chunks))['S'])), len(ROWS))
+
+    def test_sheets_have_zip64_headers(self):
+        with zipfile.ZipFile(io.BytesIO(_write([('S', iter(ROWS))]))) as zf:
+            self.assertIsNone(zf.testzip())
+            info = zf.getinfo('xl/worksheets/sheet1.xml')
+            # the local header carries the zip64 extra field (id 0x0001)
+            zf.fp.seek(info.header_offset + 26)
+            name_len, extra_len = int.from_bytes(zf.fp.read(2), 'little'), int.from_bytes(zf.fp.read(2), 'little')
+            zf.fp.seek(name_len, 1)
+            self.assertEqual(zf.fp.read(extra_len)[:2], b'\x01\x00')
+
+    def test_long_titles_are_cut(self):
+        wb = _load(_write([('x' * 40, iter([[1]]))]))
+        self.assertEqual(wb.sheetnames, ['x' * 31])
+
+
+class SheetRowsTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.xlsx')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_write([('Voice', iter(ROWS)), ('Tiny', iter([['only']])), ('None', iter([]))]))
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_titles(self):
+        self.assertEqual(xlsx_stream.sheet_titles(self.path), ['Voice', 'Tiny', 'None'])
+
+    def test_rows_round_trip_whatever_the_block_size(self):
+        want = b''.join(xlsx_stream._row(r) for r in ROWS)
+        for block in (1, 7, 11, 1 << 16):
+            self.assertEqual(b''.join(xlsx_stream.sheet_rows(self.path, 1, block=block)), want)
+        self.assertEqual(b''.join(xlsx_stream.sheet_rows(self.path, 2, block=5)), xlsx_stream._row(['only']))
+        self.assertEqual(list(xlsx_stream.sheet_rows(self.path, 3)), [])
+
+    def test_stored_rows_extend_into_a_new_workbook(self):
+        extra = [[datetime.date(2026, 11, 1), 'late', 1, 0.0, False, None]]
+        data = _write([('Voice', [*xlsx_stream.sheet_rows(self.path, 1, block=13), *extra])])
+        got = _values(_load(data)['Voice'])
+        self.assertEqual(len(got), len(ROWS) + 1)
+        self.assertEqual(got[0], ROWS[0])
+        self.assertEqual(got[-1][1:5], ['late', 1, 0, False])
@@ -10,7 +10,9 @@ urlpatterns = [
 
     # per-channel aggregates
     path('voice/channels/today', views.voice_channels_today),
+    path('voice/channels/total', views.voice_channels_total),
     path('voice/channel/<str:channel_id>/users/today', views.voice_channel_users_today),
+    path('voice/channel/<str:channel_id>/history', views.voice_channel_history),
 
     path('voice/user/<str:user_id>/today', views.voice_user_today),
     path('voice/user/<str:user_id>/history', views.voice_user_history),
@@ -21,5 +23,10 @@ urlpatterns = [
     path('messages/user/<str:user_id>/history', views.messages_user_history),
     path('messages/user/<str:user_id>/total', views.messages_user_total),
 
-    path('export.xlsx', views.export_xlsx)
+    # roster stats: ?ids=1,2,3 or POST {"ids": [...]}
+    path('users/batch', views.users_batch),
+
+    path('export.xlsx', views.export_xlsx),
+    # incremental per-table pulls: ?since=<X-Next-Cursor of the previous pull>
+    path('export/<slug:table>.<slug:fmt>', views.export_table),
 ]
\ No newline at end of file
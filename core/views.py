@@ -1,31 +1,48 @@
+import io
 import os
-from datetime import datetime, timedelta
+import re
+import csv
+import json
+import base64
+import hashlib
+import functools
+from datetime import date, datetime, timedelta
 from typing import Any, Dict, List
 
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
-from django.db.models import Sum, Count
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.db.models import Q, Sum
 from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
 
+from . import rollups, snapshots, xlsx_stream
 from .models import (
-    KV, Daily, UserProfile,
-    VoiceUserDaily, VoiceUserTotal,
-    MessageUserDaily, MessageUserTotal,
-    VoiceChannel, VoiceChannelDaily, VoiceUserChannelDaily,
+    Daily, DailyRollup, UserProfile,
+    VoiceUserDaily, VoiceUserTotal, VoiceUserRollup,
+    MessageUserDaily, MessageUserTotal, MessageUserRollup,
+    VoiceChannel, VoiceChannelDaily, VoiceChannelTotal, VoiceChannelRollup, VoiceUserChannelDaily,
 )
+from .storage import MESSAGES_TOTAL, counter_get, data_version
 
 # ================== helpers ==================
 
 BACKDATE_DAYS = int(os.getenv("BACKDATE_DAYS", "0"))  
+# entries stay valid until the next bot flush anyway; this only bounds idle ones
+API_CACHE_TTL = int(os.getenv("API_CACHE_TTL", "300"))
 
 def _logic_date():
     return timezone.localdate() - timedelta(days=BACKDATE_DAYS)
 
-def _get_total_messages() -> int:
-    try:
-        return int(KV.objects.get(pk="messages_total").val)
-    except KV.DoesNotExist:
-        KV.objects.create(key="messages_total", val="0")
-        return 0
+def _guild(request) -> str:
+    # ?guild=<id> picks the guild; without it, the default one (GUILD_ID)
+    return (request.GET.get("guild") or "").strip() or settings.DEFAULT_GUILD_ID
+
+def _get_total_messages(gid: str) -> int:
+    return counter_get(gid, MESSAGES_TOTAL)
 
 def _profile_map(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
     if not user_ids:
@@ -43,32 +60,147 @@ def _profile_map(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         }
     return d
 
-def _excel_safe(v: Any):
-    if isinstance(v, datetime):
-        return v.replace(tzinfo=None)
+def _versioned(view):
+    """
+    Cache a read endpoint under (path, query, logic date, guild data version) and
+    answer If-None-Match with 304. The bot bumps the version with every write, so a
+    response is reused until the next flush; polling clients mostly get 304s.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        query = "&".join(sorted(request.GET.urlencode().split("&")))
+        # a POSTed body (e.g. a long id list) is part of the request as much as the query
+        body = hashlib.sha1(request.body).hexdigest() if request.method == "POST" else ""
+        raw = f"{request.path}?{query}|{body}|{_logic_date()}|{data_version(_guild(request))}"
+        key = hashlib.sha1(raw.encode()).hexdigest()
+        etag = f'"{key[:24]}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+        hit = cache.get("api:" + key)
+        if hit is not None:
+            resp = HttpResponse(hit[0], content_type=hit[1])
+        else:
+            resp = view(request, *args, **kwargs)
+            if resp.status_code == 200 and not resp.streaming:
+                cache.set("api:" + key, (resp.content, resp["Content-Type"]), API_CACHE_TTL)
+        resp["ETag"] = etag
+        resp["Cache-Control"] = "no-cache"
+        return resp
+    return wrapper
+
+PAGE_MAX = int(os.getenv("API_PAGE_MAX", "1000"))
+
+def _cursor(value: int, user_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{value}:{user_id}".encode()).decode().rstrip("=")
+
+def _parse_cursor(cursor: str) -> tuple[int, str]:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    value, user_id = raw.split(":", 1)
+    return int(value), user_id
+
+def _leaderboard(request, qs, field: str, item):
+    """
+    Per-day ranking by `field` desc, user_id asc. Without ?limit= / ?cursor= every
+    row comes back as a plain list, as before. With them it is keyset paginated
+    ({"total", "items", "next_cursor"}): a page reads `limit` rows off the
+    (guild, date, field desc, user) index and joins profiles for those only.
+    """
+    qs = qs.order_by(f"-{field}", "user_id")
+    limit, cursor = request.GET.get("limit"), request.GET.get("cursor")
+    if not limit and not cursor:
+        rows = list(qs.values("user_id", field))
+        prof = _profile_map([r["user_id"] for r in rows])
+        return JsonResponse([item(r, prof.get(r["user_id"], {})) for r in rows], safe=False)
     try:
-        return v.isoformat()  # type: ignore[attr-defined]
-    except Exception:
-        return v
+        limit = min(max(int(limit or 50), 1), PAGE_MAX)
+        after = _parse_cursor(cursor) if cursor else None
+    except ValueError:
+        return HttpResponseBadRequest("bad limit or cursor")
+    total = qs.count()
+    if after:
+        qs = qs.filter(Q(**{f"{field}__lt": after[0]}) | Q(**{field: after[0], "user_id__gt": after[1]}))
+    rows = list(qs.values("user_id", field)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    prof = _profile_map([r["user_id"] for r in rows])
+    return JsonResponse({
+        "total": total,
+        "items": [item(r, prof.get(r["user_id"], {})) for r in rows],
+        "next_cursor": _cursor(rows[-1][field], rows[-1]["user_id"]) if more else None,
+    })
+
+def _voice_item(r: Dict[str, Any], p: Dict[str, Any]) -> Dict[str, Any]:
+    sec = int(r["seconds"] or 0)
+    return {
+        "user_id": r["user_id"],
+        "username": p.get("username", ""),
+        "display_name": p.get("display_name", ""),
+        "avatar_url": p.get("avatar_url"),
+        "seconds": sec,
+        "hours": round(sec / 3600, 2),
+    }
+
+def _message_item(r: Dict[str, Any], p: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "user_id": r["user_id"],
+        "username": p.get("username", ""),
+        "display_name": p.get("display_name", ""),
+        "avatar_url": p.get("avatar_url"),
+        "messages": int(r["messages"] or 0),
+    }
+
+HISTORY_RANGE_HELP = "from/to: YYYY-MM-DD, granularity: day, week or month"
+
+def _history_range(request):
+    """?from= / ?to= (inclusive) and ?granularity= of the history endpoints; ValueError when malformed."""
+    date_from = request.GET.get("from") or None
+    date_to = request.GET.get("to") or None
+    period = request.GET.get("granularity") or rollups.DAY
+    if period not in (rollups.DAY, *rollups.PERIODS):
+        raise ValueError(period)
+    return (
+        date.fromisoformat(date_from) if date_from else None,
+        date.fromisoformat(date_to) if date_to else None,
+        period,
+    )
+
+def _in_range(qs, date_from, date_to):
+    if date_from:
+        qs = qs.filter(date__gte=date_from)
+    if date_to:
+        qs = qs.filter(date__lte=date_to)
+    return qs
+
+def _series(g: str, period: str, date_from, date_to, field: str, daily_qs, rollup_qs) -> List[Dict[str, Any]]:
+    """A member's or channel's per-day rows, or per week / month from the rollups; newest first, keyed by 'date'."""
+    if period == rollups.DAY:
+        return list(_in_range(daily_qs, date_from, date_to).order_by("-date").values("date", field))
+    return [
+        {"date": r["start"], field: r[field]}
+        for r in rollups.series(rollup_qs, daily_qs, rollups.watermark(g), period, [field], date_from, date_to)
+    ]
 
 # ================== NOW / HISTORY ==================
 
+@_versioned
 def now(request):
     d = _logic_date()
+    g = _guild(request)
     row, _ = Daily.objects.get_or_create(
-        date=d,
+        guild_id=g, date=d,
         defaults={
             "members": 0, "joins": 0, "leaves": 0,
-            "messages": 0, "messages_total": _get_total_messages(),
+            "messages": 0, "messages_total": _get_total_messages(g),
             "voice_seconds": 0,
         },
     )
 
-    active_authors = MessageUserDaily.objects.filter(date=d).values("user_id").distinct().count()
-    active_voice   = VoiceUserDaily.objects.filter(date=d).values("user_id").distinct().count()
-    visitors       = max(active_authors, active_voice)
+    active_authors = int(row.unique_message_members or 0)
+    visitors       = int(row.visitors or 0)
     msgs_today     = int(row.messages or 0)
-    avg_per_active = round(msgs_today / active_authors, 2) if active_authors else 0.0
+    avg_per_active = round(float(row.avg_messages_per_active_member or 0), 2)
 
     return JsonResponse({
         "date": str(d),
@@ -85,75 +217,55 @@ def now(request):
     })
 
 def history(request):
-    rows = list(
-        Daily.objects.order_by("-date").values(
-            "date", "members", "joins", "leaves",
-            "messages", "messages_total", "voice_seconds"
+    g = _guild(request)
+    try:
+        date_from, date_to, period = _history_range(request)
+    except ValueError:
+        return HttpResponseBadRequest(HISTORY_RANGE_HELP)
+    fields = ["members", "joins", "leaves", "messages", "messages_total", "voice_seconds"]
+    if period == rollups.DAY:
+        rows = list(
+            _in_range(Daily.objects.filter(guild_id=g), date_from, date_to)
+            .order_by("-date").values("date", *fields)
         )
-    )
+    else:
+        rows = [
+            {"date": r.pop("start"), "period": period, **r}
+            for r in rollups.series(
+                DailyRollup.objects.filter(guild_id=g), Daily.objects.filter(guild_id=g), rollups.watermark(g),
+                period, fields + ["days"], date_from, date_to, snapshots=("members", "messages_total"),
+            )
+        ]
     for r in rows:
         r["voice_hours"] = round((int(r.get("voice_seconds") or 0)) / 3600, 2)
     return JsonResponse(rows, safe=False)
 
 # ================== VOICE (LISTS) ==================
 
+@_versioned
 def voice_today(request):
-    d = _logic_date()
-    rows = list(
-        VoiceUserDaily.objects.filter(date=d)
-        .order_by("-seconds")
-        .values("user_id", "seconds")
-    )
-    prof = _profile_map([r["user_id"] for r in rows])
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        p = prof.get(r["user_id"], {})
-        sec = int(r["seconds"] or 0)
-        out.append({
-            "user_id": r["user_id"],
-            "username": p.get("username", ""),
-            "display_name": p.get("display_name", ""),
-            "avatar_url": p.get("avatar_url"),
-            "seconds": sec,
-            "hours": round(sec / 3600, 2),
-        })
-    return JsonResponse(out, safe=False)
+    qs = VoiceUserDaily.objects.filter(guild_id=_guild(request), date=_logic_date())
+    return _leaderboard(request, qs, "seconds", _voice_item)
 
 def voice_by_date(request):
     q = request.GET.get("date")
     if not q:
         return HttpResponseBadRequest("date required YYYY-MM-DD")
-    rows = list(
-        VoiceUserDaily.objects.filter(date=q)
-        .order_by("-seconds")
-        .values("user_id", "seconds")
-    )
-    prof = _profile_map([r["user_id"] for r in rows])
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        p = prof.get(r["user_id"], {})
-        sec = int(r["seconds"] or 0)
-        out.append({
-            "user_id": r["user_id"],
-            "username": p.get("username", ""),
-            "display_name": p.get("display_name", ""),
-            "avatar_url": p.get("avatar_url"),
-            "seconds": sec,
-            "hours": round(sec / 3600, 2),
-        })
-    return JsonResponse(out, safe=False)
+    qs = VoiceUserDaily.objects.filter(guild_id=_guild(request), date=q)
+    return _leaderboard(request, qs, "seconds", _voice_item)
 
 # ===== VOICE BY CHANNEL (LISTS) =====
 
+@_versioned
 def voice_channels_today(request):
     d = _logic_date()
     rows = list(
-        VoiceChannelDaily.objects.filter(date=d)
+        VoiceChannelDaily.objects.filter(guild_id=_guild(request), date=d)
         .order_by("-seconds")
         .values("channel_id", "seconds")
     )
     id2name = dict(
-        VoiceChannel.objects.filter(channel_id__in=[r["channel_id"] for r in rows])
+        VoiceChannel.objects.filter(guild_id=_guild(request), channel_id__in=[r["channel_id"] for r in rows])
         .values_list("channel_id", "name")
     )
     out = [{
@@ -164,33 +276,50 @@ def voice_channels_today(request):
     } for r in rows]
     return JsonResponse(out, safe=False)
 
-def voice_channel_users_today(request, channel_id: str):
-    d = _logic_date()
+def voice_channels_total(request):
+    g = _guild(request)
     rows = list(
-        VoiceUserChannelDaily.objects.filter(date=d, channel_id=channel_id)
+        VoiceChannelTotal.objects.filter(guild_id=g)
         .order_by("-seconds")
-        .values("user_id", "seconds")
+        .values("channel_id", "seconds")
     )
-    prof = _profile_map([r["user_id"] for r in rows])
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        p = prof.get(r["user_id"], {})
-        sec = int(r["seconds"] or 0)
-        out.append({
-            "user_id": r["user_id"],
-            "username": p.get("username", ""),
-            "display_name": p.get("display_name", ""),
-            "avatar_url": p.get("avatar_url"),
-            "seconds": sec,
-            "hours": round(sec / 3600, 2),
-        })
+    id2name = dict(
+        VoiceChannel.objects.filter(guild_id=g, channel_id__in=[r["channel_id"] for r in rows])
+        .values_list("channel_id", "name")
+    )
+    out = [{
+        "channel_id": r["channel_id"],
+        "channel_name": id2name.get(r["channel_id"], ""),
+        "seconds": int(r["seconds"] or 0),
+        "hours": round((int(r["seconds"] or 0)) / 3600, 2),
+    } for r in rows]
     return JsonResponse(out, safe=False)
 
+def voice_channel_history(request, channel_id: str):
+    g = _guild(request)
+    try:
+        date_from, date_to, period = _history_range(request)
+    except ValueError:
+        return HttpResponseBadRequest(HISTORY_RANGE_HELP)
+    rows = _series(g, period, date_from, date_to, "seconds",
+                   VoiceChannelDaily.objects.filter(guild_id=g, channel_id=channel_id),
+                   VoiceChannelRollup.objects.filter(guild_id=g, channel_id=channel_id))
+    out = [{
+        "date": str(r["date"]),
+        "seconds": int(r["seconds"] or 0),
+        "hours": round((int(r["seconds"] or 0)) / 3600, 2)
+    } for r in rows]
+    return JsonResponse(out, safe=False)
+
+def voice_channel_users_today(request, channel_id: str):
+    qs = VoiceUserChannelDaily.objects.filter(guild_id=_guild(request), date=_logic_date(), channel_id=channel_id)
+    return _leaderboard(request, qs, "seconds", _voice_item)
+
 # ================== VOICE (BY USER) ==================
 
 def voice_user_today(request, user_id: str):
     d = _logic_date()
-    sec = VoiceUserDaily.objects.filter(date=d, user_id=user_id)\
+    sec = VoiceUserDaily.objects.filter(guild_id=_guild(request), date=d, user_id=user_id)\
         .values_list("seconds", flat=True).first() or 0
     prof = _profile_map([user_id]).get(user_id, {"user_id": user_id})
     return JsonResponse({
@@ -200,11 +329,14 @@ def voice_user_today(request, user_id: str):
     })
 
 def voice_user_history(request, user_id: str):
-    rows = list(
-        VoiceUserDaily.objects.filter(user_id=user_id)
-        .order_by("-date")
-        .values("date", "seconds")
-    )
+    g = _guild(request)
+    try:
+        date_from, date_to, period = _history_range(request)
+    except ValueError:
+        return HttpResponseBadRequest(HISTORY_RANGE_HELP)
+    rows = _series(g, period, date_from, date_to, "seconds",
+                   VoiceUserDaily.objects.filter(guild_id=g, user_id=user_id),
+                   VoiceUserRollup.objects.filter(guild_id=g, user_id=user_id))
     out = [{
         "date": str(r["date"]),
         "seconds": int(r["seconds"] or 0),
@@ -213,7 +345,7 @@ def voice_user_history(request, user_id: str):
     return JsonResponse(out, safe=False)
 
 def voice_user_total(request, user_id: str):
-    tot = VoiceUserTotal.objects.filter(user_id=user_id)\
+    tot = VoiceUserTotal.objects.filter(guild_id=_guild(request), user_id=user_id)\
         .values_list("seconds", flat=True).first() or 0
     return JsonResponse({
         "user_id": user_id,
@@ -223,44 +355,35 @@ def voice_user_total(request, user_id: str):
 
 # ================== MESSAGES ==================
 
+@_versioned
 def messages_users_today(request):
-    d = _logic_date()
-    rows = list(
-        MessageUserDaily.objects.filter(date=d)
-        .order_by("-messages")
-        .values("user_id", "messages")
-    )
-    prof = _profile_map([r["user_id"] for r in rows])
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        p = prof.get(r["user_id"], {})
-        out.append({
-            "user_id": r["user_id"],
-            "username": p.get("username", ""),
-            "display_name": p.get("display_name", ""),
-            "avatar_url": p.get("avatar_url"),
-            "messages": int(r["messages"] or 0),
-        })
-    return JsonResponse(out, safe=False)
+    qs = MessageUserDaily.objects.filter(guild_id=_guild(request), date=_logic_date())
+    return _leaderboard(request, qs, "messages", _message_item)
 
 def messages_user_today(request, user_id: str):
     d = _logic_date()
-    cnt = MessageUserDaily.objects.filter(date=d, user_id=user_id)\
+    cnt = MessageUserDaily.objects.filter(guild_id=_guild(request), date=d, user_id=user_id)\
         .values_list("messages", flat=True).first() or 0
     prof = _profile_map([user_id]).get(user_id, {"user_id": user_id})
     return JsonResponse({"user": prof, "messages": int(cnt)})
 
 def messages_user_history(request, user_id: str):
-    rows = MessageUserDaily.objects.filter(user_id=user_id)\
-        .order_by("-date").values("date", "messages")
+    g = _guild(request)
+    try:
+        date_from, date_to, period = _history_range(request)
+    except ValueError:
+        return HttpResponseBadRequest(HISTORY_RANGE_HELP)
+    rows = _series(g, period, date_from, date_to, "messages",
+                   MessageUserDaily.objects.filter(guild_id=g, user_id=user_id),
+                   MessageUserRollup.objects.filter(guild_id=g, user_id=user_id))
     out = [{"date": str(r["date"]), "messages": int(r["messages"] or 0)} for r in rows]
     return JsonResponse(out, safe=False)
 
 def messages_user_total(request, user_id: str):
-    total = MessageUserTotal.objects.filter(user_id=user_id)\
+    total = MessageUserTotal.objects.filter(guild_id=_guild(request), user_id=user_id)\
         .values_list("messages", flat=True).first()
     if total is None:
-        total = MessageUserDaily.objects.filter(user_id=user_id)\
+        total = MessageUserDaily.objects.filter(guild_id=_guild(request), user_id=user_id)\
             .aggregate(s=Sum("messages"))["s"] or 0
     return JsonResponse({"user_id": user_id, "messages": int(total)})
 
@@ -269,9 +392,9 @@ def messages_user_total(request, user_id: str):
 def user_today(request, user_id: str):
     d = _logic_date()
     prof = _profile_map([user_id]).get(user_id, {"user_id": user_id})
-    voice_sec = VoiceUserDaily.objects.filter(date=d, user_id=user_id)\
+    voice_sec = VoiceUserDaily.objects.filter(guild_id=_guild(request), date=d, user_id=user_id)\
         .values_list("seconds", flat=True).first() or 0
-    msg_cnt = MessageUserDaily.objects.filter(date=d, user_id=user_id)\
+    msg_cnt = MessageUserDaily.objects.filter(guild_id=_guild(request), date=d, user_id=user_id)\
         .values_list("messages", flat=True).first() or 0
     return JsonResponse({
         "user": prof,
@@ -280,8 +403,145 @@ def user_today(request, user_id: str):
         "messages": int(msg_cnt),
     })
 
+# most ids one users/batch call takes
+BATCH_MAX = int(os.getenv("API_BATCH_MAX", "1000"))
+
+def _batch_ids(request) -> List[str]:
+    """?ids=1,2,3 (repeatable), or a POSTed {"ids": [...]} for rosters too long for a URL; ValueError when malformed."""
+    if request.method == "POST":
+        ids = json.loads(request.body or b"{}").get("ids")
+        if not isinstance(ids, list):
+            raise ValueError("ids")
+        ids = [str(i) for i in ids]
+    else:
+        ids = [i for part in request.GET.getlist("ids") for i in part.split(",")]
+    return list(dict.fromkeys(i.strip() for i in ids if i.strip()))
+
+def _by_user(qs, field: str) -> Dict[str, int]:
+    return {u: int(v or 0) for u, v in qs.values_list("user_id", field)}
+
+def _sums_by_user(qs, field: str) -> Dict[str, int]:
+    return {u: int(v or 0) for u, v in qs.values("user_id").annotate(s=Sum(field)).values_list("user_id", "s")}
+
+@csrf_exempt
+@_versioned
+def users_batch(request):
+    """
+    user_today and the voice / messages totals for many members at once: ?ids=
+    (comma-separated) or POST {"ids": [...]}, up to API_BATCH_MAX. With ?from= /
+    ?to= each member also gets the sums over that range. One query per table
+    whatever the number of ids; members are returned in the order asked.
+    """
+    if request.method not in ("GET", "HEAD", "POST"):
+        return HttpResponseBadRequest("GET ?ids= or POST {\"ids\": [...]}")
+    g = _guild(request)
+    d = _logic_date()
+    try:
+        ids = _batch_ids(request)
+        date_from, date_to, _ = _history_range(request)
+    except (ValueError, AttributeError):
+        return HttpResponseBadRequest('ids: ?ids=1,2,3 or POST {"ids": [...]}; from/to: YYYY-MM-DD')
+    if len(ids) > BATCH_MAX:
+        return HttpResponseBadRequest(f"at most {BATCH_MAX} ids per call")
+
+    profiles = _profile_map(ids)
+    voice_today = _by_user(VoiceUserDaily.objects.filter(guild_id=g, date=d, user_id__in=ids), "seconds")
+    msgs_today = _by_user(MessageUserDaily.objects.filter(guild_id=g, date=d, user_id__in=ids), "messages")
+    voice_total = _by_user(VoiceUserTotal.objects.filter(guild_id=g, user_id__in=ids), "seconds")
+    msgs_total = _by_user(MessageUserTotal.objects.filter(guild_id=g, user_id__in=ids), "messages")
+    # members without a total row yet, like messages_user_total does for one
+    missing = [u for u in ids if u not in msgs_total]
+    if missing:
+        msgs_total.update(_sums_by_user(MessageUserDaily.objects.filter(guild_id=g, user_id__in=missing), "messages"))
+    ranged = date_from is not None or date_to is not None
+    if ranged:
+        voice_range = _sums_by_user(
+            _in_range(VoiceUserDaily.objects.filter(guild_id=g, user_id__in=ids), date_from, date_to), "seconds")
+        msgs_range = _sums_by_user(
+            _in_range(MessageUserDaily.objects.filter(guild_id=g, user_id__in=ids), date_from, date_to), "messages")
+
+    def stats(voice: int, messages: int) -> Dict[str, Any]:
+        return {"voice_seconds": voice, "voice_hours": round(voice / 3600, 2), "messages": messages}
+
+    users = []
+    for u in ids:
+        item = {
+            "user_id": u,
+            "user": profiles.get(u, {"user_id": u}),
+            "today": stats(voice_today.get(u, 0), msgs_today.get(u, 0)),
+            "total": stats(voice_total.get(u, 0), msgs_total.get(u, 0)),
+        }
+        if ranged:
+            item["range"] = stats(voice_range.get(u, 0), msgs_range.get(u, 0))
+        users.append(item)
+    out: Dict[str, Any] = {"date": str(d), "users": users}
+    if ranged:
+        out["from"] = str(date_from) if date_from else None
+        out["to"] = str(date_to) if date_to else None
+    return JsonResponse(out)
+
 # ================== EXPORT (XLSX) ==================
 
+def _byte_range(header: str, size: int):
+    """(first, last) of a single 'bytes=' range; None to send everything, ValueError when unsatisfiable."""
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not m or not any(m.groups()):
+        # absent, malformed or several ranges: the whole file, as RFC 9110 allows
+        return None
+    first, last = m.groups()
+    if not first:
+        if int(last) == 0:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    if last and int(last) < int(first):
+        return None
+    if int(first) >= size:
+        raise ValueError(header)
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+def _file_chunks(path: str, first: int, length: int, block: int = 1 << 16):
+    with open(path, "rb") as f:
+        f.seek(first)
+        while length > 0:
+            data = f.read(min(block, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+
+def _snapshot_response(request, snap):
+    """The snapshot file with ETag / Last-Modified, answering conditional and Range requests."""
+    st = os.stat(snap.path)
+    size, mtime = st.st_size, int(st.st_mtime)
+    etag = f'"{snap.through:%Y%m%d}-{st.st_mtime_ns:x}-{size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(mtime),
+        "Accept-Ranges": "bytes",
+        "X-Snapshot-Through": snap.through.isoformat(),
+    }
+    resp = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if resp is None:
+        # If-Range: a client resuming an older copy gets the new file whole
+        if_range = request.headers.get("If-Range")
+        fresh = not if_range or if_range == etag or parse_http_date_safe(if_range) == mtime
+        try:
+            rng = _byte_range(request.headers.get("Range"), size) if fresh else None
+        except ValueError:
+            resp = HttpResponse(status=416)
+            resp["Content-Range"] = f"bytes */{size}"
+            return resp
+        first, last = rng or (0, size - 1)
+        resp = StreamingHttpResponse(_file_chunks(snap.path, first, last - first + 1),
+                                     status=206 if rng else 200, content_type=xlsx_stream.CONTENT_TYPE)
+        resp["Content-Length"] = str(last - first + 1)
+        if rng:
+            resp["Content-Range"] = f"bytes {first}-{last}/{size}"
+        resp["Content-Disposition"] = f'attachment; filename="discord_metrics_through_{snap.through}.xlsx"'
+    for k, v in headers.items():
+        resp[k] = v
+    return resp
+
 def export_xlsx(request):
     """
     Полный исторический экспорт.
@@ -291,87 +551,143 @@ def export_xlsx(request):
       - VoiceUserByChannelDay
       - MessagesByDay
       - Profiles
+    Days up to the newest snapshot the export worker built after the day close are
+    copied from that file, later days are read live (X-Snapshot-Through names the
+    snapshot's last day). ?snapshot=1 serves the snapshot file itself, with ETag /
+    Last-Modified / Range, and ?through= an older one still kept; ?from= exports
+    the days from then on live, ?live=1 everything live.
+    Streamed: bytes go out while the tables are still being read, and memory stays
+    at one chunk of rows. ?stream=0 builds a live file with openpyxl first.
     """
-    from openpyxl import Workbook
-    import io
-
-    wb = Workbook()
-
-    # Daily
-    ws = wb.active
-    ws.title = "Daily"
-    ws.append([
-        "date", "members", "joins", "leaves",
-        "messages", "messages_total", "voice_seconds", "voice_hours",
-        "unique_message_members", "avg_messages_per_active_member",
-    ])
-    authors_per_day = dict(
-        MessageUserDaily.objects
-        .values("date")
-        .annotate(c=Count("user_id", distinct=True))
-        .values_list("date", "c")
-    )
-    for r in Daily.objects.order_by("date").values(
-        "date", "members", "joins", "leaves", "messages", "messages_total", "voice_seconds"
-    ):
-        msgs = int(r["messages"] or 0)
-        authors = int(authors_per_day.get(r["date"], 0) or 0)
-        avg = round(msgs / authors, 2) if authors else 0.0
-        ws.append([
-            _excel_safe(r["date"]),
-            r["members"] or 0, r["joins"] or 0, r["leaves"] or 0,
-            msgs, r["messages_total"] or 0,
-            r["voice_seconds"] or 0, round((int(r["voice_seconds"] or 0)) / 3600, 2),
-            authors, avg
-        ])
-
-    # VoiceByChannelDay
-    ws2 = wb.create_sheet("VoiceByChannelDay")
-    ws2.append(["date", "channel_id", "channel_name", "seconds", "hours"])
-    id2name = dict(VoiceChannel.objects.values_list("channel_id", "name"))
-    for r in VoiceChannelDaily.objects.order_by("date", "channel_id").values("date", "channel_id", "seconds"):
-        sec = int(r["seconds"] or 0)
-        ws2.append([
-            _excel_safe(r["date"]),
-            r["channel_id"], id2name.get(r["channel_id"], ""),
-            sec, round(sec / 3600, 2)
-        ])
-
-    # VoiceUserByChannelDay
-    ws3 = wb.create_sheet("VoiceUserByChannelDay")
-    ws3.append(["date", "channel_id", "channel_name", "user_id", "seconds", "hours"])
-    for r in VoiceUserChannelDaily.objects.order_by("date", "channel_id", "user_id")\
-            .values("date", "channel_id", "user_id", "seconds"):
-        sec = int(r["seconds"] or 0)
-        ws3.append([
-            _excel_safe(r["date"]),
-            r["channel_id"], id2name.get(r["channel_id"], ""),
-            r["user_id"], sec, round(sec / 3600, 2)
-        ])
-
-    # MessagesByDay
-    ws4 = wb.create_sheet("MessagesByDay")
-    ws4.append(["user_id", "date", "messages"])
-    for r in MessageUserDaily.objects.order_by("date", "user_id").values("user_id", "date", "messages"):
-        ws4.append([r["user_id"], _excel_safe(r["date"]), int(r["messages"] or 0)])
-
-    # Profiles
-    ws5 = wb.create_sheet("Profiles")
-    ws5.append(["user_id", "username", "display_name", "avatar_url", "joined_at", "is_bot"])
-    for p in UserProfile.objects.order_by("user_id").values(
-        "user_id", "username", "display_name", "avatar_url", "joined_at", "is_bot"
-    ):
-        ws5.append([
-            p["user_id"], p.get("username") or "", p.get("display_name") or "",
-            p.get("avatar_url") or "", _excel_safe(p.get("joined_at") or ""), bool(p.get("is_bot"))
-        ])
-
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    resp = HttpResponse(
-        bio.getvalue(),
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    g = _guild(request)
+    try:
+        date_from = date.fromisoformat(request.GET["from"]) if request.GET.get("from") else None
+        through = date.fromisoformat(request.GET["through"]) if request.GET.get("through") else None
+    except ValueError:
+        return HttpResponseBadRequest("from/through: YYYY-MM-DD")
+    stream = request.GET.get("stream", "1") != "0"
+    if through or request.GET.get("snapshot") == "1":
+        snap = snapshots.latest(g, through)
+        if snap is None:
+            return JsonResponse({"detail": f"no snapshot through {through}" if through else "no snapshot yet"},
+                                status=404)
+        return _snapshot_response(request, snap)
+    if stream and not date_from and request.GET.get("live") != "1":
+        snap = snapshots.latest(g)
+        sheets = snapshots.with_open_days(snap, g) if snap else None
+        if sheets is not None:
+            resp = StreamingHttpResponse(xlsx_stream.stream(sheets), content_type=xlsx_stream.CONTENT_TYPE)
+            resp["X-Snapshot-Through"] = snap.through.isoformat()
+            resp["Content-Disposition"] = 'attachment; filename="discord_metrics_all.xlsx"'
+            return resp
+
+    sheets = snapshots.workbook(g, date_from=date_from)
+    if stream:
+        resp = StreamingHttpResponse(xlsx_stream.stream(sheets), content_type=xlsx_stream.CONTENT_TYPE)
+    else:
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        for title, rows in sheets:
+            ws = wb.create_sheet(title)
+            for row in rows:
+                ws.append(row)
+        bio = io.BytesIO()
+        wb.save(bio)
+        resp = HttpResponse(bio.getbuffer(), content_type=xlsx_stream.CONTENT_TYPE)
     resp["Content-Disposition"] = 'attachment; filename="discord_metrics_all.xlsx"'
-    return resp
\ No newline at end of file
+    return resp
+
+# ================== EXPORT (incremental tables) ==================
+
+# table -> (model, columns); every row also carries its change marker, updated_at
+EXPORT_TABLES = {
+    "daily": (Daily, [
+        "date", "members", "joins", "leaves", "messages", "messages_total", "voice_seconds",
+        "unique_message_members", "unique_voice_members", "visitors", "avg_messages_per_active_member",
+    ]),
+    "voice_users": (VoiceUserDaily, ["date", "user_id", "seconds"]),
+    "voice_channels": (VoiceChannelDaily, ["date", "channel_id", "seconds"]),
+    "voice_user_channels": (VoiceUserChannelDaily, ["date", "channel_id", "user_id", "seconds"]),
+    "messages": (MessageUserDaily, ["date", "user_id", "messages"]),
+    "profiles": (UserProfile, ["user_id", "username", "display_name", "avatar_url", "joined_at", "is_bot"]),
+}
+
+# rows changed in the last seconds are left for the next pull, so a write that is
+# still committing when a cursor is cut is not skipped
+EXPORT_SETTLE_SECONDS = int(os.getenv("EXPORT_SETTLE_SECONDS", "60"))
+
+def _change_cursor(at: datetime) -> str:
+    return base64.urlsafe_b64encode(f"c1:{at.isoformat()}".encode()).decode().rstrip("=")
+
+def _parse_change_cursor(cursor: str) -> datetime:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    if not raw.startswith("c1:"):
+        raise ValueError(cursor)
+    return datetime.fromisoformat(raw[3:])
+
+def _ndjson(rows) -> Any:
+    buf: List[str] = []
+    for r in rows:
+        buf.append(json.dumps(r, cls=DjangoJSONEncoder))
+        if len(buf) >= 500:
+            yield "\n".join(buf) + "\n"
+            buf = []
+    if buf:
+        yield "\n".join(buf) + "\n"
+
+def _csv(rows, columns: List[str]) -> Any:
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(columns)
+    for n, r in enumerate(rows, 1):
+        w.writerow([_csv_value(r[c]) for c in columns])
+        if n % 500 == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+def _csv_value(v: Any):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+def export_table(request, table: str, fmt: str):
+    """
+    Rows of one table (EXPORT_TABLES) as NDJSON or CSV, streamed. ?since= takes the
+    X-Next-Cursor of the previous pull and limits the rows to those changed after it;
+    without it the whole table comes back. ?from= / ?to= narrow by row date.
+    Deletes are not reported.
+    """
+    spec = EXPORT_TABLES.get(table)
+    if spec is None or fmt not in ("ndjson", "csv"):
+        return HttpResponseBadRequest(f"tables: {', '.join(EXPORT_TABLES)}; formats: ndjson, csv")
+    model, columns = spec
+    columns = columns + ["updated_at"]
+    g = _guild(request)
+    try:
+        since = _parse_change_cursor(request.GET["since"]) if request.GET.get("since") else None
+        date_from, date_to, _ = _history_range(request)
+    except ValueError:
+        return HttpResponseBadRequest("since: a cursor from X-Next-Cursor; from/to: YYYY-MM-DD")
+
+    upto = timezone.now() - timedelta(seconds=EXPORT_SETTLE_SECONDS)
+    if since and since > upto:
+        upto = since
+    qs = model.objects.filter(updated_at__lte=upto)
+    if since:
+        qs = qs.filter(updated_at__gt=since)
+    if model is UserProfile:
+        qs = qs.filter(Q(voiceusertotal__guild_id=g) | Q(messageusertotal__guild_id=g)).distinct()
+    else:
+        qs = _in_range(qs.filter(guild_id=g), date_from, date_to)
+    rows = qs.order_by("updated_at").values(*columns).iterator(chunk_size=snapshots.CHUNK_ROWS)
+
+    if fmt == "csv":
+        resp = StreamingHttpResponse(_csv(rows, columns), content_type="text/csv; charset=utf-8")
+    else:
+        resp = StreamingHttpResponse(_ndjson(rows), content_type="application/x-ndjson")
+    resp["X-Next-Cursor"] = _change_cursor(upto)
+    resp["Content-Disposition"] = f'attachment; filename="{table}.{fmt}"'
+    return resp
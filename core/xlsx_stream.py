@@ -0,0 +1,191 @@
+"""
+Streaming XLSX writer. The workbook is a ZIP of XML parts; here the ZIP is written
+to a sink that hands its bytes back after every few hundred rows, so a response
+can start right away and memory stays at one chunk whatever the row count.
+
+Cells are numbers, booleans, strings (inline, no shared string table), dates and
+naive datetimes. That is all the exports need; there is no other styling.
+A row can also be raw <row> XML (bytes), e.g. read back from an earlier file with
+sheet_rows(), so a stored workbook can be extended without parsing its cells.
+"""
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+import datetime
+from typing import Any, Iterable, Iterator, Sequence
+from xml.sax.saxutils import escape
+
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# rows between two chunks handed to the caller
+CHUNK_ROWS = 500
+
+_EPOCH = datetime.datetime(1899, 12, 30)
+# control characters are not allowed in XML 1.0
+_ILLEGAL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# cellXfs: 0 general, 1 date, 2 date and time
+_STYLES = (
+    _XML + f'<styleSheet xmlns="{_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+class _Sink:
+    """Unseekable file object collecting what zipfile writes until drained."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = b''.join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def _cell(v: Any) -> str:
+    if v is None or v == '':
+        return '<c/>'
+    if isinstance(v, bool):
+        return f'<c t="b"><v>{int(v)}</v></c>'
+    if isinstance(v, (int, float)) and v == v and v not in (float('inf'), float('-inf')):
+        return f'<c><v>{v!r}</v></c>'
+    if isinstance(v, datetime.datetime):
+        if v.tzinfo is not None:
+            v = v.replace(tzinfo=None)
+        return f'<c s="2"><v>{(v - _EPOCH).total_seconds() / 86400!r}</v></c>'
+    if isinstance(v, datetime.date):
+        return f'<c s="1"><v>{(v - _EPOCH.date()).days}</v></c>'
+    text = escape(_ILLEGAL.sub('', str(v)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(values: Sequence[Any]) -> bytes:
+    return ('<row>' + ''.join(_cell(v) for v in values) + '</row>').encode()
+
+
+def _workbook_parts(titles: list[str]) -> dict[str, str]:
+    n = len(titles)
+    sheets = ''.join(
+        f'<sheet name="{escape(t[:31], {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, t in enumerate(titles, 1)
+    )
+    sheet_rels = ''.join(
+        f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, n + 1)
+    )
+    sheet_types = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, n + 1)
+    )
+    return {
+        '[Content_Types].xml': (
+            _XML + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            + sheet_types + '</Types>'
+        ),
+        '_rels/.rels': (
+            _XML + f'<Relationships xmlns="{_PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        ),
+        'xl/workbook.xml': (
+            _XML + f'<workbook xmlns="{_NS}" xmlns:r="{_REL_NS}"><sheets>{sheets}</sheets></workbook>'
+        ),
+        'xl/_rels/workbook.xml.rels': (
+            _XML + f'<Relationships xmlns="{_PKG_REL_NS}">' + sheet_rels
+            + f'<Relationship Id="rId{n + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+            '</Relationships>'
+        ),
+        'xl/styles.xml': _STYLES,
+    }
+
+
+def stream(sheets: list[tuple[str, Iterable[Sequence[Any]]]], chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Yield an XLSX file in chunks. `sheets` is a list of (title, rows); rows are
+    consumed lazily, one sheet after the other, so they can be DB iterators.
+    Bytes rows are written as they are.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, body in _workbook_parts([t for t, _ in sheets]).items():
+            zf.writestr(name, body)
+        for i, (_, rows) in enumerate(sheets, 1):
+            # sizes are unknown up front: zipfile writes a data descriptor after each sheet.
+            # On an unseekable sink it cannot widen the header later, so a sheet past
+            # 2 GiB of XML needs zip64 from the start
+            with zf.open(f'xl/worksheets/sheet{i}.xml', 'w', force_zip64=True) as f:
+                f.write((_XML + f'<worksheet xmlns="{_NS}"><sheetData>').encode())
+                for n, row in enumerate(rows, 1):
+                    raw = isinstance(row, bytes)
+                    f.write(row if raw else _row(row))
+                    if raw or n % chunk_rows == 0:
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+                f.write(b'</sheetData></worksheet>')
+            yield sink.drain()
+    yield sink.drain()
+
+
+def sheet_titles(path: str) -> list[str]:
+    with zipfile.ZipFile(path) as zf:
+        root = ET.fromstring(zf.read('xl/workbook.xml'))
+    return [el.get('name') for el in root.iter(f'{{{_NS}}}sheet')]
+
+
+def sheet_rows(path: str, i: int, block: int = 1 << 16) -> Iterator[bytes]:
+    """The raw <row> elements of sheet `i` (1-based) of a file written by stream(), in blocks."""
+    start, end = b'<sheetData>', b'</sheetData>'
+    with zipfile.ZipFile(path) as zf, zf.open(f'xl/worksheets/sheet{i}.xml') as f:
+        buf = b''
+        while start not in buf:
+            data = f.read(block)
+            if not data:
+                return
+            buf += data
+        buf = buf[buf.index(start) + len(start):]
+        while True:
+            k = buf.find(end)
+            if k >= 0:
+                if k:
+                    yield buf[:k]
+                return
+            data = f.read(block)
+            if not data:
+                raise ValueError(f"sheet{i}.xml in {path} has no end")
+            # hold back enough to spot an end tag split across two reads
+            keep = len(end) - 1
+            if len(buf) > keep:
+                yield buf[:-keep]
+                buf = buf[-keep:]
+            buf += data
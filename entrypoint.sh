@@ -1,9 +1,11 @@
 #!/bin/sh
 set -e
 if [ "$1" = "web" ]; then
-  python manage.py makemigrations core --noinput
   python manage.py migrate --noinput
+  python manage.py createcachetable
   python manage.py runserver 0.0.0.0:8000
 elif [ "$1" = "bot" ]; then
   python bot.py
+elif [ "$1" = "worker" ]; then
+  python manage.py export_worker
 fi
@@ -18,6 +18,7 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True  
+CORS_EXPOSE_HEADERS = ['ETag', 'X-Next-Cursor', 'X-Snapshot-Through']
 ROOT_URLCONF = 'proj.urls'
 WSGI_APPLICATION = 'proj.wsgi.application'
 
@@ -32,6 +33,33 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite: local file DB for benchmarks and quick runs (DB_NAME is the path)
+if os.getenv('DB_ENGINE', 'postgresql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME') or os.path.join(BASE_DIR, 'db.sqlite3'),
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+
+# API response cache (core.views._versioned): API_CACHE=locmem (per process, default),
+# db (table core_api_cache, shared by all web workers), redis (API_CACHE_URL) or none
+API_CACHE = os.getenv('API_CACHE', 'locmem')
+CACHES = {
+    'default': {
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api',
+                   'OPTIONS': {'MAX_ENTRIES': 1000}},
+        'db': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'core_api_cache'},
+        'redis': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                  'LOCATION': os.getenv('API_CACHE_URL', 'redis://127.0.0.1:6379/0')},
+        'none': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    }[API_CACHE]
+}
+
+# guild used for rows without one and by the API when no ?guild= is given
+DEFAULT_GUILD_ID = os.getenv('GUILD_ID', '') or '0'
+
 TIME_ZONE = os.getenv('TZ','UTC')
 USE_TZ = True
 
@@ -0,0 +1,144 @@
+"""
+Load benchmark for the stats HTTP API.
+
+Calls every route in core/urls.py in-process through Django's test client and
+reports latency percentiles, SQL queries and peak Python memory per endpoint.
+Fill the DB first, e.g. `python manage.py seed_history --users 100000 --days 1095`.
+
+    python tools/bench_api.py --repeat 20
+    python tools/bench_api.py --only voice/user --repeat 50 --json
+
+Path parameters are taken from the data: the most active member and channel, and
+the last day with voice activity for ?date=.
+"""
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proj.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.urls import get_resolver  # noqa: E402
+
+from core.models import MessageUserTotal, VoiceChannelDaily, VoiceUserDaily  # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--repeat', type=int, default=10, help='timed calls per endpoint')
+    p.add_argument('--guild', default=None, help='guild id, default GUILD_ID')
+    p.add_argument('--only', default='', help='substring filter on the route')
+    p.add_argument('--skip', default='', help='comma-separated substrings of routes to skip')
+    p.add_argument('--json', action='store_true', help='print the report as JSON')
+    return p.parse_args()
+
+
+def _routes(prefix: str = '', patterns=None):
+    """Yield route strings like 'api/voice/user/<str:user_id>/today' from the URLconf."""
+    for p in patterns if patterns is not None else get_resolver().url_patterns:
+        if hasattr(p, 'url_patterns'):
+            yield from _routes(prefix + str(p.pattern), p.url_patterns)
+        else:
+            yield prefix + str(p.pattern)
+
+
+class _QueryCounter:
+    # an execute wrapper survives the query log reset done at every request start
+    def __init__(self):
+        self.n = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.n += 1
+        return execute(sql, params, many, context)
+
+
+def _pct(xs: list[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(int(len(xs) * q), len(xs) - 1)] if xs else 0.0
+
+
+def _drain(resp) -> int:
+    """Consume a response and return its size; a streamed body is never held whole."""
+    if not resp.streaming:
+        return len(resp.content)
+    n = 0
+    for chunk in resp.streaming_content:
+        n += len(chunk)
+    return n
+
+
+def main():
+    args = parse_args()
+    gid = args.guild or settings.DEFAULT_GUILD_ID
+    top_user = MessageUserTotal.objects.filter(guild_id=gid).order_by('-messages')\
+        .values_list('user_id', flat=True).first() or '0'
+    top_channel = VoiceChannelDaily.objects.filter(guild_id=gid).order_by('-seconds')\
+        .values_list('channel_id', flat=True).first() or '0'
+    last_day = VoiceUserDaily.objects.filter(guild_id=gid).order_by('-date').values_list('date', flat=True).first()
+    params = {'user_id': top_user, 'channel_id': top_channel, 'table': 'voice_users', 'fmt': 'ndjson'}
+    query = {'guild': gid}
+    if last_day:
+        query['date'] = str(last_day)
+
+    skip = [s for s in args.skip.split(',') if s]
+    client = Client()
+    report = []
+    for route in _routes():
+        if args.only not in route or any(s in route for s in skip):
+            continue
+        path = '/' + route
+        path = re.sub(r'<\w+:(\w+)>', lambda m: params.get(m.group(1), m.group(0)), path)
+
+        # one traced call for memory and queries, then untraced timed calls
+        tracemalloc.start()
+        queries = _QueryCounter()
+        with connection.execute_wrapper(queries):
+            resp = client.get(path, query)
+            # for a streamed response the peak is what the view holds, not the body size
+            size = _drain(resp)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            _drain(client.get(path, query))
+            times.append(time.perf_counter() - t0)
+        report.append({
+            'route': route,
+            'status': resp.status_code,
+            'bytes': size,
+            'streamed': resp.streaming,
+            'queries': queries.n,
+            'peak_mb': round(peak / 2 ** 20, 2),
+            'p50_ms': round(_pct(times, 0.50) * 1000, 1),
+            'p95_ms': round(_pct(times, 0.95) * 1000, 1),
+            'p99_ms': round(_pct(times, 0.99) * 1000, 1),
+            'max_ms': round(max(times) * 1000, 1) if times else 0.0,
+        })
+
+    if args.json:
+        print(json.dumps({'db': connection.vendor, 'guild': gid, 'repeat': args.repeat, 'endpoints': report}))
+        return
+    print(f"{connection.vendor}, guild {gid}, {args.repeat} calls per endpoint")
+    print(f"{'route':<52} {'st':>3} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'queries':>7} "
+          f"{'peak MB':>8} {'bytes':>10} {'stream':>6}")
+    for r in report:
+        print(f"{r['route']:<52} {r['status']:>3} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['max_ms']:>8} {r['queries']:>7} {r['peak_mb']:>8} {r['bytes']:>10} "
+              f"{'yes' if r['streamed'] else '':>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Replay synthetic gateway events through the bot's handlers and measure the ingest path.
+
+Drives on_message, on_voice_state_update, on_member_join and the voice flusher of
+bot.py with fake members, messages and voice states, against the configured DB
+(Postgres by default, DB_ENGINE=sqlite DB_NAME=/tmp/bench.sqlite3 for a local file).
+Use a scratch database: tables are created if missing and --reset empties them.
+
+    python tools/bench_ingest.py --users 5000 --events 50000 --voice 0.1
+    python tools/bench_ingest.py --mix message=0.7,voice=0.25,join=0.05 --rate 2000 --json
+
+Reports throughput, p50/p99 handler latency and DB queries per event, so runs on
+different commits can be compared.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import datetime
+import threading
+import subprocess
+from types import SimpleNamespace as NS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--users', type=int, default=2000, help='distinct members per guild')
+    p.add_argument('--guilds', type=int, default=1)
+    p.add_argument('--channels', type=int, default=10, help='voice channels per guild')
+    p.add_argument('--voice', type=float, default=0.1, help='share of members in voice at start')
+    p.add_argument('--events', type=int, default=20000)
+    p.add_argument('--mix', default='message=0.9,voice=0.08,join=0.02',
+                   help='event weights: message, voice (join/move/leave), join')
+    p.add_argument('--rate', type=float, default=0, help='target events/sec, 0 = as fast as possible')
+    p.add_argument('--voice-flush', type=float, default=1.0, help='voice flusher period, seconds')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--reset', action='store_true', help='empty the stats tables first')
+    p.add_argument('--json', action='store_true', help='print the report as one JSON line')
+    return p.parse_args()
+
+
+args = parse_args()
+GUILD_IDS = [900000000000000001 + i for i in range(args.guilds)]
+
+# before bot is imported: it reads these at import time
+os.environ['BOT_NO_RUN'] = '1'
+os.environ['GUILD_IDS'] = ','.join(map(str, GUILD_IDS))
+os.environ.setdefault('METRICS_PORT', '0')
+if os.getenv('DB_ENGINE') == 'sqlite':
+    # one writer at a time anyway; more lanes only add lock waits
+    os.environ.setdefault('BOT_DB_WORKERS', '1')
+sys.path.insert(0, ROOT)
+
+import bot  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+
+# ===== query counting: every connection (one per lane thread) reports here
+_queries = 0
+_queries_lock = threading.Lock()
+
+def _count(execute, sql, params, many, context):
+    global _queries
+    with _queries_lock:
+        _queries += 1
+    return execute(sql, params, many, context)
+
+connection_created.connect(lambda sender, connection, **kw: connection.execute_wrappers.append(_count))
+
+
+# ===== fake gateway objects
+_ids = itertools.count(100000000000000000)
+
+class FakeGuild:
+    def __init__(self, gid: int, users: int, channels: int):
+        self.id = gid
+        self.members = {}
+        self.member_list = []
+        self.channels = [NS(id=next(_ids), name=f'voice-{c}', type='voice') for c in range(channels)]
+        for _ in range(users):
+            self.add_member(next(_ids))
+
+    @property
+    def member_count(self):
+        return len(self.members)
+
+    def add_member(self, uid: int):
+        m = NS(id=uid, name=f'user{uid}', display_name=f'User {uid}', avatar=None, display_avatar=None,
+               joined_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc), bot=False,
+               guild=self, voice=None)
+        self.members[uid] = m
+        self.member_list.append(m)
+        return m
+
+    def get_member(self, uid):
+        return self.members.get(uid)
+
+
+def _pct(xs: list[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(int(len(xs) * q), len(xs) - 1)]
+
+
+async def run() -> dict:
+    rnd = random.Random(args.seed)
+    mix = {k: float(v) for k, v in (kv.split('=') for kv in args.mix.split(','))}
+    kinds, weights = list(mix), list(mix.values())
+
+    guilds = [FakeGuild(gid, args.users, args.channels) for gid in GUILD_IDS]
+    for g in guilds:
+        for m in rnd.sample(g.member_list, int(args.users * args.voice)):
+            m.voice = NS(channel=rnd.choice(g.channels))
+    bot.client.__dict__['guilds'] = guilds
+
+    bot.ingest.start()
+    asyncio.create_task(bot.msg_buffer.run())
+    t_boot = time.monotonic()
+    for g in guilds:
+        await bot._bootstrap_guild(g)
+    boot_ms = (time.monotonic() - t_boot) * 1000
+    flusher = asyncio.create_task(bot._voice_flusher(args.voice_flush))
+
+    global _queries
+    _queries = 0
+    latencies: dict[str, list[float]] = {k: [] for k in kinds}
+    t0 = time.monotonic()
+    for n in range(args.events):
+        if args.rate:
+            delay = t0 + n / args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        kind = rnd.choices(kinds, weights)[0]
+        g = rnd.choice(guilds)
+        m = rnd.choice(g.member_list)
+        h0 = time.perf_counter()
+        if kind == 'message':
+            await bot.on_message(NS(guild=g, author=m))
+        elif kind == 'voice':
+            before = m.voice or NS(channel=None)
+            roll = rnd.random()
+            if before.channel and roll < 0.5:
+                after = NS(channel=None)
+            elif before.channel:
+                after = NS(channel=rnd.choice([c for c in g.channels if c is not before.channel] or g.channels))
+            else:
+                after = NS(channel=rnd.choice(g.channels))
+            m.voice = after if after.channel else None
+            await bot.on_voice_state_update(m, before, after)
+        elif kind == 'join':
+            m = g.add_member(next(_ids))
+            await bot.on_member_join(m)
+        latencies[kind].append(time.perf_counter() - h0)
+    dispatch_s = time.monotonic() - t0
+
+    # drain everything the run produced, as a clean shutdown would
+    await bot.ingest.drain(timeout=600)
+    await bot.msg_buffer.flush()
+    await bot._flush_all_voice()
+    total_s = time.monotonic() - t0
+    flusher.cancel()
+
+    all_lat = [x for xs in latencies.values() for x in xs]
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ''
+    return {
+        'commit': rev,
+        'db': bot.connections['default'].vendor,
+        'events': args.events,
+        'guilds': args.guilds,
+        'users': args.users,
+        'boot_ms': round(boot_ms, 1),
+        'dispatch_eps': round(args.events / dispatch_s, 1),
+        'end_to_end_eps': round(args.events / total_s, 1),
+        'handler_p50_ms': round(_pct(all_lat, 0.50) * 1000, 3),
+        'handler_p99_ms': round(_pct(all_lat, 0.99) * 1000, 3),
+        'by_kind': {k: {'n': len(xs), 'p50_ms': round(_pct(xs, 0.50) * 1000, 3),
+                        'p99_ms': round(_pct(xs, 0.99) * 1000, 3)} for k, xs in latencies.items()},
+        'queries': _queries,
+        'queries_per_event': round(_queries / args.events, 3),
+        'voice_flush_ticks': bot.voice_flush_stats['ticks'],
+        'voice_flush_last_ms': round(bot.voice_flush_stats['last_duration'] * 1000, 1),
+        'ingest': dict(bot.ingest.stats),
+    }
+
+
+def main():
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    if args.reset:
+        from core import models
+        for model in (models.VoiceSession, models.VoiceUserChannelDaily, models.VoiceChannelDaily,
+                      models.VoiceChannelTotal, models.VoiceUserDaily, models.VoiceUserTotal,
+                      models.MessageUserDaily, models.MessageUserTotal, models.VoiceChannel,
+                      models.UserProfile, models.Daily, models.Counter):
+            model.objects.all().delete()
+    report = asyncio.run(run())
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"commit {report['commit'] or '?'} on {report['db']}: {report['events']} events, "
+          f"{report['guilds']} guild(s) x {report['users']} users; bootstrap {report['boot_ms']} ms")
+    print(f"throughput   {report['dispatch_eps']} ev/s dispatched, {report['end_to_end_eps']} ev/s end to end")
+    print(f"handler      p50 {report['handler_p50_ms']} ms, p99 {report['handler_p99_ms']} ms")
+    for k, v in report['by_kind'].items():
+        print(f"  {k:<10} n={v['n']:<8} p50 {v['p50_ms']} ms, p99 {v['p99_ms']} ms")
+    print(f"queries      {report['queries']} total, {report['queries_per_event']} per event")
+    print(f"voice flush  {report['voice_flush_ticks']} ticks, last {report['voice_flush_last_ms']} ms")
+    print(f"ingest       {report['ingest']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Local stand-in for the Google Sheets REST API, enough for the pivot export.
+
+Serves the three calls core.sheets.RestBackend makes (spreadsheet metadata,
+values:batchGet, :batchUpdate with addSheet / appendDimension / insertDimension /
+deleteDimension / updateCells) from an in-memory grid, with optional injected throttling.
+
+    python tools/fake_sheets.py --port 8099 --fail-every 5
+    GS_API_BASE=http://127.0.0.1:8099/v4 GOOGLE_SHEETS_SPREADSHEET_ID=test \\
+        python manage.py export_worker --once
+    curl http://127.0.0.1:8099/_dump/test     # sheet contents as JSON
+"""
+import re
+import copy
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class Spreadsheet:
+    def __init__(self):
+        self.sheets: dict[str, dict] = {}   # title -> {'id', 'rows', 'cols', 'grid': {row: {col: value}}}
+
+    def _by_id(self, sid: int) -> dict:
+        for s in self.sheets.values():
+            if s['id'] == sid:
+                return s
+        raise ValueError(f"No grid with id: {sid}")
+
+    def metadata(self) -> dict:
+        return {'sheets': [{'properties': {
+            'sheetId': s['id'], 'title': t,
+            'gridProperties': {'rowCount': s['rows'], 'columnCount': s['cols']},
+        }} for t, s in self.sheets.items()]}
+
+    def get(self, rng: str) -> dict:
+        m = re.match(r"^'?(.*?)'?!(.*)$", rng)
+        title, a1 = m.group(1).replace("''", "'"), m.group(2)
+        if title not in self.sheets:
+            raise ValueError(f"Unable to parse range: {rng}")
+        grid = self.sheets[title]['grid']
+        if a1 == '1:1':
+            row = grid.get(0, {})
+            values = [[row.get(c, '') for c in range(max(row) + 1)]] if row else []
+        elif a1 == 'A2:A':
+            last = max((r for r, cells in grid.items() if 0 in cells), default=0)
+            values = [[grid.get(r, {}).get(0, '')] for r in range(1, last + 1)]
+        else:
+            raise ValueError(f"range not supported by the fake: {a1}")
+        return {'range': rng, 'majorDimension': 'ROWS', 'values': [[_fmt(v) for v in r] for r in values]}
+
+    def apply(self, req: dict):
+        (kind, body), = req.items()
+        if kind == 'addSheet':
+            p = body['properties']
+            g = p.get('gridProperties', {})
+            self.sheets[p['title']] = {'id': p['sheetId'], 'rows': g.get('rowCount', 1000),
+                                       'cols': g.get('columnCount', 26), 'grid': {}}
+        elif kind == 'appendDimension':
+            s = self._by_id(body['sheetId'])
+            s['rows' if body['dimension'] == 'ROWS' else 'cols'] += body['length']
+        elif kind == 'deleteDimension':
+            r = body['range']
+            s = self._by_id(r['sheetId'])
+            a, b = r['startIndex'], r['endIndex']
+            if r['dimension'] != 'COLUMNS':
+                raise ValueError("only COLUMNS deletes are supported by the fake")
+            for row in s['grid'].values():
+                for c in sorted(row):
+                    if a <= c < b:
+                        del row[c]
+                    elif c >= b:
+                        row[c - (b - a)] = row.pop(c)
+            s['cols'] -= b - a
+        elif kind == 'insertDimension':
+            r = body['range']
+            s = self._by_id(r['sheetId'])
+            a, b = r['startIndex'], r['endIndex']
+            if r['dimension'] != 'COLUMNS':
+                raise ValueError("only COLUMNS inserts are supported by the fake")
+            for row in s['grid'].values():
+                for c in sorted(row, reverse=True):
+                    if c >= a:
+                        row[c + (b - a)] = row.pop(c)
+            s['cols'] += b - a
+        elif kind == 'updateCells':
+            st = body['start']
+            s = self._by_id(st['sheetId'])
+            for i, row in enumerate(body['rows']):
+                r = st['rowIndex'] + i
+                for j, cell in enumerate(row.get('values', [])):
+                    c = st['columnIndex'] + j
+                    if r >= s['rows'] or c >= s['cols']:
+                        raise ValueError(f"Range ({r},{c}) exceeds grid limits of {s['rows']}x{s['cols']}")
+                    v = cell.get('userEnteredValue', {})
+                    s['grid'].setdefault(r, {})[c] = v.get('numberValue', v.get('stringValue', ''))
+        else:
+            raise ValueError(f"request not supported by the fake: {kind}")
+
+    def dump(self) -> dict:
+        out = {}
+        for t, s in self.sheets.items():
+            g = s['grid']
+            width = max((max(r) + 1 for r in g.values() if r), default=0)
+            out[t] = [[g.get(r, {}).get(c, '') for c in range(width)] for r in range(max(g, default=-1) + 1)]
+        return out
+
+
+def _fmt(v):
+    # FORMATTED_VALUE: numbers come back as text, the way the real API returns them
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+class FakeSheets(ThreadingHTTPServer):
+    def __init__(self, addr, fail_every: int = 0, latency: float = 0):
+        super().__init__(addr, Handler)
+        self.books: dict[str, Spreadsheet] = {}
+        self.lock = threading.Lock()
+        self.fail_every = fail_every
+        self.latency = latency
+        self.requests = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: FakeSheets
+
+    def _send(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, headers: dict | None = None):
+        self._send(status, {'error': {'code': status, 'message': message}}, headers)
+
+    def _route(self, method: str):
+        url = urlparse(self.path)
+        path = unquote(url.path)
+        srv = self.server
+        if path.startswith('/_dump/'):
+            book = srv.books.get(path[len('/_dump/'):])
+            return self._send(200, book.dump() if book else {})
+        m = re.match(r'^/v4/spreadsheets/([^/:]+)(/values:batchGet|:batchUpdate)?$', path)
+        if not m:
+            return self._error(404, f"no route for {path}")
+        with srv.lock:
+            srv.requests += 1
+            n = srv.requests
+        if srv.latency:
+            time.sleep(srv.latency)
+        if srv.fail_every and n % srv.fail_every == 0:
+            return self._error(429, "Quota exceeded (injected by fake_sheets)", {'Retry-After': '1'})
+        sid, op = m.group(1), m.group(2)
+        with srv.lock:
+            book = srv.books.setdefault(sid, Spreadsheet())
+            try:
+                if method == 'GET' and op is None:
+                    return self._send(200, book.metadata())
+                if method == 'GET' and op == '/values:batchGet':
+                    ranges = parse_qs(url.query).get('ranges', [])
+                    return self._send(200, {'spreadsheetId': sid, 'valueRanges': [book.get(r) for r in ranges]})
+                if method == 'POST' and op == ':batchUpdate':
+                    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                    # all or nothing, like the real batchUpdate
+                    snapshot = copy.deepcopy(book.sheets)
+                    try:
+                        for req in body.get('requests', []):
+                            book.apply(req)
+                    except Exception:
+                        book.sheets = snapshot
+                        raise
+                    return self._send(200, {'spreadsheetId': sid, 'replies': [{} for _ in body.get('requests', [])]})
+            except ValueError as e:
+                return self._error(400, str(e))
+        return self._error(405, f"{method} not allowed")
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def log_message(self, fmt, *args):
+        print("[FAKE-SHEETS]", fmt % args, flush=True)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8099)
+    p.add_argument('--fail-every', type=int, default=0, help='answer every Nth API request with 429')
+    p.add_argument('--latency', type=float, default=0, help='seconds added to every API request')
+    args = p.parse_args()
+    srv = FakeSheets((args.host, args.port), args.fail_every, args.latency)
+    print(f"[FAKE-SHEETS] listening on http://{args.host}:{args.port}/v4", flush=True)
+    srv.serve_forever()
+
+
+if __name__ == '__main__':
+    main()